@@ -150,6 +150,7 @@ MIDDLEWARE = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'judge.middleware.RequestMemoMiddleware',
     'judge.user_log.LogUserAccessMiddleware',
     'judge.timezone.TimezoneMiddleware',
     'judge.middleware.ContestMiddleware',
@@ -304,7 +305,10 @@ DATABASES = {
     }
 }
 
-ENABLE_FTS = False
+# The file the problem search index is saved to on each host. It must be set for problems to be searched with the
+# index, which is built in the background or with `manage.py warm_caches --search`; until then, and whenever it is
+# not set, problems are searched with substring matches in the database.
+DMOJ_PROBLEM_SEARCH_INDEX = None
 
 # Bridged configuration
 BRIDGED_JUDGE_ADDRESS = [('localhost', 9999)]
@@ -346,6 +350,8 @@ STATICFILES_DIRS = [
 STATIC_URL = '/static/'
 
 # Define a cache
+# To save a round trip per key for the small values read on most requests, put judge.two_tier_cache.TwoTierCache
+# as the default cache in front of the shared one, naming it as the LOCATION; see that module for the options.
 CACHES = {}
 
 # Authentication
@@ -167,7 +167,7 @@ urlpatterns = [
     ])),
 
     url(r'^contests/$', contests.ContestList.as_view(), name='contest_list'),
-    url(r'^contests/(?P<year>\d+)/(?P<month>\d+)/$', contests.ContestCalendar.as_view(), name='contest_calendar'),
+    url(r'^contests/(?P<year>\d+)/(?P<month>\d+)/$', contests.CachedContestCalendar.as_view(), name='contest_calendar'),
     url(r'^contests/tag/(?P<name>[a-z-]+)', include([
         url(r'^$', contests.ContestTagDetail.as_view(), name='contest_tag'),
         url(r'^/ajax$', contests.ContestTagDetailAjax.as_view(), name='contest_tag_ajax'),
@@ -177,6 +177,7 @@ urlpatterns = [
         url(r'^$', contests.ContestDetail.as_view(), name='contest_view'),
         url(r'^/ranking/$', contests.contest_ranking, name='contest_ranking'),
         url(r'^/ranking/ajax$', contests.contest_ranking_ajax, name='contest_ranking_ajax'),
+        url(r'^/ranking/rating-changes$', contests.contest_rating_changes, name='contest_rating_changes'),
         url(r'^/join$', contests.ContestJoin.as_view(), name='contest_join'),
         url(r'^/leave$', contests.ContestLeave.as_view(), name='contest_leave'),
 
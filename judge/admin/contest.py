@@ -2,7 +2,6 @@ from django.conf.urls import url
 from django.contrib import admin
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse_lazy, reverse
-from django.db import transaction, connection
 from django.db.models import TextField, Q
 from django.forms import ModelForm, ModelMultipleChoiceField
 from django.http import HttpResponseRedirect, Http404
@@ -10,8 +9,8 @@ from django.shortcuts import get_object_or_404
 from django.utils.translation import ugettext_lazy as _, ungettext
 from reversion.admin import VersionAdmin
 
-from judge.models import Contest, ContestProblem, Profile, Rating
-from judge.ratings import rate_contest
+from judge.models import Contest, ContestProblem, ContestProblemResult, Profile
+from judge.ratings import rate_contests
 from judge.widgets import HeavySelect2Widget, HeavySelect2MultipleWidget, AdminPagedownWidget, Select2MultipleWidget, \
     HeavyPreviewAdminPageDownWidget, Select2Widget
 
@@ -146,16 +145,7 @@ class ContestAdmin(VersionAdmin):
     def rate_all_view(self, request):
         if not request.user.has_perm('judge.contest_rating'):
             raise PermissionDenied()
-        with transaction.atomic():
-            if connection.vendor == 'sqlite':
-                Rating.objects.all().delete()
-            else:
-                cursor = connection.cursor()
-                cursor.execute('TRUNCATE TABLE `%s`' % Rating._meta.db_table)
-                cursor.close()
-            Profile.objects.update(rating=None)
-            for contest in Contest.objects.filter(is_rated=True).order_by('end_time'):
-                rate_contest(contest)
+        rate_contests()
         return HttpResponseRedirect(reverse('admin:judge_contest_changelist'))
 
     def rate_view(self, request, id):
@@ -164,10 +154,7 @@ class ContestAdmin(VersionAdmin):
         contest = get_object_or_404(Contest, id=id)
         if not contest.is_rated:
             raise Http404()
-        with transaction.atomic():
-            Rating.objects.filter(contest__end_time__gte=contest.end_time).delete()
-            for contest in Contest.objects.filter(is_rated=True, end_time__gte=contest.end_time).order_by('end_time'):
-                rate_contest(contest)
+        rate_contests(since=contest.end_time)
         return HttpResponseRedirect(request.META.get('HTTP_REFERER', reverse('admin:judge_contest_changelist')))
 
     def get_form(self, *args, **kwargs):
@@ -205,6 +192,7 @@ class ContestParticipationAdmin(admin.ModelAdmin):
 
     def recalculate_points(self, request, queryset):
         count = 0
+        ContestProblemResult.rebuild(list(queryset.values_list('id', flat=True)))
         for participation in queryset:
             participation.recalculate_score()
             count += 1
@@ -215,6 +203,7 @@ class ContestParticipationAdmin(admin.ModelAdmin):
 
     def recalculate_cumtime(self, request, queryset):
         count = 0
+        ContestProblemResult.rebuild(list(queryset.values_list('id', flat=True)))
         for participation in queryset:
             participation.update_cumtime()
             count += 1
@@ -12,6 +12,7 @@ from reversion.admin import VersionAdmin
 
 from judge.models import Profile, LanguageLimit, ProblemTranslation, Problem, ProblemClarification
 from judge.models import Solution
+from judge.problem_catalog import invalidate_problem_catalog
 from judge.widgets import HeavySelect2MultipleWidget, Select2MultipleWidget, Select2Widget, \
     HeavyPreviewAdminPageDownWidget, HeavyPreviewPageDownWidget, CheckboxSelectMultipleWithSelectAll
 
@@ -199,6 +200,7 @@ class ProblemAdmin(VersionAdmin):
 
     def make_public(self, request, queryset):
         count = queryset.update(is_public=True)
+        invalidate_problem_catalog()
         self._update_points_many(queryset.values_list('id', flat=True), '+')
         self.message_user(request, ungettext('%d problem successfully marked as public.',
                                              '%d problems successfully marked as public.',
@@ -208,6 +210,7 @@ class ProblemAdmin(VersionAdmin):
 
     def make_private(self, request, queryset):
         count = queryset.update(is_public=False)
+        invalidate_problem_catalog()
         self._update_points_many(queryset.values_list('id', flat=True), '-')
         self.message_user(request, ungettext('%d problem successfully marked as private.',
                                              '%d problems successfully marked as private.',
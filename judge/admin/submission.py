@@ -3,7 +3,6 @@ from operator import itemgetter
 
 from django.conf.urls import url
 from django.contrib import admin, messages
-from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q
 from django.http import HttpResponseRedirect
@@ -12,8 +11,9 @@ from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _, pgettext, ugettext, ungettext
 
 from django_ace import AceWidget
+from judge.caching import bump_generation
 from judge.models import Submission, SubmissionTestCase, ContestSubmission, ContestParticipation, ContestProblem, \
-    Profile
+    ContestProblemResult, Profile, BestResult
 
 
 class SubmissionStatusFilter(admin.SimpleListFilter):
@@ -149,7 +149,7 @@ class SubmissionAdmin(admin.ModelAdmin):
             self.message_user(request, ugettext('You do not have the permission to rejudge submissions.'),
                               level=messages.ERROR)
             return
-        submissions = list(queryset.select_related('problem').only('points', 'case_points', 'case_total',
+        submissions = list(queryset.select_related('problem').only('user', 'points', 'case_points', 'case_total',
                                                                    'problem__partial', 'problem__points'))
         for submission in submissions:
             submission.points = round(submission.case_points / submission.case_total * submission.problem.points
@@ -166,10 +166,16 @@ class SubmissionAdmin(admin.ModelAdmin):
                     contest.points = 0
                 contest.save()
 
+        for user_id, problem_id in {(submission.user_id, submission.problem_id) for submission in submissions}:
+            BestResult.recalculate(user_id, problem_id)
+
         for profile in Profile.objects.filter(id__in=queryset.values_list('user_id', flat=True).distinct()):
             profile.calculate_points()
-            cache.delete('user_complete:%d' % profile.id)
-            cache.delete('user_attempted:%d' % profile.id)
+            bump_generation('solved', profile.id)
+
+        for participation_id, problem_id in set(queryset.filter(contest__isnull=False).values_list(
+                'contest__participation_id', 'contest__problem_id')):
+            ContestProblemResult.recalculate(participation_id, problem_id)
 
         for participation in ContestParticipation.objects.filter(
                 id__in=queryset.values_list('contest__participation_id')):
@@ -7,8 +7,10 @@ from django import db
 from django.utils import timezone
 
 from judge import event_poster as event
-from judge.caching import finished_submission
-from judge.models import Submission, SubmissionTestCase, Problem, Judge, Language, LanguageLimit, RuntimeVersion
+from judge.models import Submission, SubmissionTestCase, Problem, Judge, Language, LanguageLimit, RuntimeVersion, \
+    BestResult, Profile, ContestProblemResult, ProblemActivity
+from judge.scoreboard import update_scoreboard
+from judge.utils.problems import update_solved_problems
 from .judgehandler import JudgeHandler
 
 logger = logging.getLogger('judge.bridge')
@@ -136,6 +138,19 @@ class DjangoJudgeHandler(JudgeHandler):
                 'status': data['status'], 'language': data['language__key'],
             })
 
+    def _update_best_result(self, id):
+        # Only a rejudged submission could have been somebody's best result before failing to grade.
+        try:
+            user_id, problem_id, was_rejudged = (Submission.objects.filter(id=id)
+                                                 .values_list('user_id', 'problem_id', 'was_rejudged').get())
+        except Submission.DoesNotExist:
+            return
+        if was_rejudged:
+            BestResult.recalculate(user_id, problem_id)
+            profile = Profile.objects.get(id=user_id)
+            profile._updating_stats_only = True
+            profile.calculate_points()
+
     def on_submission_processing(self, packet):
         id = packet['submission-id']
         if Submission.objects.filter(id=id).update(status='P', judged_on=self.judge):
@@ -214,6 +229,7 @@ class DjangoJudgeHandler(JudgeHandler):
         if not problem.partial and sub_points != problem.points:
             sub_points = 0
 
+        was_accepted = submission.result == 'AC'
         submission.status = 'D'
         submission.time = time
         submission.memory = memory
@@ -228,10 +244,11 @@ class DjangoJudgeHandler(JudgeHandler):
             problem=problem.code, finish=True
         ))
 
+        result = BestResult.update_from_submission(submission)
         submission.user._updating_stats_only = True
-        submission.user.calculate_points()
-        problem._updating_stats_only = True
-        problem.update_stats()
+        submission.user.update_problem_points(problem, result)
+        Problem.adjust_stats(problem.id, accepted=(submission.result == 'AC') - was_accepted)
+        ProblemActivity.record(problem.id, submission.date, result=submission.result)
 
         if hasattr(submission, 'contest'):
             contest = submission.contest
@@ -239,10 +256,17 @@ class DjangoJudgeHandler(JudgeHandler):
             if not contest.problem.partial and contest.points != contest.problem.points:
                 contest.points = 0
             contest.save()
-            submission.contest.participation.recalculate_score()
-            submission.contest.participation.update_cumtime()
+            ContestProblemResult.update_from_submission(contest, submission.was_rejudged)
+            participation = submission.contest.participation
+            participation._updating_stats_only = True
+            participation.recalculate_score()
+            participation.update_cumtime()
+            update_scoreboard(participation)
+            if participation.virtual == 0 and participation.contest.ended:
+                # The final ranks are stored again by the next request for them.
+                participation.contest.reset_ranks()
 
-        finished_submission(submission)
+        update_solved_problems(submission, result)
 
         event.post('sub_%d' % submission.id, {
             'type': 'grading-end',
@@ -261,6 +285,7 @@ class DjangoJudgeHandler(JudgeHandler):
         super(DjangoJudgeHandler, self).on_compile_error(packet)
 
         if Submission.objects.filter(id=packet['submission-id']).update(status='CE', result='CE', error=packet['log']):
+            self._update_best_result(packet['submission-id'])
             event.post('sub_%d' % packet['submission-id'], {
                 'type': 'compile-error',
                 'log': packet['log']
@@ -289,6 +314,7 @@ class DjangoJudgeHandler(JudgeHandler):
 
         id = packet['submission-id']
         if Submission.objects.filter(id=id).update(status='IE', result='IE', error=packet['message']):
+            self._update_best_result(id)
             event.post('sub_%d' % id, {'type': 'internal-error'})
             self._post_update_submission(id, 'internal-error', done=True)
             json_log.info(self._make_json_log(packet, action='internal-error', message=packet['message'],
@@ -302,6 +328,7 @@ class DjangoJudgeHandler(JudgeHandler):
         super(DjangoJudgeHandler, self).on_submission_terminated(packet)
 
         if Submission.objects.filter(id=packet['submission-id']).update(status='AB', result='AB'):
+            self._update_best_result(packet['submission-id'])
             event.post('sub_%d' % packet['submission-id'], {'type': 'aborted-submission'})
             self._post_update_submission(packet['submission-id'], 'terminated', done=True)
             json_log.info(self._make_json_log(packet, action='aborted', finish=True, result='AB'))
@@ -1,10 +1,150 @@
+import math
+import random
+import time
+from uuid import uuid4
+
 from django.core.cache import cache
 
+__all__ = ['get_generation', 'bump_generation', 'finished_submission', 'cached_computation', 'carry_computation',
+           'start_changes', 'append_change', 'read_changes']
+
+COMPUTATION_LOCK_TIMEOUT = 30
+COMPUTATION_POLL_INTERVAL = 0.05
+
+
+# Everything cached for an object includes the generation of its namespace in the key, so that all of it is
+# invalidated at once by incrementing the generation, however many variants of each key there are. A generation
+# starts from a random number, so that one which was evicted does not start over from a number still in old keys.
+def _generation_key(namespace, id):
+    return 'generation:%s:%s' % (namespace, id)
+
+
+def get_generation(namespace, id):
+    """Returns the generation of the cache namespace of an object, to be included in the keys cached for it."""
+    key = _generation_key(namespace, id)
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid4().int >> 66
+        if not cache.add(key, generation, None):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def bump_generation(namespace, id):
+    """Invalidates everything cached in the namespace of an object, returning the new generation if it is known."""
+    try:
+        return cache.incr(_generation_key(namespace, id))
+    except ValueError:
+        # A missing generation starts afresh when it is next read, which leaves everything cached before behind.
+        return None
+
 
 def finished_submission(sub):
-    keys = ['user_complete:%d' % sub.user_id, 'user_attempted:%s' % sub.user_id]
-    if hasattr(sub, 'contest'):
-        participation = sub.contest.participation
-        keys += ['contest_complete:%d' % participation.id]
-        keys += ['contest_attempted:%d' % participation.id]
-    cache.delete_many(keys)
+    # Covers both the problems completed and attempted by the user and those by their contest participations.
+    bump_generation('solved', sub.user_id)
+
+
+def cached_computation(key, compute, timeout, stale_timeout=300, beta=1.0):
+    """
+    Returns the value cached under key, calling compute to fill it in at most once at a time across all workers.
+
+    Values are recomputed a little before they expire, with a probability that grows as the expiry nears and with
+    how long compute took the last time, scaled by beta. A value is kept for stale_timeout seconds after it
+    expires, so that it can be served while one worker recomputes it. Without a value to serve, the other workers
+    wait for the one recomputing it, up to COMPUTATION_LOCK_TIMEOUT seconds.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires = entry
+        if time.time() - delta * beta * math.log(1 - random.random()) < expires:
+            return value
+
+    lock_key = 'computing:' + key
+    token = uuid4().hex
+    if not cache.add(lock_key, token, COMPUTATION_LOCK_TIMEOUT):
+        if entry is not None:
+            return entry[0]
+        deadline = time.time() + COMPUTATION_LOCK_TIMEOUT
+        while True:
+            time.sleep(COMPUTATION_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+            # Either the worker computing it gave up, or it took too long and we compute it as well.
+            if cache.add(lock_key, token, COMPUTATION_LOCK_TIMEOUT):
+                break
+            if time.time() >= deadline:
+                token = None
+                break
+
+    try:
+        if token is not None:
+            # The worker before us may have stored the value just before we took over the lock.
+            latest = cache.get(key)
+            if latest is not None and (entry is None or latest[2] > entry[2]):
+                return latest[0]
+        start = time.time()
+        value = compute()
+        cache.set(key, (value, time.time() - start, time.time() + timeout), timeout + stale_timeout)
+        return value
+    finally:
+        if token is not None and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def carry_computation(old_key, new_key, update, stale_timeout=300):
+    """
+    Stores the value cached by cached_computation under old_key as changed by update under new_key, unless a value
+    was computed for new_key already, so that a change known in advance does not need a full recomputation.
+    """
+    entry = cache.get(old_key)
+    if entry is None:
+        return
+    value, delta, expires = entry
+    timeout = int(expires - time.time())
+    if timeout > 0:
+        cache.add(new_key, (update(value), delta, expires), timeout + stale_timeout)
+
+
+# A change log lets processes that keep their own copy of something too large to share on every change apply the
+# changes made by the others instead. Every change is numbered by incrementing a counter and stored under its own
+# number, so that changes appended at the same time cannot overwrite each other. A log belongs to a version of
+# what it changes, and is replaced with it.
+def _change_count_key(key, version):
+    return 'changes:%s:%s' % (key, version)
+
+
+def _change_key(key, version, number):
+    return 'changes:%s:%s:%d' % (key, version, number)
+
+
+def start_changes(key, version, timeout):
+    cache.set(_change_count_key(key, version), 0, timeout)
+
+
+def append_change(key, version, change, timeout):
+    """Returns the number of the appended change, counting from 1, or None if the log is gone."""
+    try:
+        number = cache.incr(_change_count_key(key, version))
+    except ValueError:
+        return None
+    cache.set(_change_key(key, version, number), change, timeout)
+    return number
+
+
+def read_changes(key, version, start):
+    """
+    Returns the changes after the first start ones, in order, or None if the log is gone. The changes stop before
+    the first one that is still being written.
+    """
+    count = cache.get(_change_count_key(key, version))
+    if count is None:
+        return None
+    keys = [_change_key(key, version, number) for number in xrange(start + 1, count + 1)]
+    found = cache.get_many(keys) if keys else {}
+    changes = []
+    for change in keys:
+        if change not in found:
+            break
+        changes.append(found[change])
+    return changes
@@ -4,6 +4,7 @@ from django.core.cache import cache
 from django.utils import timezone
 from django.utils.feedgenerator import Atom1Feed
 
+from judge.caching import get_generation
 from judge.jinja2.markdown import markdown
 from judge.models import Comment, BlogPost, Problem
 
@@ -20,7 +21,7 @@ class ProblemFeed(Feed):
         return problem.name
 
     def item_description(self, problem):
-        key = 'problem_feed:%d' % problem.id
+        key = 'problem_feed:%d:%d' % (problem.id, get_generation('problem', problem.id))
         desc = cache.get(key)
         if desc is None:
             desc = unicode(markdown(problem.description, 'problem'))[:500] + '...'
@@ -80,7 +81,7 @@ class BlogFeed(Feed):
         return post.title
 
     def item_description(self, post):
-        key = 'blog_feed:%d' % post.id
+        key = 'blog_feed:%d:%d' % (post.id, get_generation('post', post.id))
         summary = cache.get(key)
         if summary is None:
             summary = unicode(markdown(post.summary or post.content, 'blog'))
@@ -6,6 +6,7 @@ from jinja2.ext import Extension
 from mptt.utils import get_cached_trees
 from statici18n.templatetags.statici18n import inlinei18n
 
+from judge.caching import get_generation
 from judge.highlight_code import highlight_code
 from judge.user_translations import ugettext
 from . import (datetime, filesize, gravatar, language, markdown, rating, reference, render, social, spaceless,
@@ -21,6 +22,7 @@ registry.filter('roundfloat', round)
 registry.function('inlinei18n', inlinei18n)
 registry.function('mptt_tree', get_cached_trees)
 registry.function('user_trans', ugettext)
+registry.function('cache_generation', get_generation)
 
 
 @registry.function
@@ -4,6 +4,7 @@ import socket
 import struct
 
 from django.conf import settings
+from django.db import transaction
 
 from judge import event_poster as event
 
@@ -40,7 +41,7 @@ def judge_request(packet, reply=True):
 
 
 def judge_submission(submission, rejudge):
-    from .models import ContestSubmission, Submission, SubmissionTestCase
+    from .models import ContestSubmission, Problem, ProblemActivity, Submission, SubmissionTestCase
 
     updates = {'time': None, 'memory': None, 'points': None, 'result': None, 'error': None,
                'was_rejudged': rejudge, 'status': 'QU'}
@@ -60,8 +61,19 @@ def judge_submission(submission, rejudge):
     # as that would prevent people from knowing a submission is being scheduled for rejudging.
     # It is worth noting that this mechanism does not prevent a new rejudge from being scheduled
     # while already queued, but that does not lead to data corruption.
-    if not Submission.objects.filter(id=submission.id).exclude(status__in=('P', 'G')).update(**updates):
-        return False
+    # The old result is read under a lock on the row, so that it is taken back from the statistics once even when
+    # two rejudges are queued at the same time: the second one finds it already cleared.
+    with transaction.atomic():
+        row = Submission.objects.select_for_update().filter(id=submission.id).exclude(status__in=('P', 'G')) \
+                                .values_list('result', flat=True)
+        if not row:
+            return False
+        old_result = row[0]
+        Submission.objects.filter(id=submission.id).update(**updates)
+        if old_result == 'AC':
+            Problem.adjust_stats(submission.problem_id, accepted=-1)
+        if old_result is not None:
+            ProblemActivity.record(submission.problem_id, submission.date, result=old_result, count=-1)
 
     SubmissionTestCase.objects.filter(submission_id=submission.id).delete()
 
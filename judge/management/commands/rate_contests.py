@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from judge.models import Contest, Rating
+from judge.ratings import rate_contests
+
+
+class Command(BaseCommand):
+    help = 'rates every rated contest again in order of their end times, replaying them in memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--since', metavar='KEY',
+                            help='only rate the contests that ended at the same time as this one or later')
+        parser.add_argument('-r', '--resume', action='store_true', default=False,
+                            help='continue an interrupted run after the last contest it stored ratings for')
+        parser.add_argument('-b', '--batch-size', type=int, default=50,
+                            help='number of contests to store the ratings of at once')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since'] and options['resume']:
+            raise CommandError('--since and --resume cannot be used together')
+        if options['since']:
+            try:
+                since = Contest.objects.get(key=options['since'], is_rated=True).end_time
+            except Contest.DoesNotExist:
+                raise CommandError('no rated contest with key %s' % options['since'])
+        elif options['resume']:
+            # Runs store whole batches of contests ending at the same time, so every contest that ended by the
+            # last stored rating is done.
+            last = Rating.objects.aggregate(last=Max('contest__end_time'))['last']
+            if last is not None:
+                remaining = Contest.objects.filter(is_rated=True, end_time__gt=last).order_by('end_time')
+                if not remaining.exists():
+                    self.stdout.write('Every rated contest is already rated')
+                    return
+                since = remaining.values_list('end_time', flat=True)[0]
+
+        def progress(done, total):
+            if options['verbosity'] > 0:
+                self.stdout.write('Processed %d/%d contests' % (done, total))
+
+        stored = rate_contests(since, batch_size=options['batch_size'], progress=progress)
+        if options['verbosity'] > 0:
+            self.stdout.write('Stored %d ratings' % stored)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from judge.models import BestResult, Profile, Submission
+
+
+class Command(BaseCommand):
+    help = 'rebuilds the best result of every user on every problem from their submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=500,
+                            help='number of users to process at once')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = list(Profile.objects.order_by('id').values_list('id', flat=True))
+        total = 0
+
+        for start in xrange(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            results = {}
+            for sub in (Submission.objects.filter(user_id__in=batch, points__isnull=False).order_by()
+                        .only('id', 'user', 'problem', 'points', 'case_points', 'case_total', 'time', 'result',
+                              'date')):
+                result = results.get((sub.user_id, sub.problem_id))
+                if result is None:
+                    result = results[sub.user_id, sub.problem_id] = BestResult(user_id=sub.user_id,
+                                                                               problem_id=sub.problem_id)
+                    result.set_best(sub)
+                elif result.is_beaten_by(sub):
+                    result.set_best(sub)
+                if sub.result == 'AC' and (result.first_ac_date is None or sub.date < result.first_ac_date):
+                    result.first_ac_date = sub.date
+
+            with transaction.atomic():
+                BestResult.objects.filter(user_id__in=batch).delete()
+                BestResult.objects.bulk_create(results.values())
+
+            total += len(results)
+            if options['verbosity'] > 0:
+                self.stdout.write('Processed %d/%d users, %d results' %
+                                  (min(start + batch_size, len(user_ids)), len(user_ids), total))
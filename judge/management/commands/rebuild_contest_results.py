@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from judge.models import ContestParticipation, ContestProblemResult
+
+
+class Command(BaseCommand):
+    help = 'rebuilds the best result of every contest participation on every contest problem'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                            help='number of participations to process at once')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        participation_ids = list(ContestParticipation.objects.order_by('id').values_list('id', flat=True))
+
+        for start in xrange(0, len(participation_ids), batch_size):
+            ContestProblemResult.rebuild(participation_ids[start:start + batch_size])
+            if options['verbosity'] > 0:
+                self.stdout.write('Processed %d/%d participations' %
+                                  (min(start + batch_size, len(participation_ids)), len(participation_ids)))
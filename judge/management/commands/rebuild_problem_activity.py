@@ -0,0 +1,44 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from judge.models import ProblemActivity, Submission
+from judge.utils.hyperloglog import hll_add, hll_empty
+
+
+class Command(BaseCommand):
+    help = 'rebuilds the hourly problem activity used to find hot problems from recent submissions, ' \
+           'and drops the activity older than that'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-d', '--days', type=int,
+                            default=getattr(settings, 'DMOJ_PROBLEM_ACTIVITY_DAYS', 7),
+                            help='number of days of activity to keep')
+        parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                            help='number of rows to store at once')
+
+    def handle(self, *args, **options):
+        since = ProblemActivity.hour_of(timezone.now() - timedelta(days=options['days']))
+
+        activity = defaultdict(lambda: [hll_empty(), 0, 0])
+        for problem, user, date, result in (Submission.objects.filter(date__gte=since)
+                                            .values_list('problem_id', 'user_id', 'date', 'result').iterator()):
+            hour = activity[problem, ProblemActivity.hour_of(date)]
+            hour[0] = hll_add(hour[0], user) or hour[0]
+            if result in ProblemActivity.VOLUME_RESULTS:
+                hour[1] += 1
+                hour[2] += result == 'AC'
+
+        rows = [ProblemActivity(problem_id=problem, hour=hour, users=users, volume=volume, ac_count=ac_count)
+                for (problem, hour), (users, volume, ac_count) in activity.iteritems()]
+        with transaction.atomic():
+            ProblemActivity.objects.all().delete()
+            for start in xrange(0, len(rows), options['batch_size']):
+                ProblemActivity.objects.bulk_create(rows[start:start + options['batch_size']])
+                if options['verbosity'] > 0:
+                    self.stdout.write('Processed %d/%d hours of problem activity' %
+                                      (min(start + options['batch_size'], len(rows)), len(rows)))
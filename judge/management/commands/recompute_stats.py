@@ -0,0 +1,123 @@
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Case, Value, When
+
+from judge.models import ContestParticipation, Organization, Problem, Profile
+from judge.performance_points import PerformancePointsTable
+from judge.rank_index import invalidate_rank_index
+from judge.utils.recompute import PARTICIPATION_FIELDS, PROBLEM_FIELDS, PROFILE_FIELDS, participation_stats, \
+    problem_stats, profile_stats
+
+SECTIONS = {
+    'profiles': (Profile, PROFILE_FIELDS, profile_stats),
+    'problems': (Problem, PROBLEM_FIELDS, problem_stats),
+    'participations': (ContestParticipation, PARTICIPATION_FIELDS, participation_stats),
+}
+
+
+def differs(old, new):
+    if isinstance(new, float):
+        return abs(old - new) > 1e-6
+    return old != new
+
+
+def recompute_chunk(args):
+    section, ids, dry_run = args
+    model, fields, compute = SECTIONS[section]
+    changes = []
+    with transaction.atomic():
+        rows = model.objects.filter(id__in=ids).order_by('id')
+        if not dry_run:
+            # Lock the rows before counting, so that grading in the meantime waits and then moves the recomputed
+            # values, instead of being overwritten by values counted before it.
+            rows = rows.select_for_update()
+        rows = list(rows.values_list('id', *fields))
+        expected = compute(ids)
+        for row in rows:
+            id, current = row[0], row[1:]
+            if any(differs(old, new) for old, new in zip(current, expected[id])):
+                changes.append((id, current, expected[id]))
+        if changes and not dry_run:
+            model.objects.filter(id__in=[id for id, old, new in changes]).update(**{
+                field: Case(*[When(id=id, then=Value(new[index])) for id, old, new in changes],
+                            output_field=model._meta.get_field(field))
+                for index, field in enumerate(fields)
+            })
+    if section == 'profiles' and not dry_run:
+        PerformancePointsTable.invalidate(ids)
+        if changes:
+            invalidate_rank_index('performance_points', 'points', 'problem_count')
+            for organization in Organization.objects.values_list('id', flat=True):
+                invalidate_rank_index('performance_points', organization=organization)
+    return section, len(ids), changes
+
+
+def close_connections():
+    # Forked workers must not share the parent's database connections.
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'recomputes the points of profiles, the statistics of problems and the scores of contest ' \
+           'participations directly from submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', action='store_true', default=False,
+                            help='recompute profile points and performance points')
+        parser.add_argument('--problems', action='store_true', default=False,
+                            help='recompute problem submission statistics')
+        parser.add_argument('--participations', action='store_true', default=False,
+                            help='recompute contest participation scores and cumulative times')
+        parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                            help='number of rows to recompute at once')
+        parser.add_argument('-j', '--workers', type=int, default=1,
+                            help='number of worker processes')
+        parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+                            help='only show what would change')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        sections = [section for section in ('profiles', 'problems', 'participations') if options[section]] or \
+            ['profiles', 'problems', 'participations']
+        verbosity = options['verbosity']
+
+        chunks = []
+        totals = {}
+        for section in sections:
+            ids = list(SECTIONS[section][0].objects.order_by('id').values_list('id', flat=True))
+            totals[section] = len(ids)
+            chunks += [(section, ids[start:start + batch_size], options['dry_run'])
+                       for start in xrange(0, len(ids), batch_size)]
+
+        if options['workers'] > 1:
+            close_connections()
+            pool = Pool(options['workers'], initializer=close_connections)
+            results = pool.imap_unordered(recompute_chunk, chunks)
+        else:
+            pool = None
+            results = (recompute_chunk(chunk) for chunk in chunks)
+
+        done = dict.fromkeys(sections, 0)
+        changed = dict.fromkeys(sections, 0)
+        try:
+            for section, count, changes in results:
+                done[section] += count
+                changed[section] += len(changes)
+                if verbosity > 1:
+                    fields = SECTIONS[section][1]
+                    for id, old, new in changes:
+                        self.stdout.write('%s %d: %s' % (section, id, ', '.join(
+                            '%s %s -> %s' % (field, a, b) for field, a, b in zip(fields, old, new) if differs(a, b)
+                        )))
+                if verbosity > 0:
+                    self.stdout.write('Processed %d/%d %s, %d changed' %
+                                      (done[section], totals[section], section, changed[section]))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if options['dry_run'] and verbosity > 0:
+            self.stdout.write('Dry run, nothing was saved')
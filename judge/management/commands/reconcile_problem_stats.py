@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from judge.models import Problem
+from judge.utils.recompute import problem_stats
+
+
+class Command(BaseCommand):
+    help = 'recounts the submission statistics of every problem and fixes counters that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                            help='number of problems to process at once')
+        parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+                            help='only report the problems that have drifted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        problem_ids = list(Problem.objects.order_by('id').values_list('id', flat=True))
+        drifted = 0
+
+        for start in xrange(0, len(problem_ids), batch_size):
+            batch = problem_ids[start:start + batch_size]
+            with transaction.atomic():
+                # Lock the rows first, so that counter updates made while counting are applied on top of the
+                # recounted values instead of being overwritten by them.
+                stored = {id: (code, (submissions, accepted, users)) for id, code, submissions, accepted, users in
+                          Problem.objects.select_for_update().filter(id__in=batch)
+                                 .values_list('id', 'code', 'submission_count', 'ac_count', 'user_count')}
+
+                counts = problem_stats(batch)
+
+                for id, (code, current) in stored.iteritems():
+                    submissions, accepted, users, ac_rate = counts[id]
+                    expected = submissions, accepted, users
+                    if current == expected:
+                        continue
+                    drifted += 1
+                    if options['verbosity'] > 1:
+                        self.stdout.write('%s: submissions %d -> %d, accepted %d -> %d, users %d -> %d' %
+                                          ((code,) + sum(zip(current, expected), ())))
+                    if not dry_run:
+                        Problem.objects.filter(id=id).update(submission_count=submissions, ac_count=accepted,
+                                                             user_count=users, ac_rate=ac_rate)
+
+            if options['verbosity'] > 0:
+                self.stdout.write('Processed %d/%d problems, %d drifted' %
+                                  (min(start + batch_size, len(problem_ids)), len(problem_ids), drifted))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from judge.models import Contest
+
+
+class Command(BaseCommand):
+    help = 'stores the final ranks of the participations of ended contests, meant to be run periodically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('contests', nargs='*', help='keys of the contests to rank, instead of the unranked ones')
+        parser.add_argument('-a', '--all', action='store_true', default=False,
+                            help='rank every ended contest again')
+
+    def handle(self, *args, **options):
+        contests = Contest.objects.filter(end_time__lt=timezone.now()).order_by('end_time')
+        if options['contests']:
+            contests = contests.filter(key__in=options['contests'])
+        elif not options['all']:
+            contests = contests.filter(users__virtual=0, users__rank__isnull=True).distinct()
+
+        contests = list(contests.only('id', 'key'))
+        for index, contest in enumerate(contests, 1):
+            changed = contest.update_ranks()
+            if options['verbosity'] > 0:
+                self.stdout.write('Processed %d/%d contests, %s: %d ranks changed' %
+                                  (index, len(contests), contest.key, changed))
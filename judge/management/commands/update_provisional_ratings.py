@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from judge.models import Contest
+from judge.ratings import get_provisional_ratings, update_provisional_ratings
+
+
+class Command(BaseCommand):
+    help = 'keeps the provisional rating changes of rated contests that are running or awaiting their ratings ' \
+           'up to date, meant to run as a daemon'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-i', '--interval', type=int,
+                            default=getattr(settings, 'DMOJ_PROVISIONAL_RATING_INTERVAL', 60),
+                            help='number of seconds between the updates of each contest')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='update every contest once and exit')
+
+    def handle(self, *args, **options):
+        interval = timedelta(seconds=options['interval'])
+        while True:
+            now = timezone.now()
+            # Contests stay provisional for a day after they end, or until they are rated.
+            contests = Contest.objects.filter(is_rated=True, start_time__lte=now, end_time__gt=now - timedelta(days=1),
+                                              ratings__isnull=True).distinct()
+            next_update = now + interval
+            for contest in contests:
+                cached = get_provisional_ratings(contest)
+                if options['once'] or cached is None or cached[0] + interval <= now:
+                    start = time.time()
+                    changes = update_provisional_ratings(contest)
+                    if options['verbosity'] > 1:
+                        self.stdout.write('Updated %s: %d participations in %.2fs' %
+                                          (contest.key, len(changes), time.time() - start))
+                    cached = (timezone.now(),)
+                next_update = min(next_update, cached[0] + interval)
+
+            if options['once']:
+                break
+            time.sleep(max((next_update - timezone.now()).total_seconds(), 1))
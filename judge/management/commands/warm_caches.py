@@ -0,0 +1,213 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count, Sum
+from django.http import HttpRequest
+from django.template.loader import get_template
+from django.utils import timezone
+
+from judge.caching import get_generation
+from judge.models import BlogPost, Contest, ContestParticipation, Problem, ProblemActivity
+from judge.models.choices import EFFECTIVE_MATH_ENGINES
+from judge.problem_search import build_problem_search
+from judge.utils.opengraph import contest_opengraph, problem_opengraph
+from judge.views.contests import CachedContestCalendar
+
+# As in problem/description.html.
+PROBLEM_HTML_TIMEOUT = 86400
+
+
+def warm_problems(ids, languages, engines):
+    template = get_template('problem/description.html')
+    rendered = 0
+    for problem in Problem.objects.filter(id__in=ids).prefetch_related('translations'):
+        translations = {translation.language: translation.description for translation in problem.translations.all()}
+
+        if not problem.og_image or not problem.summary:
+            for language in languages:
+                if language in translations:
+                    problem_opengraph(problem, language, translations[language])
+            if not set(languages) <= set(translations):
+                problem_opengraph(problem, settings.LANGUAGE_CODE, problem.description)
+
+        # Untranslated languages all show the same description, which only needs to be rendered once.
+        by_description = defaultdict(list)
+        for language in languages:
+            by_description[translations.get(language, problem.description)].append(language)
+
+        generation = get_generation('problem', problem.id)
+        for description, group in by_description.iteritems():
+            for engine in engines:
+                keys = {make_template_fragment_key('problem_html', [problem.id, engine, language, generation]): language
+                        for language in group}
+                cached = cache.get_many(keys.keys())
+                missing = [key for key in keys if key not in cached]
+                if not missing:
+                    continue
+                if cached:
+                    html = next(cached.itervalues())
+                else:
+                    template.render({'problem': problem, 'description': description, 'MATH_ENGINE': engine,
+                                     'LANGUAGE_CODE': keys[missing[0]]})
+                    rendered += 1
+                    html = cache.get(missing[0])
+                    missing = missing[1:]
+                if html is not None and missing:
+                    cache.set_many(dict.fromkeys(missing, html), PROBLEM_HTML_TIMEOUT)
+    return rendered
+
+
+def warm_contests(ids, languages, engines):
+    template = get_template('contest/description.html')
+    for contest in Contest.objects.filter(id__in=ids):
+        if not contest.og_image or not contest.summary:
+            contest_opengraph(contest)
+        for engine in engines:
+            template.render({'contest': contest, 'MATH_ENGINE': engine})
+    return len(ids) * len(engines)
+
+
+def warm_posts(ids, languages, engines):
+    template = get_template('blog/post-content.html')
+    for post in BlogPost.objects.filter(id__in=ids):
+        for engine in engines:
+            template.render({'post': post, 'MATH_ENGINE': engine})
+    return len(ids) * len(engines)
+
+
+SECTIONS = {
+    'problems': warm_problems,
+    'contests': warm_contests,
+    'posts': warm_posts,
+}
+
+
+def warm_chunk(args):
+    section, ids, languages, engines = args
+    return section, len(ids), SECTIONS[section](ids, languages, engines)
+
+
+def close_connections():
+    # Forked workers must not share the parent's database connections.
+    connections.close_all()
+
+
+def by_traffic(queryset, traffic):
+    # Sorting is stable, so objects without recent traffic keep the order of the queryset.
+    return sorted(queryset.values_list('id', flat=True), key=lambda id: -traffic.get(id, 0))
+
+
+class Command(BaseCommand):
+    help = 'renders the cached descriptions and opengraph metadata of public problems, contests and blog posts, ' \
+           'the contest calendar and the problem search index ahead of visitors, starting with the most active'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--problems', action='store_true', default=False,
+                            help='warm problem descriptions and metadata')
+        parser.add_argument('--contests', action='store_true', default=False,
+                            help='warm contest descriptions and metadata')
+        parser.add_argument('--posts', action='store_true', default=False,
+                            help='warm blog posts')
+        parser.add_argument('--calendar', action='store_true', default=False,
+                            help='warm the contest calendar around the current month')
+        parser.add_argument('--search', action='store_true', default=False,
+                            help='build the problem search index on this host')
+        parser.add_argument('-l', '--language', action='append', dest='languages',
+                            choices=[code for code, name in settings.LANGUAGES],
+                            help='language to warm, defaults to all of them')
+        parser.add_argument('-m', '--math-engine', action='append', dest='engines', choices=EFFECTIVE_MATH_ENGINES,
+                            help='math engine to warm, defaults to all of them')
+        parser.add_argument('--months', type=int, default=1,
+                            help='number of calendar months to warm on each side of the current month')
+        parser.add_argument('-b', '--batch-size', type=int, default=50,
+                            help='number of objects to warm at once')
+        parser.add_argument('-j', '--workers', type=int, default=1,
+                            help='number of worker processes')
+
+    def handle(self, *args, **options):
+        sections = [section for section in ('problems', 'contests', 'posts', 'calendar', 'search')
+                    if options[section]] or ['problems', 'contests', 'posts', 'calendar', 'search']
+        languages = options['languages'] or [code for code, name in settings.LANGUAGES]
+        engines = options['engines'] or list(EFFECTIVE_MATH_ENGINES)
+        batch_size = options['batch_size']
+        verbosity = options['verbosity']
+        started = time.time()
+
+        since = timezone.now() - timedelta(days=1)
+        objects = {}
+        if 'problems' in sections:
+            objects['problems'] = by_traffic(Problem.objects.filter(is_public=True).order_by('id'), dict(
+                ProblemActivity.objects.filter(hour__gte=ProblemActivity.hour_of(since))
+                .values_list('problem_id').annotate(volume=Sum('volume'))
+            ))
+        if 'contests' in sections:
+            objects['contests'] = by_traffic(
+                Contest.objects.filter(is_public=True, is_private=False).order_by('-end_time'),
+                dict(ContestParticipation.objects.filter(real_start__gte=since)
+                     .values_list('contest_id').annotate(count=Count('id'))),
+            )
+        if 'posts' in sections:
+            objects['posts'] = list(BlogPost.objects.filter(visible=True, publish_on__lte=timezone.now())
+                                    .order_by('-sticky', '-publish_on').values_list('id', flat=True))
+
+        chunks = []
+        for section in ('problems', 'contests', 'posts'):
+            ids = objects.get(section, [])
+            chunks += [(section, ids[start:start + batch_size], languages, engines)
+                       for start in xrange(0, len(ids), batch_size)]
+
+        if options['workers'] > 1:
+            close_connections()
+            pool = Pool(options['workers'], initializer=close_connections)
+            results = pool.imap_unordered(warm_chunk, chunks)
+        else:
+            pool = None
+            results = (warm_chunk(chunk) for chunk in chunks)
+
+        done = defaultdict(int)
+        rendered = defaultdict(int)
+        try:
+            for section, count, renders in results:
+                done[section] += count
+                rendered[section] += renders
+                if verbosity > 0:
+                    self.stdout.write('Processed %d/%d %s, %d fragments rendered, %.1fs elapsed' %
+                                      (done[section], len(objects[section]), section, rendered[section],
+                                       time.time() - started))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if 'calendar' in sections:
+            months = self.warm_calendar(options['months'])
+            if verbosity > 0:
+                self.stdout.write('Processed %d calendar months, %.1fs elapsed' % (months, time.time() - started))
+
+        if 'search' in sections:
+            if build_problem_search() is None:
+                self.stderr.write('Skipped problem search index, since DMOJ_PROBLEM_SEARCH_INDEX is not set')
+            elif verbosity > 0:
+                self.stdout.write('Processed problem search index, %.1fs elapsed' % (time.time() - started))
+
+        if verbosity > 0:
+            self.stdout.write('Warmed caches in %.1fs' % (time.time() - started))
+
+    def warm_calendar(self, months):
+        today = timezone.now().date()
+        request = HttpRequest()
+        request.user = AnonymousUser()
+        for offset in xrange(-months, months + 1):
+            year, month = divmod(today.year * 12 + today.month - 1 + offset, 12)
+            calendar = CachedContestCalendar(request=request)
+            calendar.year, calendar.month, calendar.today = year, month + 1, today
+            calendar.get_table()
+        return 2 * months + 1
@@ -1,3 +1,9 @@
+from django.conf import settings
+from django.utils.html import format_html, format_html_join
+
+from judge.request_memo import begin_request_memo, end_request_memo, request_memo_stats
+
+
 class ContestMiddleware(object):
     def __init__(self, get_response):
         self.get_response = get_response
@@ -12,3 +18,40 @@ class ContestMiddleware(object):
             request.in_contest = False
             request.participation = None
         return self.get_response(request)
+
+
+class RequestMemoMiddleware(object):
+    """
+    Scopes the memoized permission and access checks to each request. With DMOJ_REQUEST_MEMO_PANEL set, HTML pages
+    also show how many of those checks were answered without querying the database.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.show_panel = getattr(settings, 'DMOJ_REQUEST_MEMO_PANEL', False)
+
+    def __call__(self, request):
+        begin_request_memo()
+        try:
+            response = self.get_response(request)
+            if self.show_panel and not response.streaming and \
+                    response.get('Content-Type', '').startswith('text/html'):
+                self.add_panel(response)
+            return response
+        finally:
+            end_request_memo()
+
+    @staticmethod
+    def add_panel(response):
+        stats = request_memo_stats()
+        panel = format_html(
+            '<div id="request-memo-panel" style="position:fixed;bottom:0;right:0;z-index:10000;background:#fff;'
+            'border:1px solid #ccc;font-size:12px;padding:4px"><b>Queries avoided: {0}</b>'
+            '<table><tr><th>check</th><th>hits</th><th>misses</th><th>primed</th></tr>{1}</table></div>',
+            sum(hits for namespace, hits, misses, primed in stats),
+            format_html_join('', '<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>', stats),
+        ).encode('utf-8')
+        content = response.content
+        index = content.rfind(b'</body>')
+        if index >= 0:
+            response.content = content[:index] + panel + content[index:]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.8 on 2026-10-18 22:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0068_auto_20171229_1242'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.FloatField(db_index=True, verbose_name='best points')),
+                ('case_points', models.FloatField(default=0, verbose_name='best test case points')),
+                ('case_total', models.FloatField(default=0, verbose_name='best test case total points')),
+                ('time', models.FloatField(null=True, verbose_name='fastest execution time')),
+                ('first_ac_date', models.DateTimeField(blank=True, null=True, verbose_name='first accepted submission time')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_results', to='judge.Problem', verbose_name='problem')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='judge.Submission', verbose_name='best submission')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_results', to='judge.Profile', verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'best result',
+                'verbose_name_plural': 'best results',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='bestresult',
+            unique_together=set([('user', 'problem')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.8 on 2026-10-18 22:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0069_best_result'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bestresult',
+            name='submission',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='judge.Submission', verbose_name='best submission'),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='ac_count',
+            field=models.IntegerField(default=0, verbose_name='amount of AC submissions'),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='submission_count',
+            field=models.IntegerField(default=0, verbose_name='amount of submissions'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.8 on 2026-10-18 22:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0070_problem_stats_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContestProblemResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.FloatField(default=0, verbose_name='best points')),
+                ('attempts', models.IntegerField(default=0, verbose_name='number of submissions')),
+                ('last_submission', models.DateTimeField(null=True, verbose_name='last submission time')),
+                ('last_scored', models.DateTimeField(null=True, verbose_name='last submission time with points')),
+                ('participation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='judge.ContestParticipation', verbose_name='participation')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='judge.ContestProblem', verbose_name='contest problem')),
+            ],
+            options={
+                'verbose_name': 'contest problem result',
+                'verbose_name_plural': 'contest problem results',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='contestproblemresult',
+            unique_together=set([('participation', 'problem')]),
+        ),
+    ]
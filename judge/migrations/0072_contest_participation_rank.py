@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.8 on 2026-10-18 23:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0071_contest_problem_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contestparticipation',
+            name='rank',
+            field=models.IntegerField(blank=True, help_text='Rank in the final ranking, shared by tied participants.', null=True, verbose_name='final rank'),
+        ),
+        migrations.AddField(
+            model_name='contestparticipation',
+            name='tie_rank',
+            field=models.FloatField(blank=True, help_text='Average of the ranks of tied participants, as used for ratings.', null=True, verbose_name='tie-aware rank'),
+        ),
+    ]
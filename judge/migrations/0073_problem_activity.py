@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.8 on 2026-10-19 00:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0072_contest_participation_rank'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(db_index=True, verbose_name='hour')),
+                ('users', models.BinaryField(verbose_name='submitting users sketch')),
+                ('volume', models.IntegerField(default=0, verbose_name='graded submissions')),
+                ('ac_count', models.IntegerField(default=0, verbose_name='accepted submissions')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='judge.Problem', verbose_name='problem')),
+            ],
+            options={
+                'verbose_name': 'problem activity',
+                'verbose_name_plural': 'problem activities',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='problemactivity',
+            unique_together=set([('problem', 'hour')]),
+        ),
+    ]
@@ -2,7 +2,8 @@ from reversion import revisions
 
 from judge.models.choices import TIMEZONE, ACE_THEMES, MATH_ENGINES_CHOICES, EFFECTIVE_MATH_ENGINES
 from judge.models.comment import Comment, CommentVote
-from judge.models.contest import Contest, ContestTag, ContestParticipation, ContestProblem, ContestSubmission, Rating
+from judge.models.contest import Contest, ContestTag, ContestParticipation, ContestProblem, ContestSubmission, \
+    ContestProblemResult, Rating
 from judge.models.interface import MiscConfig, validate_regex, NavigationBar, BlogPost
 from judge.models.message import PrivateMessage, PrivateMessageThread
 from judge.models.problem import ProblemGroup, ProblemType, Problem, ProblemClarification, ProblemTranslation, \
@@ -11,7 +12,8 @@ from judge.models.problem_data import problem_data_storage, problem_directory_fi
     CHECKERS
 from judge.models.profile import Profile, Organization, OrganizationRequest
 from judge.models.runtime import Language, RuntimeVersion, Judge
-from judge.models.submission import SUBMISSION_RESULT, Submission, SubmissionTestCase
+from judge.models.submission import SUBMISSION_RESULT, Submission, SubmissionTestCase, BestResult, \
+    ProblemActivity
 from judge.models.ticket import Ticket, TicketMessage
 
 revisions.register(Profile, exclude=['points', 'last_access', 'ip', 'rating'])
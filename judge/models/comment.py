@@ -65,13 +65,15 @@ class Comment(MPTTModel):
             slice = queryset[i * batch:i * batch + batch]
             if not slice:
                 break
+            problems = {problem.code: problem for problem in
+                        Problem.objects.filter(code__in=[comment.page[2:] for comment in slice
+                                                         if comment.page.startswith('p:')]).defer('description')}
+            Problem.prefetch_access(problems.values(), user)
             for comment in slice:
                 if comment.page.startswith('p:'):
-                    try:
-                        if Problem.objects.get(code=comment.page[2:]).is_accessible_by(user):
-                            output.append(comment)
-                    except Problem.DoesNotExist:
-                        pass
+                    problem = problems.get(comment.page[2:])
+                    if problem is not None and problem.is_accessible_by(user):
+                        output.append(comment)
                 else:
                     output.append(comment)
                 if len(output) >= n:
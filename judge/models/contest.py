@@ -1,10 +1,11 @@
+from itertools import izip
 from operator import itemgetter
 
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
-from django.db.models import Max
+from django.db import models, transaction
+from django.db.models import Max, Count, Case, When, Value, IntegerField, FloatField
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _, ugettext
@@ -12,8 +13,10 @@ from django.utils.translation import ugettext_lazy as _, ugettext
 from judge.models.problem import Problem
 from judge.models.profile import Profile, Organization
 from judge.models.submission import Submission
+from judge.utils.ranker import ranker, tie_ranker
 
-__all__ = ['Contest', 'ContestTag', 'ContestParticipation', 'ContestProblem', 'ContestSubmission', 'Rating']
+__all__ = ['Contest', 'ContestTag', 'ContestParticipation', 'ContestProblem', 'ContestSubmission',
+           'ContestProblemResult', 'Rating']
 
 
 class ContestTag(models.Model):
@@ -135,6 +138,31 @@ class Contest(models.Model):
 
     update_user_count.alters_data = True
 
+    def update_ranks(self, batch_size=500):
+        """Stores the rank of every live participation, so that it need not be found from the whole ranking."""
+        participations = list(self.users.filter(virtual=0).order_by('-score', 'cumtime', 'id')
+                                  .values_list('id', 'score', 'cumtime', 'rank', 'tie_rank'))
+        key = itemgetter(1, 2)
+        changed = [(participation[0], rank, tie_rank) for (rank, participation), (tie_rank, _) in
+                   izip(ranker(participations, key=key), tie_ranker(participations, key=key))
+                   if participation[3:] != (rank, tie_rank)]
+        for start in xrange(0, len(changed), batch_size):
+            batch = changed[start:start + batch_size]
+            self.users.filter(id__in=[id for id, rank, tie_rank in batch]).update(
+                rank=Case(*[When(id=id, then=Value(rank)) for id, rank, tie_rank in batch],
+                          output_field=IntegerField()),
+                tie_rank=Case(*[When(id=id, then=Value(tie_rank)) for id, rank, tie_rank in batch],
+                              output_field=FloatField()),
+            )
+        return len(changed)
+
+    update_ranks.alters_data = True
+
+    def reset_ranks(self):
+        self.users.filter(virtual=0).update(rank=None, tie_rank=None)
+
+    reset_ranks.alters_data = True
+
     class Meta:
         permissions = (
             ('see_private_contest', _('See private contests')),
@@ -155,10 +183,13 @@ class ContestParticipation(models.Model):
     cumtime = models.PositiveIntegerField(verbose_name=_('cumulative time'), default=0)
     virtual = models.IntegerField(verbose_name=_('virtual participation id'), default=0,
                                   help_text=_('0 means non-virtual, otherwise the n-th virtual participation'))
+    rank = models.IntegerField(verbose_name=_('final rank'), null=True, blank=True,
+                               help_text=_('Rank in the final ranking, shared by tied participants.'))
+    tie_rank = models.FloatField(verbose_name=_('tie-aware rank'), null=True, blank=True,
+                                 help_text=_('Average of the ranks of tied participants, as used for ratings.'))
 
     def recalculate_score(self):
-        self.score = sum(map(itemgetter('points'),
-                             self.submissions.values('submission__problem').annotate(points=Max('points'))))
+        self.score = sum(self.results.values_list('points', flat=True))
         self.save()
         return self.score
 
@@ -203,13 +234,8 @@ class ContestParticipation(models.Model):
 
     def update_cumtime(self):
         cumtime = 0
-        for problem in self.contest.contest_problems.all():
-            solution = problem.submissions.filter(participation=self, points__gt=0) \
-                .values('submission__user_id').annotate(time=Max('submission__date'))
-            if not solution:
-                continue
-            dt = solution[0]['time'] - self.start
-            cumtime += dt.total_seconds()
+        for last_scored in self.results.filter(last_scored__isnull=False).values_list('last_scored', flat=True):
+            cumtime += (last_scored - self.start).total_seconds()
         self.cumtime = cumtime
         self.save()
 
@@ -264,6 +290,74 @@ class ContestSubmission(models.Model):
         verbose_name_plural = _('contest submissions')
 
 
+class ContestProblemResult(models.Model):
+    participation = models.ForeignKey(ContestParticipation, verbose_name=_('participation'), related_name='results')
+    problem = models.ForeignKey(ContestProblem, verbose_name=_('contest problem'), related_name='results')
+    points = models.FloatField(verbose_name=_('best points'), default=0)
+    attempts = models.IntegerField(verbose_name=_('number of submissions'), default=0)
+    last_submission = models.DateTimeField(verbose_name=_('last submission time'), null=True)
+    last_scored = models.DateTimeField(verbose_name=_('last submission time with points'), null=True)
+
+    @classmethod
+    def _from_submissions(cls, submissions):
+        submissions = submissions.values('participation_id', 'problem_id').order_by()
+        scored = {(participation, problem): date for participation, problem, date in
+                  submissions.filter(points__gt=0).annotate(date=Max('submission__date'))
+                             .values_list('participation_id', 'problem_id', 'date')}
+        return [cls(participation_id=participation, problem_id=problem, points=points, attempts=attempts,
+                    last_submission=last_submission, last_scored=scored.get((participation, problem)))
+                for participation, problem, points, attempts, last_submission in
+                submissions.annotate(best=Max('points'), count=Count('id'), date=Max('submission__date'))
+                           .values_list('participation_id', 'problem_id', 'best', 'count', 'date')]
+
+    @classmethod
+    def rebuild(cls, participation_ids):
+        with transaction.atomic():
+            cls.objects.filter(participation_id__in=participation_ids).delete()
+            cls.objects.bulk_create(cls._from_submissions(
+                ContestSubmission.objects.filter(participation_id__in=participation_ids)))
+
+    @classmethod
+    def recalculate(cls, participation_id, problem_id):
+        with transaction.atomic():
+            cls.objects.filter(participation_id=participation_id, problem_id=problem_id).delete()
+            results = cls._from_submissions(ContestSubmission.objects.filter(participation_id=participation_id,
+                                                                             problem_id=problem_id))
+            for result in results:
+                result.save()
+            return results[0] if results else None
+
+    @classmethod
+    def update_from_submission(cls, contest_submission, rejudged=False):
+        # Like BestResult, a rejudge may lower the points and needs a recount. Otherwise, the submission was
+        # already counted as an attempt when it was made, and its points can only raise the best.
+        if rejudged:
+            return cls.recalculate(contest_submission.participation_id, contest_submission.problem_id)
+
+        with transaction.atomic():
+            result = cls.objects.select_for_update().filter(participation_id=contest_submission.participation_id,
+                                                            problem_id=contest_submission.problem_id).first()
+            if result is None:
+                return cls.recalculate(contest_submission.participation_id, contest_submission.problem_id)
+
+            changed = False
+            date = contest_submission.submission.date
+            if contest_submission.points > result.points:
+                result.points = contest_submission.points
+                changed = True
+            if contest_submission.points > 0 and (result.last_scored is None or date > result.last_scored):
+                result.last_scored = date
+                changed = True
+            if changed:
+                result.save()
+            return result
+
+    class Meta:
+        unique_together = ('participation', 'problem')
+        verbose_name = _('contest problem result')
+        verbose_name_plural = _('contest problem results')
+
+
 class Rating(models.Model):
     user = models.ForeignKey(Profile, verbose_name=_('user'), related_name='ratings')
     contest = models.ForeignKey(Contest, verbose_name=_('contest'), related_name='ratings')
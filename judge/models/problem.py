@@ -1,3 +1,4 @@
+from collections import defaultdict
 from operator import attrgetter
 
 from django.conf import settings
@@ -6,15 +7,17 @@ from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models import F, QuerySet
+from django.db.models import F, Q, QuerySet, Case, When, Value, ExpressionWrapper, FloatField
 from django.db.models.expressions import RawSQL
 from django.db.models.functions import Coalesce
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
+from judge.caching import get_generation
 from judge.fulltext import SearchQuerySet
 from judge.models.profile import Profile
 from judge.models.runtime import Language
+from judge.request_memo import memoized, prime, request_memo_active
 from judge.user_translations import ugettext as user_ugettext
 from judge.utils.raw_sql import unique_together_left_join, RawSQLColumn
 
@@ -126,6 +129,8 @@ class Problem(models.Model):
     user_count = models.IntegerField(verbose_name=_('amount of users'), default=0,
                                      help_text=_('The amount of users on the best solutions page.'))
     ac_rate = models.FloatField(verbose_name=_('rate of AC submissions'), default=0)
+    submission_count = models.IntegerField(verbose_name=_('amount of submissions'), default=0)
+    ac_count = models.IntegerField(verbose_name=_('amount of AC submissions'), default=0)
 
     objects = TranslatedProblemQuerySet.as_manager()
     tickets = GenericRelation('Ticket')
@@ -135,6 +140,7 @@ class Problem(models.Model):
         self._translated_name_cache = {}
         self._i18n_name = None
         self.__original_code = self.code
+        self.__original_is_public = self.is_public
 
     @cached_property
     def types_list(self):
@@ -144,7 +150,8 @@ class Problem(models.Model):
         return self.allowed_languages.values_list('common_name', flat=True).distinct().order_by('common_name')
 
     def is_editor(self, profile):
-        return (self.authors.filter(id=profile.id) | self.curators.filter(id=profile.id)).exists()
+        return memoized('problem_editor', (self.id, profile.id),
+                        lambda: (self.authors.filter(id=profile.id) | self.curators.filter(id=profile.id)).exists())
 
     def is_editable_by(self, user):
         if not user.is_authenticated:
@@ -170,7 +177,7 @@ class Problem(models.Model):
             return False
 
         # If user is a tester
-        if self.testers.filter(id=user.profile.id).exists():
+        if user.profile.id in self.tester_ids:
             return True
 
         # If user is currently in a contest containing that problem
@@ -178,7 +185,38 @@ class Problem(models.Model):
         if current is None:
             return False
         from judge.models import ContestProblem
-        return ContestProblem.objects.filter(problem_id=self.id, contest__users__id=current).exists()
+        return memoized('problem_in_contest', (self.id, current),
+                        lambda: ContestProblem.objects.filter(problem_id=self.id, contest__users__id=current).exists())
+
+    @classmethod
+    def prefetch_access(cls, problems, user):
+        """
+        Answers the checks is_accessible_by makes for many problems at once for the rest of the request, so that
+        checking each row of a list does not query the database.
+        """
+        if not request_memo_active() or not user.is_authenticated:
+            return
+        ids = [problem.id for problem in problems if not problem.is_public]
+        if not ids:
+            return
+        profile = user.profile
+
+        editors = set(cls.objects.filter(Q(authors=profile) | Q(curators=profile), id__in=ids)
+                      .values_list('id', flat=True))
+        prime('problem_editor', (((id, profile.id), id in editors) for id in ids))
+
+        testers = defaultdict(set)
+        for problem, tester in cls.testers.through.objects.filter(problem_id__in=ids) \
+                                                          .values_list('problem_id', 'profile_id'):
+            testers[problem].add(tester)
+        prime('problem_testers', ((id, frozenset(testers[id])) for id in ids))
+
+        current = profile.current_contest_id
+        if current is not None:
+            from judge.models import ContestProblem
+            in_contest = set(ContestProblem.objects.filter(problem_id__in=ids, contest__users__id=current)
+                             .values_list('problem_id', flat=True))
+            prime('problem_in_contest', (((id, current), id in in_contest) for id in ids))
 
     def __unicode__(self):
         return self.name
@@ -196,7 +234,7 @@ class Problem(models.Model):
 
     @cached_property
     def tester_ids(self):
-        return self.testers.values_list('id', flat=True)
+        return memoized('problem_testers', self.id, lambda: frozenset(self.testers.values_list('id', flat=True)))
 
     @cached_property
     def usable_common_names(self):
@@ -231,14 +269,41 @@ class Problem(models.Model):
     def clarifications(self):
         return ProblemClarification.objects.filter(problem=self)
 
+    stats_fields = ('submission_count', 'ac_count', 'user_count', 'ac_rate')
+
     def update_stats(self):
         self.user_count = self.submission_set.filter(points__gt=0).values('user').distinct().count()
-        submissions = self.submission_set.count()
-        self.ac_rate = 100.0 * self.submission_set.filter(result='AC').count() / submissions if submissions else 0
-        self.save()
+        self.submission_count = self.submission_set.count()
+        self.ac_count = self.submission_set.filter(result='AC').count()
+        self.ac_rate = 100.0 * self.ac_count / self.submission_count if self.submission_count else 0
+        self.save(update_fields=self.stats_fields)
 
     update_stats.alters_data = True
 
+    @classmethod
+    def adjust_stats(cls, id, submissions=0, accepted=0, users=0):
+        """
+        Moves the statistics counters of a problem by the given amounts with atomic updates, so that
+        grading a submission does not have to count everything again.
+        """
+        updates = {}
+        if submissions:
+            updates['submission_count'] = F('submission_count') + submissions
+        if accepted:
+            updates['ac_count'] = F('ac_count') + accepted
+        if users:
+            updates['user_count'] = F('user_count') + users
+        if not updates:
+            return
+        problems = cls.objects.filter(id=id)
+        problems.update(**updates)
+        if submissions or accepted:
+            problems.update(ac_rate=Case(
+                When(submission_count__gt=0,
+                     then=ExpressionWrapper(100.0 * F('ac_count') / F('submission_count'), output_field=FloatField())),
+                default=Value(0.0), output_field=FloatField(),
+            ))
+
     def _get_limits(self, key):
         limits = {limit['language_id']: (limit['language__name'], limit[key])
                   for limit in self.language_limits.values('language_id', 'language__name', key)}
@@ -261,7 +326,7 @@ class Problem(models.Model):
 
     @property
     def language_time_limit(self):
-        key = 'problem_tls:%d' % self.id
+        key = 'problem_tls:%d:%d' % (self.id, get_generation('problem', self.id))
         result = cache.get(key)
         if result is not None:
             return result
@@ -271,7 +336,7 @@ class Problem(models.Model):
 
     @property
     def language_memory_limit(self):
-        key = 'problem_mls:%d' % self.id
+        key = 'problem_mls:%d:%d' % (self.id, get_generation('problem', self.id))
         result = cache.get(key)
         if result is not None:
             return result
@@ -280,6 +345,14 @@ class Problem(models.Model):
         return result
 
     def save(self, *args, **kwargs):
+        # The statistics are moved by adjust_stats while problems are being edited, so saving them from a copy
+        # loaded earlier would undo grading. Only update_stats writes them to existing problems.
+        if self.pk is not None and not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.attname for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.attname not in deferred and
+                                       field.name not in self.stats_fields]
         super(Problem, self).save(*args, **kwargs)
         if self.code != self.__original_code:
             try:
@@ -288,6 +361,10 @@ class Problem(models.Model):
                 pass
             else:
                 problem_data._update_code(self.__original_code, self.code)
+        if self.is_public != self.__original_is_public:
+            from judge.performance_points import PerformancePointsTable
+            PerformancePointsTable.invalidate(self.best_results.values_list('user_id', flat=True))
+            self.__original_is_public = self.is_public
     save.alters_data = True
 
     class Meta:
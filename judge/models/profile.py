@@ -1,11 +1,8 @@
-from operator import mul
-
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models import Max
 from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _, pgettext
@@ -98,26 +95,55 @@ class Profile(models.Model):
         orgs = self.organizations.all()
         return orgs[0] if orgs else None
 
-    def calculate_points(self, table=(lambda x: [pow(x, i) for i in xrange(100)])(getattr(settings, 'PP_STEP', 0.95))):
-        from judge.models import Problem
-        data = (Problem.objects.filter(submission__user=self, submission__points__isnull=False, is_public=True)
-                .annotate(max_points=Max('submission__points')).order_by('-max_points')
-                .values_list('max_points', flat=True).filter(max_points__gt=0))
-        extradata = Problem.objects.filter(submission__user=self, submission__result='AC', is_public=True).values('id').distinct().count()
-        bonus_function = getattr(settings, 'PP_BONUS_FUNCTION', lambda n: 300 * (1 - 0.997 ** n))
-        points = sum(data)
-        problems = len(data)
-        entries = min(len(data), len(table))
-        pp = sum(map(mul, table[:entries], data[:entries])) + bonus_function(extradata)
+    def calculate_points(self):
+        from judge.models import BestResult
+        from judge.performance_points import PerformancePointsTable
+        table = PerformancePointsTable.from_results(
+            BestResult.objects.filter(user=self, problem__is_public=True)
+                      .values_list('problem_id', 'points', 'first_ac_date'))
+        table.set_cached(self.id)
+        return self._update_points_from_table(table)
+
+    calculate_points.alters_data = True
+
+    def update_problem_points(self, problem, result):
+        """
+        Applies the best result of this user on a problem (None if there is none) without going over the
+        user's other problems, as long as the table from the last calculation is still cached.
+        """
+        from judge.performance_points import PerformancePointsTable
+        table = PerformancePointsTable.get_cached(self.id)
+        if table is None:
+            return self.calculate_points()
+
+        if result is not None and problem.is_public:
+            changed = table.update(problem.id, result.points, result.first_ac_date is not None)
+        else:
+            changed = table.update(problem.id, 0, False)
+        if changed:
+            table.set_cached(self.id)
+        return self._update_points_from_table(table)
+
+    update_problem_points.alters_data = True
+
+    def _update_points_from_table(self, table):
+        points = table.total_points
+        problems = table.problem_count
+        pp = table.performance_points
         if self.points != points or problems != self.problem_count or self.performance_points != pp:
+            from judge.rank_index import update_rank_index
+
             self.points = points
             self.problem_count = problems
             self.performance_points = pp
             self.save()
+            update_rank_index('performance_points', self.id, pp)
+            update_rank_index('points', self.id, points)
+            update_rank_index('problem_count', self.id, problems)
+            for organization in self.organizations.values_list('id', flat=True):
+                update_rank_index('performance_points', self.id, pp, organization)
         return points
 
-    calculate_points.alters_data = True
-
     @cached_property
     def display_name(self):
         if self.name:
@@ -1,6 +1,7 @@
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Min
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
@@ -8,8 +9,9 @@ from judge.judgeapi import judge_submission, abort_submission
 from judge.models.problem import Problem, TranslatedProblemForeignKeyQuerySet
 from judge.models.profile import Profile
 from judge.models.runtime import Language
+from judge.utils.hyperloglog import hll_add, hll_empty
 
-__all__ = ['SUBMISSION_RESULT', 'Submission', 'SubmissionTestCase']
+__all__ = ['SUBMISSION_RESULT', 'Submission', 'SubmissionTestCase', 'BestResult', 'ProblemActivity']
 
 SUBMISSION_RESULT = (
     ('AC', _('Accepted')),
@@ -171,3 +173,152 @@ class SubmissionTestCase(models.Model):
     class Meta:
         verbose_name = _('submission test case')
         verbose_name_plural = _('submission test cases')
+
+
+class BestResult(models.Model):
+    user = models.ForeignKey(Profile, verbose_name=_('user'), related_name='best_results')
+    problem = models.ForeignKey(Problem, verbose_name=_('problem'), related_name='best_results')
+    # Kept when the submission is deleted, so that the recalculation afterwards still knows the old points.
+    submission = models.ForeignKey(Submission, verbose_name=_('best submission'), related_name='+', null=True,
+                                   on_delete=models.SET_NULL)
+    points = models.FloatField(verbose_name=_('best points'), db_index=True)
+    case_points = models.FloatField(verbose_name=_('best test case points'), default=0)
+    case_total = models.FloatField(verbose_name=_('best test case total points'), default=0)
+    time = models.FloatField(verbose_name=_('fastest execution time'), null=True)
+    first_ac_date = models.DateTimeField(verbose_name=_('first accepted submission time'), null=True, blank=True)
+
+    @staticmethod
+    def _sort_key(id, points, time):
+        # Most points first, then the fastest, then the earliest submission.
+        return -points, float('inf') if time is None else time, id
+
+    def is_beaten_by(self, submission):
+        return (self._sort_key(submission.id, submission.points, submission.time) <
+                self._sort_key(self.submission_id, self.points, self.time))
+
+    def set_best(self, submission):
+        self.submission_id = submission.id
+        self.points = submission.points
+        self.case_points = submission.case_points
+        self.case_total = submission.case_total
+        self.time = submission.time
+
+    @classmethod
+    def recalculate(cls, user_id, problem_id):
+        with transaction.atomic():
+            submissions = Submission.objects.filter(user_id=user_id, problem_id=problem_id)
+            # Submissions without a time sort last, as in _sort_key, rather than where the database puts NULLs.
+            best = submissions.filter(points__isnull=False) \
+                              .order_by('-points', F('time').asc(nulls_last=True), 'id') \
+                              .only('id', 'points', 'case_points', 'case_total', 'time').first()
+            result = cls.objects.select_for_update().filter(user_id=user_id, problem_id=problem_id).first()
+            was_scored = result is not None and result.points > 0
+            if best is None:
+                if result is not None:
+                    result.delete()
+                result = None
+            else:
+                result = result or cls(user_id=user_id, problem_id=problem_id)
+                result.set_best(best)
+                result.first_ac_date = submissions.filter(result='AC').aggregate(date=Min('date'))['date']
+                result.save()
+            cls._count_user(problem_id, was_scored, result)
+            return result
+
+    @classmethod
+    def update_from_submission(cls, submission):
+        # A rejudge can lower a score, so only a complete recount is safe. Otherwise a freshly graded
+        # submission can only ever improve on what is stored, and merging it in avoids touching any
+        # other submission.
+        if submission.was_rejudged:
+            return cls.recalculate(submission.user_id, submission.problem_id)
+        if submission.points is None:
+            return cls.objects.filter(user_id=submission.user_id, problem_id=submission.problem_id).first()
+
+        with transaction.atomic():
+            result = cls.objects.select_for_update().filter(user_id=submission.user_id,
+                                                            problem_id=submission.problem_id).first()
+            changed = False
+            was_scored = result is not None and result.points > 0
+            if result is None:
+                result = cls(user_id=submission.user_id, problem_id=submission.problem_id)
+                result.set_best(submission)
+                changed = True
+            elif result.is_beaten_by(submission):
+                result.set_best(submission)
+                changed = True
+            if submission.result == 'AC' and (result.first_ac_date is None or submission.date < result.first_ac_date):
+                result.first_ac_date = submission.date
+                changed = True
+            if changed:
+                result.save()
+                cls._count_user(submission.problem_id, was_scored, result)
+            return result
+
+    @staticmethod
+    def _count_user(problem_id, was_scored, result):
+        # Problem.user_count is the number of users with a positive score, which is exactly the number
+        # of best results with positive points.
+        is_scored = result is not None and result.points > 0
+        if is_scored != was_scored:
+            Problem.adjust_stats(problem_id, users=1 if is_scored else -1)
+
+    class Meta:
+        unique_together = ('user', 'problem')
+        verbose_name = _('best result')
+        verbose_name_plural = _('best results')
+
+
+class ProblemActivity(models.Model):
+    # The results that count towards the volume of submissions used to rank hot problems.
+    VOLUME_RESULTS = ('AC', 'WA', 'IR', 'RTE', 'TLE', 'OLE')
+
+    problem = models.ForeignKey(Problem, verbose_name=_('problem'), related_name='activity')
+    hour = models.DateTimeField(verbose_name=_('hour'), db_index=True)
+    users = models.BinaryField(verbose_name=_('submitting users sketch'))
+    volume = models.IntegerField(verbose_name=_('graded submissions'), default=0)
+    ac_count = models.IntegerField(verbose_name=_('accepted submissions'), default=0)
+
+    @staticmethod
+    def hour_of(date):
+        return date.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def record(cls, problem_id, date, user_id=None, result=None, count=1):
+        """
+        Counts a submitting user, or moves the counters of a result by count, in the hour of date. A rejudge
+        takes the old result back by recording it with a count of -1.
+        """
+        volume = count if result in cls.VOLUME_RESULTS else 0
+        accepted = count if result == 'AC' else 0
+        if user_id is None and not volume:
+            return
+
+        counters = {}
+        if volume:
+            counters['volume'] = F('volume') + volume
+        if accepted:
+            counters['ac_count'] = F('ac_count') + accepted
+
+        if count < 0:
+            # Taking a result back never creates an hour, which would be left with negative counters if the
+            # submission is older than the activity that is kept.
+            cls.objects.filter(problem_id=problem_id, hour=cls.hour_of(date)).update(**counters)
+            return
+
+        with transaction.atomic():
+            activity, created = cls.objects.select_for_update().get_or_create(
+                problem_id=problem_id, hour=cls.hour_of(date), defaults={'users': hll_empty()},
+            )
+            updates = counters
+            if user_id is not None:
+                users = hll_add(activity.users, user_id)
+                if users is not None:
+                    updates['users'] = users
+            if updates:
+                cls.objects.filter(id=activity.id).update(**updates)
+
+    class Meta:
+        unique_together = ('problem', 'hour')
+        verbose_name = _('problem activity')
+        verbose_name_plural = _('problem activities')
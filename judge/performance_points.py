@@ -1,14 +1,17 @@
+from array import array
+from bisect import bisect_left, insort
 from collections import namedtuple
+from itertools import islice, izip
 
 from django.conf import settings
-from django.db import connection
+from django.core.cache import cache
 
-from judge.models import Submission
-from judge.timezone import from_database_time
+from judge.models import BestResult, Submission
 
 PP_STEP = getattr(settings, 'PP_STEP', 0.95)
 PP_ENTRIES = getattr(settings, 'PP_ENTRIES', 100)
 PP_WEIGHT_TABLE = [pow(PP_STEP, i) for i in xrange(PP_ENTRIES)]
+PP_BONUS_FUNCTION = getattr(settings, 'PP_BONUS_FUNCTION', lambda n: 300 * (1 - 0.997 ** n))
 
 PPBreakdown = namedtuple('PPBreakdown', 'points weight scaled_points problem_name problem_code '
                                         'sub_id sub_date sub_points sub_total sub_result_class '
@@ -16,40 +19,11 @@ PPBreakdown = namedtuple('PPBreakdown', 'points weight scaled_points problem_nam
 
 
 def get_pp_breakdown(user, start=0, end=100):
-    with connection.cursor() as cursor:
-        cursor.execute('''
-            SELECT max_points_table.problem_code,
-                   max_points_table.problem_name,
-                   max_points_table.max_points,
-                   judge_submission.id,
-                   judge_submission.date,
-                   judge_submission.case_points,
-                   judge_submission.case_total,
-                   judge_submission.result,
-                   judge_language.short_name,
-                   judge_language.key
-            FROM judge_submission
-            JOIN (SELECT judge_problem.id problem_id,
-                         judge_problem.name problem_name,
-                         judge_problem.code problem_code,
-                         MAX(judge_submission.points) AS max_points
-                FROM judge_problem
-                INNER JOIN judge_submission ON (judge_problem.id = judge_submission.problem_id)
-                WHERE (judge_problem.is_public = True AND
-                       judge_submission.points IS NOT NULL AND
-                       judge_submission.user_id = %s)
-                GROUP BY judge_problem.id
-                HAVING MAX(judge_submission.points) > 0.0) AS max_points_table
-            ON (judge_submission.problem_id = max_points_table.problem_id AND
-                judge_submission.points = max_points_table.max_points AND
-                judge_submission.user_id = %s)
-            JOIN judge_language
-            ON judge_submission.language_id = judge_language.id
-            GROUP BY max_points_table.problem_id
-            ORDER BY max_points DESC, judge_submission.date DESC
-            LIMIT %s OFFSET %s
-        ''', (user.id, user.id, end - start + 1, start))
-        data = cursor.fetchall()
+    data = (BestResult.objects.filter(user=user, problem__is_public=True, points__gt=0)
+            .order_by('-points', '-submission__date')
+            .values_list('problem__code', 'problem__name', 'points', 'submission_id', 'submission__date',
+                         'submission__case_points', 'submission__case_total', 'submission__result',
+                         'submission__language__short_name', 'submission__language__key')[start:end + 1])
 
     breakdown = []
     for weight, contrib in zip(PP_WEIGHT_TABLE[start:end], data):
@@ -67,7 +41,7 @@ def get_pp_breakdown(user, start=0, end=100):
             problem_name=name,
             problem_code=code,
             sub_id=id,
-            sub_date=from_database_time(date),
+            sub_date=date,
             sub_points=case_points,
             sub_total=case_total,
             sub_short_status=result,
@@ -77,3 +51,81 @@ def get_pp_breakdown(user, start=0, end=100):
         ))
     has_more = end < min(len(PP_WEIGHT_TABLE), start + len(data))
     return breakdown, has_more
+
+
+class PerformancePointsTable(object):
+    """
+    The best points a user has on each public problem, kept sorted so that a newly graded submission
+    only has to move its own problem's entry before the totals are read off again.
+    """
+
+    def __init__(self, points=(), solved=()):
+        # Points are stored negated: ascending order, which is what bisect maintains, is then best first.
+        entries = sorted((-value, problem) for problem, value in points if value > 0)
+        self.points = array('d', [value for value, problem in entries])
+        self.problems = array('l', [problem for value, problem in entries])
+        self.solved = array('l', sorted(solved))
+
+    @classmethod
+    def from_results(cls, results):
+        """Builds the table from (problem id, points, first AC date) tuples of public problems."""
+        results = list(results)
+        return cls([(problem, points) for problem, points, first_ac in results],
+                   [problem for problem, points, first_ac in results if first_ac is not None])
+
+    def update(self, problem, points, solved):
+        """Sets the best points of a problem, returning whether anything changed."""
+        changed = False
+        try:
+            index = self.problems.index(problem)
+        except ValueError:
+            index = None
+        if index is None or -self.points[index] != points:
+            if index is not None:
+                del self.points[index]
+                del self.problems[index]
+                changed = True
+            if points > 0:
+                index = bisect_left(self.points, -points)
+                self.points.insert(index, -points)
+                self.problems.insert(index, problem)
+                changed = True
+
+        index = bisect_left(self.solved, problem)
+        was_solved = index < len(self.solved) and self.solved[index] == problem
+        if solved and not was_solved:
+            insort(self.solved, problem)
+            changed = True
+        elif was_solved and not solved:
+            del self.solved[index]
+            changed = True
+        return changed
+
+    @property
+    def total_points(self):
+        return -sum(self.points)
+
+    @property
+    def problem_count(self):
+        return len(self.points)
+
+    @property
+    def performance_points(self):
+        top = (-value for value in islice(self.points, PP_ENTRIES))
+        return sum(weight * value for weight, value in izip(PP_WEIGHT_TABLE, top)) + \
+            PP_BONUS_FUNCTION(len(self.solved))
+
+    @staticmethod
+    def cache_key(profile_id):
+        return 'user_pp_table:%d' % profile_id
+
+    @classmethod
+    def get_cached(cls, profile_id):
+        return cache.get(cls.cache_key(profile_id))
+
+    def set_cached(self, profile_id):
+        cache.set(self.cache_key(profile_id), self, 86400)
+
+    @classmethod
+    def invalidate(cls, profile_ids):
+        cache.delete_many([cls.cache_key(id) for id in profile_ids])
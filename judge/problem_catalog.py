@@ -0,0 +1,210 @@
+import time
+
+import numpy as np
+from django.conf import settings
+
+from judge.caching import bump_generation, get_generation
+from judge.models import Problem, ProblemGroup, ProblemTranslation, ProblemType
+from judge.user_translations import ugettext as user_ugettext
+
+__all__ = ['ProblemCatalog', 'ProblemCatalogList', 'get_problem_catalog', 'invalidate_problem_catalog']
+
+
+def _rank(values, ignore_case=True):
+    """Returns the position of each string in sorted order, with equal strings sharing one."""
+    if not values:
+        return np.zeros(0, dtype=np.int64)
+    if ignore_case:
+        values = [value.lower() for value in values]
+    return np.unique(np.array(values, dtype=np.unicode_), return_inverse=True)[1].astype(np.int64)
+
+
+class ProblemCatalog(object):
+    """
+    The columns of every problem that the problem list filters and sorts on, as arrays ordered by problem id, so
+    that a page of the list is found without scanning the problem table and only its own rows are fetched.
+    """
+
+    sort_columns = {
+        'points': 'points',
+        'ac_rate': 'ac_rate',
+        'user_count': 'user_count',
+        'code': 'code_rank',
+        'group': 'group_rank',
+    }
+
+    def __init__(self, generation):
+        self.generation = generation
+
+        rows = list(Problem.objects.order_by('id').values_list('id', 'code', 'name', 'points', 'group_id',
+                                                               'is_public'))
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.code_rank = _rank([row[1] for row in rows])
+        self.names = [row[2] for row in rows]
+        self.points = np.array([row[3] for row in rows], dtype=np.float64)
+        self.group = np.array([row[4] for row in rows], dtype=np.int64)
+        self.is_public = np.array([row[5] for row in rows], dtype=np.bool_)
+
+        groups = dict(ProblemGroup.objects.values_list('id', 'name'))
+        group_ids = sorted(groups)
+        self.group_rank = _rank([groups[id] for id in group_ids])[np.searchsorted(group_ids, self.group)] \
+            if group_ids else np.zeros(len(self.ids), dtype=np.int64)
+
+        types = list(ProblemType.objects.order_by('id').values_list('id', 'full_name'))
+        self.type_ids = np.array([id for id, full_name in types], dtype=np.int64)
+        self.type_names = [full_name for id, full_name in types]
+        self.types = np.zeros((len(self.ids), len(self.type_ids)), dtype=np.bool_)
+        pairs = np.array(list(Problem.types.through.objects.values_list('problem_id', 'problemtype_id')),
+                         dtype=np.int64).reshape(-1, 2)
+        self.types[self.index(pairs[:, 0]), np.searchsorted(self.type_ids, pairs[:, 1])] = True
+
+        # The type listed first, as types are ordered by name, or -1 for problems without types.
+        by_name = np.array(sorted(xrange(len(types)), key=lambda column: types[column][::-1]), dtype=np.int64)
+        self.first_type = np.where(self.types.any(axis=1), by_name[self.types[:, by_name].argmax(axis=1)], -1) \
+            if len(types) else np.full(len(self.ids), -1, dtype=np.int64)
+
+        # Authors, curators and testers can see problems that are not public.
+        pairs = np.array([pair for field in (Problem.authors, Problem.curators, Problem.testers)
+                          for pair in field.through.objects.values_list('problem_id', 'profile_id')],
+                         dtype=np.int64).reshape(-1, 2)
+        self.editor_problems = self.index(pairs[:, 0])
+        self.editor_profiles = pairs[:, 1]
+
+        self._name_ranks = {}
+        self._type_ranks = {}
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        """Reloads the statistics that grading moves with updates instead of saving the problem."""
+        stats = dict((id, (ac_rate, user_count)) for id, ac_rate, user_count in
+                     Problem.objects.values_list('id', 'ac_rate', 'user_count'))
+        missing = (0.0, 0)
+        self.ac_rate = np.array([stats.get(id, missing)[0] for id in self.ids.tolist()], dtype=np.float64)
+        self.user_count = np.array([stats.get(id, missing)[1] for id in self.ids.tolist()], dtype=np.int64)
+        self.stats_expires = time.time() + getattr(settings, 'DMOJ_PROBLEM_CATALOG_STATS_TIMEOUT', 60)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, ids):
+        """Returns the positions of problems that are known to be in the catalog."""
+        return np.searchsorted(self.ids, ids)
+
+    def positions(self, ids):
+        """Returns the positions of the problems with the given ids that are in the catalog, in the same order."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.zeros(0, dtype=np.int64)
+        positions = np.minimum(self.index(ids), len(self.ids) - 1)
+        return positions[self.ids[positions] == ids]
+
+    def contains(self, ids):
+        """Returns a mask of the problems among the given ids."""
+        return np.in1d(self.ids, np.fromiter(ids, dtype=np.int64))
+
+    def editable_by(self, profile_id):
+        mask = np.zeros(len(self.ids), dtype=np.bool_)
+        mask[self.editor_problems[self.editor_profiles == profile_id]] = True
+        return mask
+
+    def has_any_type(self, type_ids):
+        columns = np.flatnonzero(np.in1d(self.type_ids, type_ids))
+        return self.types[:, columns].any(axis=1)
+
+    def name_rank(self, language):
+        rank = self._name_ranks.get(language)
+        if rank is None:
+            names = list(self.names)
+            for id, name in ProblemTranslation.objects.filter(language=language).values_list('problem_id', 'name'):
+                index = int(self.index(id))
+                if index < len(self.ids) and self.ids[index] == id:
+                    names[index] = name
+            rank = self._name_ranks[language] = _rank(names)
+        return rank
+
+    def type_rank(self, language):
+        """
+        Ranks problems by the name of their first type, translated into the given language, which must be the
+        active one. Problems without types come first.
+        """
+        rank = self._type_ranks.get(language)
+        if rank is None:
+            names = _rank([user_ugettext(name) for name in self.type_names], ignore_case=False)
+            rank = self._type_ranks[language] = np.where(self.first_type >= 0, names[self.first_type] + 1, 0) \
+                if len(names) else np.zeros(len(self.ids), dtype=np.int64)
+        return rank
+
+    def solved_rank(self, completed, attempted):
+        """Ranks problems as not attempted, attempted and then solved."""
+        rank = self.contains(attempted).astype(np.int64)
+        rank[self.contains(completed)] = 2
+        return rank
+
+    def sort_key(self, field, language):
+        if field == 'name':
+            return self.name_rank(language)
+        if field == 'type':
+            return self.type_rank(language)
+        return getattr(self, self.sort_columns[field])
+
+    def order(self, indices, key, descending=False):
+        """Sorts positions by a value for each problem, with ties in the order of problem id."""
+        key = key[indices]
+        if descending:
+            key = -key
+        return indices[np.lexsort((self.ids[indices], key))]
+
+
+class ProblemCatalogList(object):
+    """
+    The problems at some positions of a catalog, as a sequence for a paginator. Slicing it fetches the rows of
+    the slice from the queryset, and counting it does not query at all.
+    """
+
+    batch_size = 500
+
+    def __init__(self, catalog, indices, queryset):
+        self.catalog = catalog
+        self.indices = indices
+        self.queryset = queryset
+
+    def count(self):
+        return len(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        ids = self.catalog.ids[self.indices[index]].tolist()
+        problems = {}
+        for start in xrange(0, len(ids), self.batch_size):
+            problems.update(self.queryset.in_bulk(ids[start:start + self.batch_size]))
+        return [problems[id] for id in ids if id in problems]
+
+    def order_by(self, order, language):
+        return self.order_by_key(self.catalog.sort_key(order.lstrip('-'), language), order.startswith('-'))
+
+    def order_by_key(self, key, descending=False):
+        return ProblemCatalogList(self.catalog, self.catalog.order(self.indices, key, descending), self.queryset)
+
+
+_local = {}
+
+
+def get_problem_catalog():
+    generation = get_generation('problem', 'catalog')
+    catalog = _local.get('catalog')
+    if catalog is None or catalog.generation != generation:
+        catalog = _local['catalog'] = ProblemCatalog(generation)
+    elif time.time() > catalog.stats_expires:
+        catalog.refresh_stats()
+    return catalog
+
+
+def invalidate_problem_catalog():
+    bump_generation('problem', 'catalog')
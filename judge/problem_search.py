@@ -0,0 +1,395 @@
+import cPickle as pickle
+import errno
+import logging
+import os
+import re
+import socket
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from uuid import uuid4
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+from judge.caching import append_change, read_changes, start_changes
+from judge.models import Problem, ProblemTranslation
+
+__all__ = ['SearchIndex', 'ProblemSearch', 'tokenize', 'count_tokens', 'problem_query', 'build_problem_search',
+           'get_problem_search', 'update_problem_search']
+
+logger = logging.getLogger('judge.problem_search')
+
+TOKEN_RE = re.compile(r'\w+', re.U)
+TOKEN_PART_RE = re.compile(r'\d+|[^\W\d_]+', re.U)
+
+
+def tokenize(text):
+    """Splits text into lowercase words, followed by the runs of letters and digits of words that mix them."""
+    tokens = TOKEN_RE.findall(text.lower())
+    for token in tokens[:]:
+        if not token.isalpha() and not token.isdigit():
+            parts = TOKEN_PART_RE.findall(token)
+            if len(parts) > 1:
+                tokens += parts
+    return tokens
+
+
+def count_tokens(frequencies, tokens, weight=1):
+    """Adds the weight to the frequency of each token, which is much faster than a Counter."""
+    get = frequencies.get
+    for token in tokens:
+        frequencies[token] = get(token, 0) + weight
+    return frequencies
+
+
+class SearchIndex(object):
+    """
+    An inverted index ranked with BM25. The postings of all terms are kept in a single array in the order of the
+    sorted terms, so that the postings of the terms sharing a prefix are one slice of it. Documents set since the
+    index was last compacted are held apart and hide their old postings until they are merged in.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    # Terms that only start with a searched word count for less than the word itself.
+    prefix_weight = 0.5
+
+    def __init__(self):
+        self.terms = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int64)
+        self.frequencies = np.zeros(0, dtype=np.float32)
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.changed = {}
+        self._update_totals()
+
+    def _update_totals(self):
+        self.stale = np.array(sorted(self.changed), dtype=np.int64)
+        current = ~np.in1d(self.doc_ids, self.stale)
+        changed = [frequencies for frequencies in self.changed.itervalues() if frequencies]
+        self.count = int(current.sum()) + len(changed)
+        total = float(self.lengths[current].sum()) + sum(sum(frequencies.itervalues()) for frequencies in changed)
+        self.average_length = total / self.count if self.count else 1.0
+
+    def set(self, doc, frequencies):
+        """Replaces the weighted term frequencies of a document, or removes it if they are None."""
+        self.changed[doc] = frequencies or None
+        self._update_totals()
+
+    def compact(self):
+        """Merges the documents set since the last time into the arrays."""
+        if not self.changed:
+            return
+        keep = ~np.in1d(self.docs, self.stale)
+        term_numbers = np.repeat(np.arange(len(self.terms)), np.diff(self.offsets))[keep]
+        docs = [self.docs[keep]]
+        frequencies = [self.frequencies[keep]]
+
+        terms = set(self.terms)
+        for changed in self.changed.itervalues():
+            if changed:
+                terms.update(changed)
+        terms = sorted(terms)
+        number = {term: i for i, term in enumerate(terms)}
+        term_numbers = [np.array([number[term] for term in self.terms], dtype=np.int64)[term_numbers]]
+
+        lengths = {}
+        for doc, changed in self.changed.iteritems():
+            if changed:
+                term_numbers.append(np.array([number[term] for term in changed], dtype=np.int64))
+                docs.append(np.full(len(changed), doc, dtype=np.int64))
+                frequencies.append(np.array(changed.values(), dtype=np.float32))
+                lengths[doc] = sum(changed.itervalues())
+        term_numbers, docs, frequencies = map(np.concatenate, (term_numbers, docs, frequencies))
+
+        # Terms only found in removed documents are dropped.
+        counts = np.bincount(term_numbers, minlength=len(terms))
+        used = counts > 0
+        term_numbers = (np.cumsum(used) - 1)[term_numbers]
+        order = np.lexsort((docs, term_numbers))
+        self.terms = [term for term, is_used in zip(terms, used) if is_used]
+        self.offsets = np.concatenate(([0], np.cumsum(counts[used]))).astype(np.int64)
+        self.docs = docs[order]
+        self.frequencies = frequencies[order]
+
+        current = ~np.in1d(self.doc_ids, self.stale)
+        doc_ids = np.concatenate((self.doc_ids[current], np.array(list(lengths), dtype=np.int64)))
+        doc_lengths = np.concatenate((self.lengths[current], np.array(lengths.values(), dtype=np.float32)))
+        order = np.argsort(doc_ids)
+        self.doc_ids = doc_ids[order]
+        self.lengths = doc_lengths[order]
+        self.changed = {}
+        self._update_totals()
+
+    def _document_frequency(self, term):
+        index = bisect_left(self.terms, term)
+        if index < len(self.terms) and self.terms[index] == term:
+            return int(self.offsets[index + 1] - self.offsets[index])
+        return 0
+
+    def _score(self, frequencies, document_frequencies, lengths):
+        idf = np.log1p((self.count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        return idf * frequencies * (self.k1 + 1) / (
+            frequencies + self.k1 * (1 - self.b + self.b * lengths / self.average_length))
+
+    def match(self, word):
+        """Returns the documents containing a word or a term starting with it, and the score of each."""
+        start, end = bisect_left(self.terms, word), bisect_left(self.terms, word + u'\uffff')
+        term_numbers = np.repeat(np.arange(start, end), np.diff(self.offsets[start:end + 1]))
+        docs = self.docs[self.offsets[start]:self.offsets[end]]
+        current = ~np.in1d(docs, self.stale)
+        term_numbers, docs = term_numbers[current], docs[current]
+        frequencies = self.frequencies[self.offsets[start]:self.offsets[end]][current].astype(np.float64)
+        document_frequencies = np.diff(self.offsets)[term_numbers].astype(np.float64)
+        lengths = self.lengths[np.searchsorted(self.doc_ids, docs)].astype(np.float64)
+        weights = np.where(term_numbers == start, 1.0, self.prefix_weight) \
+            if start < end and self.terms[start] == word else np.full(len(docs), self.prefix_weight)
+        scores = [self._score(frequencies, document_frequencies, lengths) * weights]
+        docs = [docs]
+
+        for doc, changed in self.changed.iteritems():
+            if not changed:
+                continue
+            length = float(sum(changed.itervalues()))
+            for term, frequency in changed.iteritems():
+                if term.startswith(word):
+                    docs.append(np.array([doc], dtype=np.int64))
+                    scores.append(self._score(float(frequency), self._document_frequency(term) + 1.0, length) *
+                                  np.array([1.0 if term == word else self.prefix_weight]))
+
+        docs, scores = np.concatenate(docs), np.concatenate(scores)
+        # A document is as good a match as the best of its terms.
+        docs, inverse = np.unique(docs, return_inverse=True)
+        best = np.zeros(len(docs))
+        np.maximum.at(best, inverse, scores)
+        return docs, best
+
+    def search(self, query):
+        """Returns the documents matching every word of the query, from the highest BM25 score to the lowest."""
+        words = sorted(set(TOKEN_RE.findall(query.lower())))
+        if not words:
+            return []
+        docs, scores = self.match(words[0])
+        for word in words[1:]:
+            other_docs, other_scores = self.match(word)
+            docs, mine, theirs = np.intersect1d(docs, other_docs, assume_unique=True, return_indices=True)
+            scores = scores[mine] + other_scores[theirs]
+        return docs[np.lexsort((docs, -scores))].tolist()
+
+
+NAME_WEIGHTS = {'code': 3, 'name': 2}
+DESCRIPTION_WEIGHT = 1
+
+
+def problem_documents(ids=None):
+    """
+    Yields the id of each problem with the weighted frequencies of the terms in its code and names, and those in
+    its code, names and descriptions, including translations.
+    """
+    problems = Problem.objects.all()
+    translations = ProblemTranslation.objects.all()
+    if ids is not None:
+        problems = problems.filter(id__in=ids)
+        translations = translations.filter(problem_id__in=ids)
+    translated = defaultdict(list)
+    for problem, name, description in translations.values_list('problem_id', 'name', 'description'):
+        translated[problem].append((name, description))
+
+    for id, code, name, description in problems.values_list('id', 'code', 'name', 'description').iterator():
+        names = count_tokens({}, tokenize(code), NAME_WEIGHTS['code'])
+        for text in [name] + [name for name, _ in translated[id]]:
+            count_tokens(names, tokenize(text), NAME_WEIGHTS['name'])
+        full = dict(names)
+        for text in [description] + [description for _, description in translated[id]]:
+            count_tokens(full, tokenize(text), DESCRIPTION_WEIGHT)
+        yield id, names, full
+
+
+class ProblemSearch(object):
+    """Search indexes of problem codes and names, and of the full text of problems."""
+
+    def __init__(self, version):
+        self.version = version
+        self.names = SearchIndex()
+        self.full = SearchIndex()
+        self.applied = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, version):
+        search = cls(version)
+        for id, names, full in problem_documents():
+            search.names.changed[id] = names
+            search.full.changed[id] = full
+        search.compact()
+        return search
+
+    def update(self, ids):
+        documents = {id: (names, full) for id, names, full in problem_documents(ids)}
+        with self.lock:
+            for id in ids:
+                names, full = documents.get(id, (None, None))
+                self.names.set(id, names)
+                self.full.set(id, full)
+            if len(self.names.changed) > PROBLEM_SEARCH_CHANGE_LIMIT:
+                self.compact()
+
+    def compact(self):
+        self.names.compact()
+        self.full.compact()
+
+    def search(self, query, full_text=False):
+        """Returns the ids of the problems matching the query, from the best match to the worst."""
+        with self.lock:
+            return (self.full if full_text else self.names).search(query)
+
+    def __getstate__(self):
+        return self.version, self.names, self.full
+
+    def __setstate__(self, state):
+        self.version, self.names, self.full = state
+        self.applied = 0
+        self.lock = threading.Lock()
+
+
+# The search index is shared between processes under a version token, with the problems changed since it was built
+# appended to a change log. Each process reindexes those problems in its own copy, and every
+# PROBLEM_SEARCH_CHANGE_LIMIT changes the process appending one saves its copy to DMOJ_PROBLEM_SEARCH_INDEX, with the
+# number of changes it includes, for new processes to load. Building an index takes seconds for thousands of
+# problems, so it is never done while serving a request: each host builds the current version in the background
+# when its file does not have it, and problems are searched with problem_query until then.
+PROBLEM_SEARCH_CHANGE_LIMIT = 200
+PROBLEM_SEARCH_TIMEOUT = 86400
+PROBLEM_SEARCH_BUILD_TIMEOUT = 600
+PROBLEM_SEARCH_VERSION_KEY = 'problem_search_version'
+PROBLEM_SEARCH_CHANGES_KEY = 'problem_search_changes'
+_local = {}
+_lock = threading.Lock()
+
+
+def problem_query(query, full_text=False):
+    """Returns a filter for the problems containing the query, for searching without the index."""
+    condition = Q(code__icontains=query) | Q(name__icontains=query) | Q(translations__name__icontains=query)
+    if full_text:
+        condition |= Q(description__icontains=query) | Q(translations__description__icontains=query)
+    return condition
+
+
+def _load(version):
+    path = settings.DMOJ_PROBLEM_SEARCH_INDEX
+    try:
+        with open(path, 'rb') as f:
+            # The header comes first, so that an index of another version is not decoded.
+            saved, applied = pickle.load(f)
+            if saved != version:
+                return None
+            search = pickle.load(f)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    search.applied = applied
+    return search
+
+
+def _save(search):
+    path = settings.DMOJ_PROBLEM_SEARCH_INDEX
+    temp = '%s.%s' % (path, uuid4().hex)
+    with open(temp, 'wb') as f:
+        pickle.dump((search.version, search.applied), f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(search, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp, path)
+
+
+def _current_version():
+    version = cache.get(PROBLEM_SEARCH_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        start_changes(PROBLEM_SEARCH_CHANGES_KEY, version, PROBLEM_SEARCH_TIMEOUT)
+        if not cache.add(PROBLEM_SEARCH_VERSION_KEY, version, PROBLEM_SEARCH_TIMEOUT):
+            version = cache.get(PROBLEM_SEARCH_VERSION_KEY, version)
+    return version
+
+
+def _build(version):
+    # The changes logged while building are applied again afterwards, since reindexing a problem is idempotent.
+    search = ProblemSearch.build(version)
+    with _lock:
+        _save(search)
+        _local['search'] = search
+    return search
+
+
+def _build_in_background(version):
+    lock_key = 'problem_search_building:%s:%s' % (socket.gethostname(), version)
+    if not cache.add(lock_key, True, PROBLEM_SEARCH_BUILD_TIMEOUT):
+        return
+
+    def build():
+        try:
+            _build(version)
+        except Exception:
+            logger.exception('Failed to build the problem search index')
+        finally:
+            cache.delete(lock_key)
+            connection.close()
+
+    thread = threading.Thread(target=build, name='problem-search-build')
+    thread.daemon = True
+    thread.start()
+
+
+def build_problem_search():
+    """Builds the current version of the index on this host, returning None if there is no file to save it to."""
+    if not settings.DMOJ_PROBLEM_SEARCH_INDEX:
+        return None
+    return _build(_current_version())
+
+
+def get_problem_search():
+    """
+    Returns the index as of the latest change, or None if it is not available yet on this host or searching without
+    the database is not set up with DMOJ_PROBLEM_SEARCH_INDEX.
+    """
+    if not settings.DMOJ_PROBLEM_SEARCH_INDEX:
+        return None
+    with _lock:
+        version = _current_version()
+        search = _local.get('search')
+        if search is None or search.version != version:
+            search = _load(version)
+            if search is None:
+                _build_in_background(version)
+                return None
+            _local['search'] = search
+
+        changes = read_changes(PROBLEM_SEARCH_CHANGES_KEY, version, search.applied)
+        if changes is None:
+            # Without the log, it cannot be known which problems changed, so the index is built again.
+            cache.delete(PROBLEM_SEARCH_VERSION_KEY)
+            return None
+        if changes:
+            search.update(set(changes))
+            search.applied += len(changes)
+        return search
+
+
+def update_problem_search(problem_id):
+    """Reindexes a problem in every process, or removes it if it was deleted."""
+    version = cache.get(PROBLEM_SEARCH_VERSION_KEY)
+    if version is None:
+        return
+    number = append_change(PROBLEM_SEARCH_CHANGES_KEY, version, problem_id, PROBLEM_SEARCH_TIMEOUT)
+    if number is None:
+        cache.delete(PROBLEM_SEARCH_VERSION_KEY)
+    elif number % PROBLEM_SEARCH_CHANGE_LIMIT == 0:
+        search = get_problem_search()
+        if search is not None:
+            with _lock, search.lock:
+                search.compact()
+                _save(search)
@@ -0,0 +1,263 @@
+import cPickle as pickle
+import zlib
+from uuid import uuid4
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from judge.caching import append_change, read_changes, start_changes
+from judge.models import Profile
+
+__all__ = ['RankIndex', 'RankedProfileList', 'RANKED_FIELDS', 'get_rank_index', 'update_rank_index',
+           'invalidate_rank_index']
+
+RANKED_FIELDS = ('performance_points', 'points', 'problem_count', 'rating')
+
+
+class RankIndex(object):
+    """
+    The values of a profile field, sorted from highest to lowest with ties ordered by profile id, as the user list
+    orders them. Profiles without a value are left out, as are those outside the organization, if one is given.
+    """
+
+    def __init__(self, field, ids, values, organization=None):
+        self.field = field
+        self.ids = ids
+        self.values = values  # negated, so that they are ascending
+        self.organization = organization
+
+    @classmethod
+    def build(cls, field, organization=None):
+        profiles = Profile.objects.filter(**{field + '__isnull': False})
+        if organization is not None:
+            profiles = profiles.filter(organizations=organization)
+        rows = np.array(list(profiles.values_list('id', field)), dtype=np.float64).reshape(-1, 2)
+        order = np.lexsort((rows[:, 0], -rows[:, 1]))
+        return cls(field, rows[order, 0].astype(np.int64), -rows[order, 1], organization)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rank(self, value, descending=True):
+        """Returns one more than the number of profiles with a higher value, or a lower one if not descending."""
+        if descending:
+            return int(np.searchsorted(self.values, -value, side='left')) + 1
+        return len(self) - int(np.searchsorted(self.values, -value, side='right')) + 1
+
+    def at(self, position, descending=True):
+        """Returns the id and value of the profile at the given position, counting from 0, in either order."""
+        if descending:
+            return int(self.ids[position]), float(-self.values[position])
+        value = self.values[len(self) - 1 - position]
+        start = np.searchsorted(self.values, value, side='left')
+        end = np.searchsorted(self.values, value, side='right')
+        # Tied profiles are ordered by id either way, so only the order of the values is reversed.
+        return int(self.ids[start + position - (len(self) - end)]), float(-value)
+
+    def position(self, id, value):
+        """Returns the number of profiles before the one with the given id and value, counting from 0."""
+        start = np.searchsorted(self.values, -value, side='left')
+        end = np.searchsorted(self.values, -value, side='right')
+        return int(start + np.searchsorted(self.ids[start:end], id))
+
+    def set(self, id, value):
+        """Moves a profile to its place for a new value, or removes it if the value is None."""
+        found = np.flatnonzero(self.ids == id)
+        if not len(found):
+            if value is not None:
+                index = self.position(id, value)
+                self.ids = np.insert(self.ids, index, id)
+                self.values = np.insert(self.values, index, -value)
+            return
+
+        old = found[0]
+        if value is None:
+            self.ids = np.delete(self.ids, old)
+            self.values = np.delete(self.values, old)
+            return
+        if self.values[old] == -value:
+            return
+
+        # Shift the profiles in between by one place instead of copying both arrays twice.
+        new = self.position(id, value)
+        if new > old:
+            new -= 1
+            self.ids[old:new] = self.ids[old + 1:new + 1]
+            self.values[old:new] = self.values[old + 1:new + 1]
+        else:
+            self.ids[new + 1:old + 1] = self.ids[new:old].copy()
+            self.values[new + 1:old + 1] = self.values[new:old].copy()
+        self.ids[new] = id
+        self.values[new] = -value
+
+    def __getstate__(self):
+        return self.field, self.ids.tostring(), self.values.tostring(), self.organization
+
+    def __setstate__(self, state):
+        field, ids, values, organization = state
+        self.__init__(field, np.fromstring(ids, dtype=np.int64), np.fromstring(values, dtype=np.float64),
+                      organization)
+
+
+class RankedProfileList(object):
+    """
+    Profiles ordered by a ranked field and then by id, as a sequence for a paginator. Slicing it seeks to the
+    first profile of the slice through the rank index, so that a deep page costs as much as the first one, and
+    the total comes from the index instead of a count. Profiles without a value come first in ascending order
+    and last in descending order, like MySQL sorts NULL. The queryset must be limited to the members of the
+    organization, if one is given.
+    """
+
+    def __init__(self, queryset, order, organization=None):
+        self.queryset = queryset
+        self.field = order.lstrip('-')
+        self.descending = order.startswith('-')
+        self.organization = organization
+        self.index = get_rank_index(self.field, organization)
+
+    @cached_property
+    def total(self):
+        # Every profile has performance points, so that index holds all of them.
+        return len(get_rank_index('performance_points', self.organization))
+
+    @cached_property
+    def unranked(self):
+        return max(self.total - len(self.index), 0)
+
+    def count(self):
+        return self.total
+
+    def __len__(self):
+        return self.total
+
+    def _ranked(self, position, limit):
+        if position >= len(self.index) or limit <= 0:
+            return []
+        id, value = self.index.at(position, self.descending)
+        field = self.field
+        if self.descending:
+            after = Q(**{field + '__lt': value}) | Q(**{field: value, 'id__gte': id}) | Q(**{field + '__isnull': True})
+        else:
+            after = Q(**{field + '__gt': value}) | Q(**{field: value, 'id__gte': id})
+        return list(self.queryset.filter(after)[:limit])
+
+    def _unranked(self, position, limit):
+        return list(self.queryset.filter(**{self.field + '__isnull': True})[position:position + limit])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        limit = (self.total if index.stop is None else index.stop) - start
+        if self.descending:
+            if start < len(self.index):
+                return self._ranked(start, limit)
+            return self._unranked(start - len(self.index), limit)
+        profiles = self._unranked(start, limit) if start < self.unranked else []
+        return profiles + self._ranked(max(start - self.unranked, 0), limit - len(profiles))
+
+    def rank(self, profile):
+        """Returns the rank of a profile in this order, shared by profiles with the same value."""
+        value = getattr(profile, self.field)
+        if value is None:
+            return len(self.index) + 1 if self.descending else 1
+        return self.index.rank(value, self.descending) + (0 if self.descending else self.unranked)
+
+
+# Like scoreboards, an index is shared between processes as a snapshot under a version token. The changes made
+# since then are appended to a change log, and every RANK_INDEX_CHANGE_LIMIT changes the process appending one
+# saves its copy as a new snapshot of the same version, with the number of changes it includes. Each process
+# remembers how many changes of the log it has applied to its own copy. A version lasts RANK_INDEX_TIMEOUT seconds
+# and is then rebuilt, which bounds how long a change that was evicted from the log can be missed.
+RANK_INDEX_CHANGE_LIMIT = 1000
+RANK_INDEX_TIMEOUT = 3600
+_local = {}
+
+
+def _name(field, organization):
+    return field if organization is None else '%s:%d' % (field, organization)
+
+
+def _version_key(name):
+    return 'rank_index_version:%s' % name
+
+
+def _data_key(name):
+    return 'rank_index_data:%s' % name
+
+
+def _changes_key(name):
+    return 'rank_index_changes:%s' % name
+
+
+def _store(index, version=None, applied=0):
+    name = _name(index.field, index.organization)
+    data = zlib.compress(pickle.dumps(index, pickle.HIGHEST_PROTOCOL), 1)
+    if version is not None:
+        cache.set(_data_key(name), (version, applied, data), RANK_INDEX_TIMEOUT)
+        return version
+    version = uuid4().hex
+    cache.set(_data_key(name), (version, 0, data), RANK_INDEX_TIMEOUT)
+    start_changes(_changes_key(name), version, RANK_INDEX_TIMEOUT)
+    cache.set(_version_key(name), version, RANK_INDEX_TIMEOUT)
+    _local[name] = [version, index, 0]
+    return version
+
+
+def _load(name):
+    version = cache.get(_version_key(name))
+    if version is None:
+        return None, None
+    local = _local.get(name)
+    if local is None or local[0] != version:
+        data = cache.get(_data_key(name))
+        if data is None or data[0] != version:
+            return version, None
+        local = _local[name] = [version, pickle.loads(zlib.decompress(data[2])), data[1]]
+
+    changes = read_changes(_changes_key(name), version, local[2])
+    if changes is None:
+        return version, None
+    for id, value in changes:
+        local[1].set(id, value)
+    local[2] += len(changes)
+    return version, local[1]
+
+
+def get_rank_index(field, organization=None):
+    version, index = _load(_name(field, organization))
+    if index is None:
+        index = RankIndex.build(field, organization)
+        _store(index)
+    return index
+
+
+def update_rank_index(field, id, value, organization=None):
+    """Moves a profile in the shared index of a field, if there is one."""
+    name = _name(field, organization)
+    version, index = _load(name)
+    if index is None:
+        return
+    # The change is applied again in its place in the log, which puts right any change to the same profile that
+    # another process appended before it and this one has not read yet.
+    index.set(id, value)
+    number = append_change(_changes_key(name), version, (id, value), RANK_INDEX_TIMEOUT)
+    if number is None:
+        # Without the log, it cannot be known what the other processes have applied, so they start over.
+        invalidate_rank_index(field, organization=organization)
+        return
+    local = _local[name]
+    if local[2] == number - 1:
+        local[2] = number
+    if number % RANK_INDEX_CHANGE_LIMIT == 0:
+        _store(index, version, local[2])
+
+
+def invalidate_rank_index(*fields, **kwargs):
+    organization = kwargs.get('organization')
+    for field in fields or RANKED_FIELDS:
+        name = _name(field, organization)
+        cache.delete(_version_key(name))
+        _local.pop(name, None)
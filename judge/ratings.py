@@ -1,10 +1,14 @@
 import math
 from bisect import bisect
-from itertools import izip
+from collections import defaultdict
+from itertools import groupby, izip
 from operator import itemgetter
 
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
 from django.db import connection, transaction
-from django.db.models import Count
+from django.db.models import Case, Count, IntegerField, Value, When
 from django.utils import timezone
 
 from judge.utils.ranker import tie_ranker
@@ -36,6 +40,94 @@ def WP(RA, RB, VA, VB):
     return (math.erf((RB - RA) / math.sqrt(2 * (VA * VA + VB * VB))) + 1) / 2.0
 
 
+# The error function exactly as CPython computes math.erf, a series for small arguments and a continued fraction
+# for the complement otherwise, so that the vectorized ratings round to the same integers as WP would give.
+ERF_SERIES_CUTOFF = 1.5
+ERF_SERIES_TERMS = 25
+ERFC_CONTFRAC_CUTOFF = 30.0
+ERFC_CONTFRAC_TERMS = 50
+SQRT_PI = 1.772453850905516027298167483341145182798
+
+# The number of pairs of players to compute at once, small enough for the arrays to stay in the processor's cache.
+RATING_BLOCK_SIZE = 1 << 16
+
+
+# Both are computed in place, in the same order of operations as CPython.
+def _erf_series(x):
+    x2 = x * x
+    acc = np.zeros_like(x)
+    fk = ERF_SERIES_TERMS + 0.5
+    for i in xrange(ERF_SERIES_TERMS):
+        acc *= x2
+        acc /= fk
+        acc += 2.0
+        fk -= 1.0
+    acc *= x
+    acc *= np.exp(-x2)
+    acc /= SQRT_PI
+    return acc
+
+
+def _erfc_contfrac(x):
+    x2 = x * x
+    a, da = 0.0, 0.5
+    p, p_last = np.ones_like(x), np.zeros_like(x)
+    q, q_last = da + x2, np.ones_like(x)
+    b = np.empty_like(x)
+    for i in xrange(ERFC_CONTFRAC_TERMS):
+        a += da
+        da += 2.0
+        np.add(x2, da, out=b)
+        # b * p - a * p_last, reusing the array of p_last for the result.
+        p_last *= -a
+        p_last += b * p
+        p, p_last = p_last, p
+        q_last *= -a
+        q_last += b * q
+        q, q_last = q_last, q
+    p /= q
+    p *= x
+    p *= np.exp(-x2)
+    p /= SQRT_PI
+    p[x >= ERFC_CONTFRAC_CUTOFF] = 0.0
+    return p
+
+
+def erf(x):
+    absx = np.abs(x)
+    result = np.empty_like(x)
+    series = absx < ERF_SERIES_CUTOFF
+    result[series] = _erf_series(x[series])
+    contfrac = ~series
+    cf = _erfc_contfrac(absx[contfrac])
+    result[contfrac] = np.where(x[contfrac] > 0.0, 1.0 - cf, cf - 1.0)
+    return result
+
+
+def expected_ranks(rating, volatility):
+    """
+    Returns 0.5 plus the sum of WP against every player, including themselves, for each player, added in the same
+    order as a loop over the players would. Players with the same rating and volatility have the same expected
+    rank, so it is only computed once for each distinct pair.
+    """
+    players, group = np.unique(np.column_stack((np.array(rating, dtype=np.float64),
+                                                np.array(volatility, dtype=np.float64))),
+                               axis=0, return_inverse=True)
+    R, V = players[:, 0], players[:, 1]
+    V2 = V * V
+    result = np.empty(len(players))
+    block = max(RATING_BLOCK_SIZE // len(players), 1)
+    for start in xrange(0, len(players), block):
+        end = start + block
+        x = (R[np.newaxis, :] - R[start:end, np.newaxis]) / \
+            np.sqrt(2 * (V2[start:end, np.newaxis] + V2[np.newaxis, :]))
+        wins = ((erf(x.ravel()) + 1) / 2.0).reshape(x.shape)[:, group]
+        # A cumulative sum adds one term at a time, unlike sum, which adds pairwise and would round differently.
+        wins[:, 0] += 0.5
+        result[start:end] = np.cumsum(wins, axis=1)[:, -1]
+    return result[group].tolist()
+
+
 def recalculate_ratings(old_rating, old_volatility, actual_rank, times_rated):
     # actual_rank: 1 is first place, N is last place
     # if there are ties, use the average of places (if places 2, 3, 4, 5 tie, use 3.5 for all of them)
@@ -54,11 +146,9 @@ def recalculate_ratings(old_rating, old_volatility, actual_rank, times_rated):
     sum2 = sum((i - ave_rating) ** 2 for i in old_rating) / (N - 1)
     CF = math.sqrt(sum1 + sum2)
 
+    ERanks = expected_ranks(old_rating, old_volatility)
     for i in xrange(N):
-        ERank = 0.5
-        for j in xrange(N):
-            ERank += WP(old_rating[i], old_rating[j], old_volatility[i], old_volatility[j])
-
+        ERank = ERanks[i]
         EPerf = -normal_CDF_inverse((ERank - 0.5) / N)
         APerf = -normal_CDF_inverse((actual_rank[i] - 0.5) / N)
         PerfAs = old_rating[i] + CF * (APerf - EPerf)
@@ -92,8 +182,36 @@ def recalculate_ratings(old_rating, old_volatility, actual_rank, times_rated):
     return map(int, map(round, new_rating)), map(int, map(round, new_volatility))
 
 
+def rate_participations(users, history):
+    """
+    Rates participations given as (id, user id, score, cumtime), ordered from best to worst, from the rating,
+    volatility and number of ratings of each user before the contest, as history maps users to them.
+    """
+    users = list(tie_ranker(users, key=itemgetter(2, 3)))
+    participation_ids = [user[1][0] for user in users]
+    user_ids = [user[1][1] for user in users]
+    ranking = map(itemgetter(0), users)
+    old_data = [history.get(user, (1200, 535, 0)) for user in user_ids]
+    old_rating = map(itemgetter(0), old_data)
+    old_volatility = map(itemgetter(1), old_data)
+    times_ranked = map(itemgetter(2), old_data)
+    rating, volatility = recalculate_ratings(old_rating, old_volatility, ranking, times_ranked)
+    return participation_ids, user_ids, ranking, old_rating, old_volatility, times_ranked, rating, volatility
+
+
+def rated_participations(contest):
+    """Returns the participations of a contest that are rated, as rate_participations takes them."""
+    users = contest.users.order_by('-score', 'cumtime', 'id').annotate(submissions=Count('submission')) \
+                   .exclude(user_id__in=contest.rate_exclude.all()).filter(virtual=0)\
+                   .values_list('id', 'user_id', 'score', 'cumtime')
+    if not contest.rate_all:
+        users = users.filter(submissions__gt=0)
+    return users
+
+
 def rate_contest(contest):
     from judge.models import Rating, Profile
+    from judge.rank_index import invalidate_rank_index
 
     cursor = connection.cursor()
     cursor.execute('''
@@ -116,20 +234,8 @@ def rate_contest(contest):
     data = {user: (rating, volatility, times) for user, rating, volatility, times in cursor.fetchall()}
     cursor.close()
 
-    users = contest.users.order_by('-score', 'cumtime').annotate(submissions=Count('submission')) \
-                   .exclude(user_id__in=contest.rate_exclude.all()).filter(virtual=0)\
-                   .values_list('id', 'user_id', 'score', 'cumtime')
-    if not contest.rate_all:
-        users = users.filter(submissions__gt=0)
-    users = list(tie_ranker(users, key=itemgetter(2, 3)))
-    participation_ids = [user[1][0] for user in users]
-    user_ids = [user[1][1] for user in users]
-    ranking = map(itemgetter(0), users)
-    old_data = [data.get(user, (1200, 535, 0)) for user in user_ids]
-    old_rating = map(itemgetter(0), old_data)
-    old_volatility = map(itemgetter(1), old_data)
-    times_ranked = map(itemgetter(2), old_data)
-    rating, volatility = recalculate_ratings(old_rating, old_volatility, ranking, times_ranked)
+    participation_ids, user_ids, ranking, old_rating, old_volatility, times_ranked, rating, volatility = \
+        rate_participations(rated_participations(contest), data)
 
     now = timezone.now()
     ratings = [Rating(user_id=id, contest=contest, rating=r, volatility=v, last_rated=now, participation_id=p, rank=z)
@@ -146,9 +252,147 @@ def rate_contest(contest):
         ''' % Profile._meta.db_table)
     cursor.execute('DROP TABLE _profile_rating_update')
     cursor.close()
+    invalidate_rank_index('rating')
     return old_rating, old_volatility, ranking, times_ranked, rating, volatility
 
 
+def rating_history(before=None, users=None):
+    """
+    Returns the latest rating and volatility and the number of ratings of every user, or of the given user ids, as
+    rate_participations takes them, from the stored ratings of the contests that ended before the given time, or of
+    all contests.
+    """
+    from judge.models import Rating
+
+    ratings = Rating.objects.all()
+    if before is not None:
+        ratings = ratings.filter(contest__end_time__lt=before)
+    if users is not None:
+        ratings = ratings.filter(user_id__in=users)
+    history = {}
+    for user, rating, volatility in ratings.order_by('contest__end_time', 'contest_id') \
+                                          .values_list('user_id', 'rating', 'volatility'):
+        history[user] = rating, volatility, history.get(user, (0, 0, 0))[2] + 1
+    return history
+
+
+def rate_contests(since=None, batch_size=50, progress=None):
+    """
+    Rates every rated contest that ended at or after the given time, or all of them, as rate_contest would one at a
+    time in order of their end times, but in a single pass: the participations and the ratings of the earlier
+    contests are loaded once, the contests are replayed in memory, and the ratings are written batch_size contests
+    at a time, each batch in its own transaction. Contests ending at the same time do not see each other's ratings,
+    and a batch never splits them, so that an interrupted run can be continued from the ratings it stored.
+
+    Calls progress with the number of contests rated so far and the total after each batch, and returns the number
+    of ratings stored.
+    """
+    from judge.models import Contest, ContestParticipation, Profile, Rating
+    from judge.rank_index import invalidate_rank_index
+
+    contests = Contest.objects.filter(is_rated=True)
+    if since is not None:
+        contests = contests.filter(end_time__gte=since)
+    contests = list(contests.order_by('end_time', 'id').values_list('id', 'end_time', 'rate_all'))
+    rate_all = {id: value for id, end_time, value in contests}
+
+    participations = ContestParticipation.objects.filter(contest__is_rated=True, virtual=0)
+    excluded = Contest.rate_exclude.through.objects.filter(contest__is_rated=True)
+    if since is not None:
+        participations = participations.filter(contest__end_time__gte=since)
+        excluded = excluded.filter(contest__end_time__gte=since)
+    excluded = set(excluded.values_list('contest_id', 'profile_id'))
+    users = defaultdict(list)
+    for contest, id, user, score, cumtime, submissions in \
+            participations.annotate(submissions=Count('submission')) \
+                          .order_by('contest_id', '-score', 'cumtime', 'id') \
+                          .values_list('contest_id', 'id', 'user_id', 'score', 'cumtime', 'submissions'):
+        if (contest, user) not in excluded and (submissions or rate_all[contest]):
+            users[contest].append((id, user, score, cumtime))
+
+    with transaction.atomic():
+        if since is not None:
+            Rating.objects.filter(contest__end_time__gte=since).delete()
+        elif connection.vendor == 'sqlite':
+            Rating.objects.all().delete()
+        else:
+            cursor = connection.cursor()
+            cursor.execute('TRUNCATE TABLE `%s`' % Rating._meta.db_table)
+            cursor.close()
+    history = rating_history(since)
+
+    done = pending = stored = 0
+    batch = []
+    for end_time, group in groupby(contests, key=itemgetter(1)):
+        group = [contest[0] for contest in group]
+        rated = {id: rate_participations(users[id], history) for id in group}
+        for id in group:
+            participation_ids, user_ids, ranking, old_rating, old_volatility, times_ranked, rating, volatility = \
+                rated[id]
+            for user, r, v in izip(user_ids, rating, volatility):
+                history[user] = r, v, history.get(user, (0, 0, 0))[2] + 1
+            batch += [Rating(user_id=user, contest_id=id, participation_id=p, rank=z, rating=r, volatility=v)
+                      for user, p, z, r, v in izip(user_ids, participation_ids, ranking, rating, volatility)]
+        done += len(group)
+        pending += len(group)
+
+        if done == len(contests) or pending >= batch_size:
+            now = timezone.now()
+            for obj in batch:
+                obj.last_rated = now
+            with transaction.atomic():
+                for start in xrange(0, len(batch), 1000):
+                    Rating.objects.bulk_create(batch[start:start + 1000])
+            stored += len(batch)
+            batch = []
+            pending = 0
+            if progress is not None:
+                progress(done, len(contests))
+
+    # Every profile takes its latest rating, or none if it was never rated.
+    latest = {user: data[0] for user, data in history.iteritems()}
+    changed = [(id, latest.get(id)) for id, rating in Profile.objects.values_list('id', 'rating')
+               if rating != latest.get(id)]
+    for start in xrange(0, len(changed), 1000):
+        chunk = changed[start:start + 1000]
+        Profile.objects.filter(id__in=[id for id, rating in chunk]).update(
+            rating=Case(*[When(id=id, then=Value(rating)) for id, rating in chunk], output_field=IntegerField()),
+        )
+    invalidate_rank_index('rating')
+    return stored
+
+
+def provisional_rating_changes(contest):
+    """
+    Rates a contest by the current scores of its participations without storing anything, and returns the ratings
+    before and after the contest of each rated participation by id.
+    """
+    users = list(rated_participations(contest))
+    history = rating_history(contest.end_time, users=[user[1] for user in users])
+    participation_ids, user_ids, ranking, old_rating, old_volatility, times_ranked, rating, volatility = \
+        rate_participations(users, history)
+    return dict(izip(participation_ids, izip(old_rating, rating)))
+
+
+# Provisional rating changes are computed by the update_provisional_ratings worker every
+# DMOJ_PROVISIONAL_RATING_INTERVAL seconds and only read from the cache by views, so that a ranking page never
+# runs the rating calculation itself. They expire if the worker stops updating them.
+def _provisional_key(contest_id):
+    return 'provisional_ratings:%d' % contest_id
+
+
+def get_provisional_ratings(contest):
+    """Returns when the provisional rating changes of a contest were computed and the changes, or None."""
+    return cache.get(_provisional_key(contest.id))
+
+
+def update_provisional_ratings(contest):
+    changes = provisional_rating_changes(contest)
+    interval = getattr(settings, 'DMOJ_PROVISIONAL_RATING_INTERVAL', 60)
+    cache.set(_provisional_key(contest.id), (timezone.now(), changes), interval * 10)
+    return changes
+
+
 RATING_LEVELS = ['Newbie', 'Amateur', 'Expert', 'Candidate Master', 'Master', 'Grandmaster', 'Target']
 RATING_VALUES = [1000, 1200, 1500, 1800, 2200, 3000]
 RATING_CLASS = ['rate-newbie', 'rate-amateur', 'rate-expert', 'rate-candidate-master',
@@ -0,0 +1,60 @@
+import threading
+from collections import defaultdict
+
+__all__ = ['begin_request_memo', 'end_request_memo', 'request_memo_active', 'memoized', 'prime', 'request_memo_stats']
+
+_local = threading.local()
+
+
+def begin_request_memo():
+    _local.memo = {}
+    _local.hits = defaultdict(int)
+    _local.misses = defaultdict(int)
+    _local.primed = defaultdict(int)
+
+
+def end_request_memo():
+    _local.__dict__.clear()
+
+
+def request_memo_active():
+    return getattr(_local, 'memo', None) is not None
+
+
+def memoized(namespace, key, compute):
+    """
+    Returns what compute returns, remembered under the namespace and key until the end of the current request.
+    Outside of requests, compute is always called.
+    """
+    memo = getattr(_local, 'memo', None)
+    if memo is None:
+        return compute()
+    try:
+        value = memo[namespace, key]
+    except KeyError:
+        _local.misses[namespace] += 1
+        value = memo[namespace, key] = compute()
+    else:
+        _local.hits[namespace] += 1
+    return value
+
+
+def prime(namespace, values):
+    """Remembers many (key, value) pairs computed at once, such as the result of a check for each row of a list."""
+    memo = getattr(_local, 'memo', None)
+    if memo is None:
+        return
+    for key, value in values:
+        memo[namespace, key] = value
+        _local.primed[namespace] += 1
+
+
+def request_memo_stats():
+    """
+    Returns (namespace, hits, misses, primed) for the current request. Every hit is a check that did not query the
+    database, and primed counts the values that were computed by a query for a whole list.
+    """
+    if getattr(_local, 'memo', None) is None:
+        return []
+    return [(namespace, _local.hits[namespace], _local.misses[namespace], _local.primed[namespace])
+            for namespace in sorted(set(_local.hits) | set(_local.misses) | set(_local.primed))]
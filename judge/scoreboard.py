@@ -0,0 +1,394 @@
+import cPickle as pickle
+import zlib
+from bisect import bisect_left, insort
+from collections import OrderedDict, namedtuple
+from itertools import izip
+from uuid import uuid4
+
+import numpy as np
+from django.core.cache import cache
+
+from judge.caching import append_change, read_changes, start_changes
+from judge.models import ContestProblemResult, ContestSubmission
+
+__all__ = ['ScoreboardEntry', 'Scoreboard', 'Timeline', 'get_scoreboard', 'update_scoreboard', 'invalidate_scoreboard',
+           'get_timeline']
+
+# cells maps a contest problem id to (best points, seconds from the start of the participation to the last
+# submission), which is what a ranking cell shows.
+ScoreboardEntry = namedtuple('ScoreboardEntry', 'id user_id username points cumtime cells')
+
+
+class Scoreboard(object):
+    """
+    The live participants of a contest, ordered by (-points, cumtime) and kept in that order as their scores
+    change, so that a ranking can be served without aggregating anything.
+    """
+
+    def __init__(self, contest_id, entries=()):
+        self.contest_id = contest_id
+        self.entries = {entry.id: entry for entry in entries}
+        self.keys = sorted(map(self._key, self.entries.itervalues()))
+
+    @staticmethod
+    def _key(entry):
+        return -entry.points, entry.cumtime, entry.id
+
+    @classmethod
+    def build(cls, contest):
+        cells = {}
+        participations = list(contest.users.filter(virtual=0).select_related('user__user')
+                              .only('id', 'contest', 'real_start', 'virtual', 'score', 'cumtime',
+                                    'user__user__username'))
+        for participation in participations:
+            participation.contest = contest
+        starts = {participation.id: participation.start for participation in participations}
+        for participation, problem, points, last in (
+                ContestProblemResult.objects.filter(participation__contest=contest, participation__virtual=0)
+                                    .values_list('participation_id', 'problem_id', 'points', 'last_submission')):
+            cells.setdefault(participation, {})[problem] = (points, (last - starts[participation]).total_seconds())
+        return cls(contest.id, [ScoreboardEntry(
+            id=participation.id, user_id=participation.user_id, username=participation.user.user.username,
+            points=participation.score, cumtime=participation.cumtime, cells=cells.get(participation.id, {}),
+        ) for participation in participations])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return (self.entries[key[2]] for key in self.keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.entries[key[2]] for key in self.keys[index]]
+        return self.entries[self.keys[index][2]]
+
+    def __contains__(self, participation_id):
+        return participation_id in self.entries
+
+    def index(self, participation_id):
+        """Returns the position of a participation, counting from 0."""
+        return bisect_left(self.keys, self._key(self.entries[participation_id]))
+
+    def rank(self, participation_id):
+        """Returns the rank of a participation, shared with everyone that has the same points and cumtime."""
+        entry = self.entries[participation_id]
+        return bisect_left(self.keys, (-entry.points, entry.cumtime)) + 1
+
+    def set(self, entry):
+        self.remove(entry.id)
+        self.entries[entry.id] = entry
+        insort(self.keys, self._key(entry))
+
+    def remove(self, participation_id):
+        entry = self.entries.pop(participation_id, None)
+        if entry is not None:
+            del self.keys[bisect_left(self.keys, self._key(entry))]
+
+    def update(self, participation):
+        """Re-reads the score and result cells of a participation, returning its new entry."""
+        start = participation.start
+        current = self.entries.get(participation.id)
+        entry = ScoreboardEntry(
+            id=participation.id, user_id=participation.user_id,
+            username=current.username if current is not None else participation.user.user.username,
+            points=participation.score, cumtime=participation.cumtime,
+            cells={problem: (points, (last - start).total_seconds()) for problem, points, last in
+                   participation.results.values_list('problem_id', 'points', 'last_submission')},
+        )
+        self.set(entry)
+        return entry
+
+    def __getstate__(self):
+        return self.contest_id, map(tuple, self.entries.itervalues())
+
+    def __setstate__(self, state):
+        contest_id, entries = state
+        self.__init__(contest_id, map(ScoreboardEntry._make, entries))
+
+
+class Timeline(object):
+    """
+    Every submission of the live participants of a contest as a log of score changes, sorted by the time since
+    the start of the participation it was made at. The standings at any time are the sums of the changes made
+    before it, which lets virtual participants be ranked against the live ones at the same point of the contest.
+    """
+
+    def __init__(self, contest_id, participations, problems, elapsed, participation, problem, points, cumtime):
+        self.contest_id = contest_id
+        self.participations = participations  # participation ids, which the participation column indexes
+        self.problems = problems  # contest problem ids, which the problem column indexes
+        self.elapsed = elapsed  # seconds from the start of the participation, ascending
+        self.participation = participation
+        self.problem = problem
+        self.points = points  # increase of the best points on the problem
+        self.cumtime = cumtime  # increase of the time of the last scored submission on the problem
+
+    @classmethod
+    def build(cls, contest):
+        participations = list(contest.users.filter(virtual=0).only('id', 'contest', 'real_start', 'virtual'))
+        for participation in participations:
+            participation.contest = contest
+        starts = {participation.id: participation.start for participation in participations}
+        index = {participation.id: i for i, participation in enumerate(participations)}
+        problems = list(contest.contest_problems.values_list('id', flat=True))
+        problem_index = {problem: i for i, problem in enumerate(problems)}
+
+        events = sorted(((date - starts[participation]).total_seconds(), index[participation],
+                         problem_index[problem], points)
+                        for participation, problem, points, date in
+                        ContestSubmission.objects.filter(participation__contest=contest, participation__virtual=0)
+                                         .values_list('participation_id', 'problem_id', 'points', 'submission__date'))
+
+        # Turn the points of every submission into the change it made to its participation's best points and
+        # cumulative time, the same way ContestProblemResult keeps them.
+        best, scored = {}, {}
+        changes = []
+        for elapsed, participation, problem, points in events:
+            cell = participation, problem
+            points = points or 0
+            gained = max(points - best.get(cell, 0), 0)
+            best[cell] = best.get(cell, 0) + gained
+            cumtime = 0
+            if points > 0:
+                cumtime = elapsed - scored.get(cell, 0)
+                scored[cell] = elapsed
+            changes.append((gained, cumtime))
+
+        return cls(contest.id, np.array([participation.id for participation in participations], dtype=np.int32),
+                   np.array(problems, dtype=np.int32),
+                   np.array([event[0] for event in events], dtype=np.float64),
+                   np.array([event[1] for event in events], dtype=np.int32),
+                   np.array([event[2] for event in events], dtype=np.int16),
+                   np.array([change[0] for change in changes], dtype=np.float64),
+                   np.array([change[1] for change in changes], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.elapsed)
+
+    def _count(self, elapsed):
+        return np.searchsorted(self.elapsed, elapsed, side='right')
+
+    def standings(self, elapsed):
+        """Returns the points and cumulative time of every participation after the given number of seconds."""
+        count = self._count(elapsed)
+        size = len(self.participations)
+        participation = self.participation[:count]
+        points = np.bincount(participation, weights=self.points[:count], minlength=size)
+        cumtime = np.bincount(participation, weights=self.cumtime[:count], minlength=size)
+        return points.astype(np.int64), cumtime.astype(np.int64)
+
+    def rank(self, elapsed, points, cumtime):
+        """Returns the rank that the given points and cumulative time would have after the given number of seconds."""
+        scores, cumtimes = self.standings(elapsed)
+        return int(np.count_nonzero((scores > points) | ((scores == points) & (cumtimes < cumtime)))) + 1
+
+    def scoreboard(self, elapsed, live):
+        """
+        Returns the scoreboard after the given number of seconds, taking the users of its entries from live. The
+        cells of the entries are left empty, since only the shown entries need them; see cells().
+        """
+        scores, cumtimes = self.standings(elapsed)
+        return Scoreboard(self.contest_id, [
+            # Positional arguments, since keyword arguments make building a namedtuple several times slower.
+            ScoreboardEntry(id, live.entries[id].user_id, live.entries[id].username, points, cumtime, {})
+            for id, points, cumtime in izip(self.participations.tolist(), scores.tolist(), cumtimes.tolist())
+            if id in live.entries
+        ])
+
+    def cells(self, elapsed, entries):
+        """Returns the given entries with their cells as they were after the given number of seconds."""
+        count = self._count(elapsed)
+        shown = np.in1d(self.participations, [entry.id for entry in entries])
+        events = np.flatnonzero(shown[self.participation[:count]])
+
+        # The time shown in a cell is that of the last submission to it, and the points are the sum of the gains.
+        width = len(self.problems)
+        keys = self.participation[events].astype(np.int64) * width + self.problem[events]
+        cells, inverse = np.unique(keys, return_inverse=True)
+        best = np.bincount(inverse, weights=self.points[events], minlength=len(cells))
+        last = np.zeros(len(cells), dtype=np.intp)
+        np.maximum.at(last, inverse, events)
+
+        results = {}
+        for cell, points, elapsed in izip(cells.tolist(), best.tolist(), self.elapsed[last].tolist()):
+            participation, problem = divmod(cell, width)
+            results.setdefault(int(self.participations[participation]), {})[int(self.problems[problem])] = \
+                (points, elapsed)
+        return [entry._replace(cells=results.get(entry.id, {})) for entry in entries]
+
+    def __getstate__(self):
+        return (self.contest_id, self.participations, self.problems, self.elapsed, self.participation,
+                self.problem, self.points, self.cumtime)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+# Memcached refuses items over 1 MB by default, which the pickle of a large contest's scoreboard can reach, so
+# pickles are stored in chunks below that. The key itself holds the version they belong to and how many there are.
+CACHE_CHUNK_SIZE = 512 * 1024
+
+
+def _set_pickle(key, version, value):
+    data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1)
+    chunks = {'%s:%d' % (key, index): (version, data[start:start + CACHE_CHUNK_SIZE])
+              for index, start in enumerate(xrange(0, len(data), CACHE_CHUNK_SIZE))}
+    cache.set_many(chunks, 86400)
+    cache.set(key, (version, len(chunks)), 86400)
+
+
+def _get_pickle(key, version):
+    """Returns the value stored under the key with the given version, or None if any of it is missing."""
+    head = cache.get(key)
+    if head is None or head[0] != version:
+        return None
+    keys = ['%s:%d' % (key, index) for index in xrange(head[1])]
+    chunks = cache.get_many(keys)
+    if len(chunks) != len(keys) or any(chunks[chunk][0] != version for chunk in keys):
+        return None
+    return pickle.loads(zlib.decompress(''.join(chunks[chunk][1] for chunk in keys)))
+
+
+def _recall(store, contest_id):
+    value = store.pop(contest_id, None)
+    if value is not None:
+        store[contest_id] = value
+    return value
+
+
+def _remember(store, contest_id, value, limit):
+    store.pop(contest_id, None)
+    store[contest_id] = value
+    while len(store) > limit:
+        store.popitem(last=False)
+
+
+# A scoreboard is shared between processes as a compressed pickle under a version token, which is too large to
+# write out on every graded submission. Entries changed since then are instead appended to a change log, and every
+# SCOREBOARD_CHANGE_LIMIT changes the process appending one writes its copy out again as a snapshot of the same
+# version, with the number of changes it includes. Each process keeps the last scoreboard it decoded for the
+# SCOREBOARD_LOCAL_LIMIT contests it used most recently, with the number of changes it has applied to it.
+SCOREBOARD_CHANGE_LIMIT = 100
+SCOREBOARD_LOCAL_LIMIT = 8
+_local = OrderedDict()
+
+
+def _version_key(contest_id):
+    return 'contest_scoreboard_version:%d' % contest_id
+
+
+def _data_key(contest_id):
+    return 'contest_scoreboard_data:%d' % contest_id
+
+
+def _changes_key(contest_id):
+    return 'contest_scoreboard_changes:%d' % contest_id
+
+
+def _load(contest_id):
+    version = cache.get(_version_key(contest_id))
+    if version is None:
+        return None, None
+    local = _recall(_local, contest_id)
+    if local is None or local[0] != version:
+        data = _get_pickle(_data_key(contest_id), version)
+        if data is None:
+            return version, None
+        local = [version, data[1], data[0]]
+        _remember(_local, contest_id, local, SCOREBOARD_LOCAL_LIMIT)
+
+    changes = read_changes(_changes_key(contest_id), version, local[2])
+    if changes is None:
+        return version, None
+    for entry in changes:
+        local[1].set(ScoreboardEntry._make(entry))
+    local[2] += len(changes)
+    return version, local[1]
+
+
+def _store(scoreboard, version=None, applied=0):
+    if version is not None:
+        _set_pickle(_data_key(scoreboard.contest_id), version, (applied, scoreboard))
+        return
+    version = uuid4().hex
+    _set_pickle(_data_key(scoreboard.contest_id), version, (0, scoreboard))
+    start_changes(_changes_key(scoreboard.contest_id), version, 86400)
+    cache.set(_version_key(scoreboard.contest_id), version, 86400)
+    _remember(_local, scoreboard.contest_id, [version, scoreboard, 0], SCOREBOARD_LOCAL_LIMIT)
+
+
+def get_scoreboard(contest):
+    version, scoreboard = _load(contest.id)
+    if scoreboard is None:
+        scoreboard = Scoreboard.build(contest)
+        _store(scoreboard)
+    return scoreboard
+
+
+def update_scoreboard(participation):
+    """Moves a live participation to its new place on the shared scoreboard, if there is one."""
+    if participation.virtual != 0:
+        return
+    if participation.contest.ended:
+        invalidate_timeline(participation.contest_id)
+    version, scoreboard = _load(participation.contest_id)
+    if scoreboard is None:
+        return
+    # The entry is set again in its place in the log, which puts right any change to the same participation that
+    # another process appended before it and this one has not read yet.
+    entry = scoreboard.update(participation)
+    number = append_change(_changes_key(participation.contest_id), version, tuple(entry), 86400)
+    if number is None:
+        # Without the log, it cannot be known what the other processes have applied, so they start over.
+        invalidate_scoreboard(participation.contest_id)
+        return
+    local = _local.get(participation.contest_id)
+    if local is None or local[0] != version:
+        return
+    if local[2] == number - 1:
+        local[2] = number
+    if number % SCOREBOARD_CHANGE_LIMIT == 0:
+        _store(scoreboard, version, local[2])
+
+
+def invalidate_scoreboard(contest_id):
+    cache.delete(_version_key(contest_id))
+    _local.pop(contest_id, None)
+    invalidate_timeline(contest_id)
+
+
+# Timelines are only served for contests that have ended, which is also when virtual participants use them, so they
+# are built on demand and dropped whenever a live participation is scored again by a rejudge, instead of being kept
+# up to date. Each process keeps those of the TIMELINE_LOCAL_LIMIT contests it used most recently.
+TIMELINE_LOCAL_LIMIT = 4
+_timelines = OrderedDict()
+
+
+def _timeline_version_key(contest_id):
+    return 'contest_timeline_version:%d' % contest_id
+
+
+def _timeline_data_key(contest_id):
+    return 'contest_timeline_data:%d' % contest_id
+
+
+def get_timeline(contest):
+    version = cache.get(_timeline_version_key(contest.id))
+    local = _recall(_timelines, contest.id)
+    if version is not None and local is not None and local[0] == version:
+        return local[1]
+
+    timeline = _get_pickle(_timeline_data_key(contest.id), version) if version is not None else None
+    if timeline is None:
+        timeline = Timeline.build(contest)
+        version = uuid4().hex
+        _set_pickle(_timeline_data_key(contest.id), version, timeline)
+        cache.set(_timeline_version_key(contest.id), version, 86400)
+    _remember(_timelines, contest.id, (version, timeline), TIMELINE_LOCAL_LIMIT)
+    return timeline
+
+
+def invalidate_timeline(contest_id):
+    cache.delete(_timeline_version_key(contest_id))
+    _timelines.pop(contest_id, None)
@@ -1,17 +1,22 @@
 import errno
 import os
+import threading
 
 from django.conf import settings
-from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 
-from .caching import finished_submission
+from .caching import bump_generation, finished_submission
 from .models import Problem, Contest, Submission, Organization, Profile, MiscConfig, Language, Judge, \
-    BlogPost, ContestSubmission, Comment, License, EFFECTIVE_MATH_ENGINES
+    BlogPost, ContestSubmission, ContestParticipation, Comment, License, BestResult, ContestProblemResult, \
+    ProblemActivity, ProblemGroup, ProblemTranslation, ProblemType
+from .problem_catalog import invalidate_problem_catalog
+from .problem_search import update_problem_search
+from .rank_index import RANKED_FIELDS, invalidate_rank_index, update_rank_index
+from .scoreboard import invalidate_scoreboard, update_scoreboard
 
 
 def get_pdf_path(basename):
@@ -26,21 +31,25 @@ def unlink_if_exists(file):
             raise
 
 
+# The problems being deleted in this thread. Their submissions are deleted along with them, and the statistics and
+# activity of the problem go with it, so nothing is taken out of them.
+_deleting = threading.local()
+
+
+def _problems_being_deleted():
+    if not hasattr(_deleting, 'problems'):
+        _deleting.problems = set()
+    return _deleting.problems
+
+
 @receiver(post_save, sender=Problem)
 def problem_update(sender, instance, **kwargs):
     if hasattr(instance, '_updating_stats_only'):
         return
 
-    cache.delete_many([
-        make_template_fragment_key('submission_problem', (instance.id,)),
-        make_template_fragment_key('problem_feed', (instance.id,)),
-        'problem_tls:%s' % instance.id, 'problem_mls:%s' % instance.id,
-    ])
-    cache.delete_many([make_template_fragment_key('problem_html', (instance.id, engine, lang))
-                       for lang, _ in settings.LANGUAGES for engine in EFFECTIVE_MATH_ENGINES])
-    cache.delete_many([make_template_fragment_key('problem_authors', (instance.id, lang))
-                       for lang, _ in settings.LANGUAGES])
-    cache.delete_many(['generated-meta-problem:%s:%d' % (lang, instance.id) for lang, _ in settings.LANGUAGES])
+    bump_generation('problem', instance.id)
+    invalidate_problem_catalog()
+    update_problem_search(instance.id)
 
     if hasattr(settings, 'PROBLEM_PDF_CACHE'):
         for lang, _ in settings.LANGUAGES:
@@ -48,15 +57,71 @@ def problem_update(sender, instance, **kwargs):
             unlink_if_exists(get_pdf_path('%s.%s.log' % (instance.code, lang)))
 
 
+@receiver(pre_delete, sender=Problem)
+def problem_pre_delete(sender, instance, **kwargs):
+    _problems_being_deleted().add(instance.id)
+
+
+@receiver(post_delete, sender=Problem)
+def problem_delete(sender, instance, **kwargs):
+    _problems_being_deleted().discard(instance.id)
+    invalidate_problem_catalog()
+    update_problem_search(instance.id)
+
+
+@receiver(post_save, sender=ProblemTranslation)
+@receiver(post_delete, sender=ProblemTranslation)
+def problem_translation_update(sender, instance, **kwargs):
+    invalidate_problem_catalog()
+    update_problem_search(instance.problem_id)
+
+
+@receiver(post_save, sender=ProblemGroup)
+@receiver(post_save, sender=ProblemType)
+def problem_catalog_update(sender, **kwargs):
+    invalidate_problem_catalog()
+
+
+@receiver(m2m_changed, sender=Problem.types.through)
+@receiver(m2m_changed, sender=Problem.authors.through)
+@receiver(m2m_changed, sender=Problem.curators.through)
+@receiver(m2m_changed, sender=Problem.testers.through)
+def problem_catalog_relation_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_problem_catalog()
+
+
 @receiver(post_save, sender=Profile)
-def profile_update(sender, instance, **kwargs):
+def profile_update(sender, instance, created, **kwargs):
+    if created:
+        for field in RANKED_FIELDS:
+            update_rank_index(field, instance.id, getattr(instance, field))
+
     if hasattr(instance, '_updating_stats_only'):
         return
 
-    cache.delete_many([make_template_fragment_key('user_about', (instance.id, engine))
-                       for engine in EFFECTIVE_MATH_ENGINES] +
-                      [make_template_fragment_key('org_member_count', (org_id,))
-                       for org_id in instance.organizations.values_list('id', flat=True)])
+    bump_generation('profile', instance.id)
+
+
+@receiver(post_delete, sender=Profile)
+def profile_delete(sender, instance, **kwargs):
+    for field in RANKED_FIELDS:
+        update_rank_index(field, instance.id, None)
+
+
+@receiver(m2m_changed, sender=Profile.organizations.through)
+def profile_organizations_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # The member rankings of the organizations are rebuilt when next shown.
+    if action in ('post_add', 'post_remove', 'post_clear') and reverse:
+        organizations = [instance.id]
+    elif action in ('post_add', 'post_remove'):
+        organizations = pk_set
+    elif action == 'pre_clear' and not reverse:
+        organizations = instance.organizations.values_list('id', flat=True)
+    else:
+        return
+    for organization in organizations:
+        invalidate_rank_index('performance_points', organization=organization)
 
 
 @receiver(post_save, sender=Contest)
@@ -64,9 +129,31 @@ def contest_update(sender, instance, **kwargs):
     if hasattr(instance, '_updating_stats_only'):
         return
 
-    cache.delete_many(['generated-meta-contest:%d' % instance.id] +
-                      [make_template_fragment_key('contest_html', (instance.id, engine))
-                       for engine in EFFECTIVE_MATH_ENGINES])
+    bump_generation('contest', instance.id)
+    bump_generation('contest', 'calendar')
+    invalidate_scoreboard(instance.id)
+    instance.reset_ranks()
+
+
+@receiver(post_save, sender=ContestParticipation)
+def contest_participation_update(sender, instance, **kwargs):
+    # Scores changed while grading and new participants are placed on the scoreboard directly, since everyone
+    # joining at the start of a contest would otherwise rebuild it each time; any other change rebuilds it.
+    if hasattr(instance, '_updating_stats_only'):
+        return
+    if kwargs.get('created'):
+        update_scoreboard(instance)
+    else:
+        invalidate_scoreboard(instance.contest_id)
+    if instance.virtual == 0 and instance.contest.ended:
+        instance.contest.reset_ranks()
+
+
+@receiver(post_delete, sender=ContestParticipation)
+def contest_participation_delete(sender, instance, **kwargs):
+    invalidate_scoreboard(instance.contest_id)
+    if instance.virtual == 0:
+        Contest(id=instance.contest_id).reset_ranks()
 
 
 @receiver(post_save, sender=License)
@@ -92,39 +179,47 @@ def comment_update(sender, instance, **kwargs):
 
 @receiver(post_save, sender=BlogPost)
 def post_update(sender, instance, **kwargs):
-    cache.delete_many([
-        make_template_fragment_key('post_summary', (instance.id,)),
-        'blog_slug:%d' % instance.id,
-        'blog_feed:%d' % instance.id,
-    ])
-    cache.delete_many([make_template_fragment_key('post_content', (instance.id, engine))
-                       for engine in EFFECTIVE_MATH_ENGINES])
+    bump_generation('post', instance.id)
+    cache.delete('blog_slug:%d' % instance.id)
+
+
+@receiver(post_save, sender=Submission)
+def submission_create(sender, instance, created, **kwargs):
+    if created:
+        Problem.adjust_stats(instance.problem_id, submissions=1, accepted=int(instance.result == 'AC'))
+        ProblemActivity.record(instance.problem_id, instance.date, user_id=instance.user_id)
 
 
 @receiver(post_delete, sender=Submission)
 def submission_delete(sender, instance, **kwargs):
     finished_submission(instance)
+    if instance.problem_id not in _problems_being_deleted():
+        Problem.adjust_stats(instance.problem_id, submissions=-1, accepted=-int(instance.result == 'AC'))
+        ProblemActivity.record(instance.problem_id, instance.date, result=instance.result, count=-1)
+    BestResult.recalculate(instance.user_id, instance.problem_id)
     instance.user.calculate_points()
 
 
+@receiver(post_save, sender=ContestSubmission)
+def contest_submission_create(sender, instance, created, **kwargs):
+    if created:
+        ContestProblemResult.recalculate(instance.participation_id, instance.problem_id)
+
+
 @receiver(post_delete, sender=ContestSubmission)
 def contest_submission_delete(sender, instance, **kwargs):
+    ContestProblemResult.recalculate(instance.participation_id, instance.problem_id)
     participation = instance.participation
     participation.recalculate_score()
+    participation.update_cumtime()
 
 
 @receiver(post_save, sender=Organization)
 def organization_update(sender, instance, **kwargs):
-    cache.delete_many([make_template_fragment_key('organization_html', (instance.id, engine))
-                       for engine in EFFECTIVE_MATH_ENGINES])
-
-
-_misc_config_i18n = [code for code, _ in settings.LANGUAGES]
-_misc_config_i18n.append('')
+    bump_generation('organization', instance.id)
 
 
 @receiver(post_save, sender=MiscConfig)
 def misc_config_update(sender, instance, **kwargs):
-    cache.delete_many(['misc_config:%s:%s:%s' % (domain, lang, instance.key.split('.')[0])
-                       for lang in _misc_config_i18n
-                       for domain in Site.objects.values_list('domain', flat=True)])
+    # Keys may be prefixed with a domain and suffixed with a language.
+    bump_generation('misc_config', instance.key.split(':')[-1].split('.')[0])
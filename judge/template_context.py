@@ -6,6 +6,7 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.core.cache import cache
 from django.utils.functional import SimpleLazyObject, new_method_proxy
 
+from judge.caching import get_generation
 from judge.utils.caniuse import CanIUse, SUPPORT
 from .models import Profile, MiscConfig, NavigationBar
 
@@ -80,7 +81,7 @@ class MiscConfigDict(dict):
         super(MiscConfigDict, self).__init__()
 
     def __missing__(self, key):
-        cache_key = 'misc_config:%s:%s:%s' % (self.site, self.language, key)
+        cache_key = 'misc_config:%s:%s:%s:%d' % (self.site, self.language, key, get_generation('misc_config', key))
         value = cache.get(cache_key)
         if value is None:
             keys = ['%s.%s' % (key, self.language), key] if self.language else [key]
@@ -1,3 +1,269 @@
-from django.test import TestCase
+import copy
+import math
+import random
+import threading
+import time
+from datetime import datetime
+from operator import mul
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from judge import ratings, scoreboard
+from judge.caching import cached_computation
+from judge.performance_points import PerformancePointsTable, PP_BONUS_FUNCTION, PP_WEIGHT_TABLE
+from judge.scoreboard import Scoreboard, ScoreboardEntry
+
+
+class PerformancePointsTableTest(SimpleTestCase):
+    @staticmethod
+    def expected(best, solved):
+        # The formula Profile.calculate_points used over the full list of best results.
+        data = sorted((points for points in best.itervalues() if points > 0), reverse=True)
+        entries = min(len(data), len(PP_WEIGHT_TABLE))
+        return (sum(data), len(data),
+                sum(map(mul, PP_WEIGHT_TABLE[:entries], data[:entries])) + PP_BONUS_FUNCTION(len(solved)))
+
+    def assertMatches(self, table, best, solved):
+        self.assertEqual((table.total_points, table.problem_count, table.performance_points),
+                         self.expected(best, solved))
+
+    def test_incremental_matches_full_calculation(self):
+        rng = random.Random(1210)
+        for trial in xrange(50):
+            problems = rng.randint(1, 300)
+            best, solved = {}, set()
+            table = PerformancePointsTable()
+            for step in xrange(500):
+                problem = rng.randint(1, problems)
+                points = rng.choice([0, 0.5, 1, rng.randint(1, 50), rng.random() * 50, best.get(problem, 0)])
+                is_solved = rng.random() < 0.3
+                best[problem] = points
+                if is_solved:
+                    solved.add(problem)
+                else:
+                    solved.discard(problem)
+                table.update(problem, points, is_solved)
+                self.assertMatches(table, best, solved)
+
+            rebuilt = PerformancePointsTable(best.iteritems(), solved)
+            self.assertMatches(rebuilt, best, solved)
+            self.assertEqual(rebuilt.points, table.points)
+
+    def test_update_reports_changes(self):
+        table = PerformancePointsTable([(1, 10), (2, 5)], [1])
+        self.assertFalse(table.update(1, 10, True))
+        self.assertTrue(table.update(2, 7, False))
+        self.assertTrue(table.update(2, 7, True))
+        self.assertTrue(table.update(3, 0, True))
+        self.assertFalse(table.update(4, 0, False))
+        self.assertEqual(list(table.problems), [1, 2])
+
+
+class RatingsTest(SimpleTestCase):
+    @staticmethod
+    def expected(old_rating, old_volatility, actual_rank, times_rated):
+        # The loop recalculate_ratings used before the expected ranks were vectorized.
+        N = len(old_rating)
+        new_rating = old_rating[:]
+        new_volatility = old_volatility[:]
+        if N <= 1:
+            return new_rating, new_volatility
+
+        ave_rating = float(sum(old_rating)) / N
+        sum1 = sum(i * i for i in old_volatility) / N
+        sum2 = sum((i - ave_rating) ** 2 for i in old_rating) / (N - 1)
+        CF = math.sqrt(sum1 + sum2)
+
+        for i in xrange(N):
+            ERank = 0.5
+            for j in xrange(N):
+                ERank += ratings.WP(old_rating[i], old_rating[j], old_volatility[i], old_volatility[j])
+
+            EPerf = -ratings.normal_CDF_inverse((ERank - 0.5) / N)
+            APerf = -ratings.normal_CDF_inverse((actual_rank[i] - 0.5) / N)
+            PerfAs = old_rating[i] + CF * (APerf - EPerf)
+            Weight = 1.0 / (1 - (0.42 / (times_rated[i] + 1) + 0.18)) - 1.0
+            if old_rating[i] > 2500:
+                Weight *= 0.8
+            elif old_rating[i] >= 2000:
+                Weight *= 0.9
+
+            Cap = 150.0 + 1500.0 / (times_rated[i] + 2)
+
+            if times_rated[i] == 0:
+                new_volatility[i] = 385
+            else:
+                new_volatility[i] = math.sqrt(((new_rating[i] - old_rating[i]) ** 2) / Weight +
+                                              (old_volatility[i] ** 2) / (Weight + 1))
+            new_rating[i] = (old_rating[i] + Weight * PerfAs) / (1.0 + Weight)
+            if abs(old_rating[i] - new_rating[i]) > Cap:
+                if old_rating[i] < new_rating[i]:
+                    new_rating[i] = old_rating[i] + Cap
+                else:
+                    new_rating[i] = old_rating[i] - Cap
+
+        adjust = float(sum(old_rating) - sum(new_rating)) / N
+        new_rating = map(adjust.__add__, new_rating)
+        best_rank = min(actual_rank)
+        for i in xrange(N):
+            if abs(actual_rank[i] - best_rank) <= 1e-3 and new_rating[i] < old_rating[i] + 1:
+                new_rating[i] = old_rating[i] + 1
+        return map(int, map(round, new_rating)), map(int, map(round, new_volatility))
+
+    @staticmethod
+    def contest(rng, N):
+        old_rating, old_volatility, times_rated = [], [], []
+        for i in xrange(N):
+            if rng.random() < 0.3:
+                old_rating.append(1200)
+                old_volatility.append(535)
+                times_rated.append(0)
+            else:
+                old_rating.append(int(rng.gauss(1500, 600)))
+                old_volatility.append(rng.randint(100, 600))
+                times_rated.append(rng.randint(1, 50))
+
+        # Rank them by a noisy performance, with ties sharing the average of their places.
+        scores = sorted((rng.randint(0, N // 3) for i in xrange(N)), reverse=True)
+        actual_rank = []
+        for score in scores:
+            first = scores.index(score) + 1
+            actual_rank.append((first + first + scores.count(score) - 1) / 2.0)
+        return old_rating, old_volatility, actual_rank, times_rated
+
+    def test_erf_matches_math(self):
+        rng = np.random.RandomState(1210)
+        x = np.concatenate([rng.uniform(-3, 3, 20000), rng.uniform(-40, 40, 20000),
+                            [0.0, 1.5, -1.5, np.nextafter(1.5, 0), 30.0, -30.0, 5e-324]])
+        self.assertEqual(ratings.erf(x).tolist(), map(math.erf, x.tolist()))
+
+    def test_matches_loop(self):
+        rng = random.Random(1210)
+        old_block_size = ratings.RATING_BLOCK_SIZE
+        try:
+            for trial in xrange(40):
+                N = rng.choice([1, 2, 3, rng.randint(4, 50), rng.randint(50, 300)])
+                ratings.RATING_BLOCK_SIZE = rng.choice([1, 7 * N, 1 << 20])
+                args = self.contest(rng, N)
+                self.assertEqual(ratings.recalculate_ratings(*args), self.expected(*args))
+        finally:
+            ratings.RATING_BLOCK_SIZE = old_block_size
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'cached-computation-test'}})
+class CachedComputationTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(None)
+            time.sleep(0.2)
+            return len(calls)
+
+        results = [None] * 20
+
+        def worker(i):
+            results[i] = cached_computation('test', compute, 60)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [1] * len(results))
+
+    def test_serves_stale_while_recomputing(self):
+        cache.set('test', ('old', 0, time.time() - 1), 60)
+        started, finish = threading.Event(), threading.Event()
+
+        def compute():
+            started.set()
+            finish.wait(5)
+            return 'new'
+
+        thread = threading.Thread(target=cached_computation, args=('test', compute, 60))
+        thread.start()
+        started.wait(5)
+        self.assertEqual(cached_computation('test', lambda: 'other', 60), 'old')
+        finish.set()
+        thread.join()
+        self.assertEqual(cached_computation('test', lambda: 'other', 60), 'new')
+
+    def test_early_recomputation(self):
+        cache.set('test', ('old', 1e-3, time.time() + 60), 120)
+        self.assertEqual(cached_computation('test', lambda: 'new', 60), 'old')
+        # Values that took long to compute are recomputed well before they expire.
+        cache.set('test', ('old', 1e6, time.time() + 60), 120)
+        self.assertEqual(cached_computation('test', lambda: 'new', 60), 'new')
+
+
+class FakeResults(object):
+    def values_list(self, *fields):
+        return []
+
+
+class FakeParticipation(object):
+    """Just what update_scoreboard reads from a participation without results."""
+
+    def __init__(self, contest_id, id, score):
+        self.contest_id = contest_id
+        self.contest = self
+        self.ended = False
+        self.virtual = 0
+        self.id = id
+        self.user_id = id
+        self.score = score
+        self.cumtime = 0
+        self.start = datetime(2020, 1, 1)
+        self.results = FakeResults()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'scoreboard-test'}})
+class ScoreboardTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        scoreboard._local.clear()
+        scoreboard._store(Scoreboard(1, [ScoreboardEntry(id, id, 'user%d' % id, 0, 0, {}) for id in xrange(1, 5)]))
+
+    def update_as(self, local, id, score):
+        """Updates the scoreboard as a process that has the given local copies would."""
+        scoreboard._local.clear()
+        scoreboard._local.update(local)
+        scoreboard.update_scoreboard(FakeParticipation(1, id, score))
+        local.clear()
+        local.update(scoreboard._local)
+
+    def test_interleaved_updates(self):
+        # Both processes load the scoreboard before either updates it, so the second does not see the first change.
+        first, second = copy.deepcopy(scoreboard._local), copy.deepcopy(scoreboard._local)
+        self.update_as(first, 2, 50)
+        self.update_as(second, 3, 70)
+
+        for local in (first, second, {}):
+            scoreboard._local.clear()
+            scoreboard._local.update(local)
+            board = scoreboard._load(1)[1]
+            self.assertEqual([entry.id for entry in board], [3, 2, 1, 4])
+            self.assertEqual([entry.points for entry in board], [70, 50, 0, 0])
+
+    def test_snapshot_keeps_changes(self):
+        first, second = copy.deepcopy(scoreboard._local), copy.deepcopy(scoreboard._local)
+        limit = scoreboard.SCOREBOARD_CHANGE_LIMIT
+        scoreboard.SCOREBOARD_CHANGE_LIMIT = 2
+        try:
+            self.update_as(first, 2, 50)
+            # This update is the second change, so this process writes a snapshot without the first one applied.
+            self.update_as(second, 3, 70)
+            self.update_as(first, 4, 90)
+        finally:
+            scoreboard.SCOREBOARD_CHANGE_LIMIT = limit
+        scoreboard._local.clear()
+        self.assertEqual([entry.id for entry in scoreboard._load(1)[1]], [4, 3, 2, 1])
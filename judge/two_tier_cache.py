@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+__all__ = ['TwoTierCache', 'DEFAULT_LOCAL_PREFIXES']
+
+# Small values read on most requests whose keys either never change meaning or include a generation from
+# judge.caching, so a copy that is a few seconds old is as good as the shared one. The generations themselves are
+# kept locally too, which is what lets the versioned keys be served without a round trip: an invalidation reaches
+# other processes once their copy of the generation expires.
+DEFAULT_LOCAL_PREFIXES = (
+    'generation:', 'misc_config:', 'lang:cn_map', 'problem_tls:', 'problem_mls:', 'mathoid:css:',
+    'generated-meta-',
+)
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class LocalTier(object):
+    """The process-local LRU of a TwoTierCache, shared by the instances Django creates for each thread."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+
+    def get(self, key, prefix):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                del self.entries[key]
+                self.entries[key] = entry
+                self.hits[prefix] = self.hits.get(prefix, 0) + 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses[prefix] = self.misses.get(prefix, 0) + 1
+        return None
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + timeout, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TwoTierCache(BaseCache):
+    """
+    Serves the keys starting with one of LOCAL_PREFIXES from a bounded per-process LRU, in front of the cache named
+    by LOCATION, which holds everything and takes every write. Local copies live for LOCAL_TIMEOUT seconds at most,
+    so they must only be used for keys that tolerate being that stale, or whose keys change when they are
+    invalidated. Configured like any other backend:
+
+        CACHES = {
+            'shared': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '...'},
+            'default': {
+                'BACKEND': 'judge.two_tier_cache.TwoTierCache',
+                'LOCATION': 'shared',
+                'OPTIONS': {'LOCAL_TIMEOUT': 5, 'LOCAL_MAX_ENTRIES': 10000},
+            },
+        }
+
+    KEY_PREFIX, VERSION and TIMEOUT are those of the shared cache.
+    """
+
+    def __init__(self, location, params):
+        super(TwoTierCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = location
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.local_prefixes = tuple(options.get('LOCAL_PREFIXES', DEFAULT_LOCAL_PREFIXES))
+        with _tiers_lock:
+            if location not in _tiers:
+                _tiers[location] = LocalTier(options.get('LOCAL_MAX_ENTRIES', 10000))
+            self.local = _tiers[location]
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_prefix(self, key):
+        for prefix in self.local_prefixes:
+            if key.startswith(prefix):
+                return prefix
+        return None
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def _store(self, key, value, timeout, version):
+        timeout = self._local_timeout(timeout)
+        if timeout > 0:
+            self.local.set((key, version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), timeout)
+        else:
+            self.local.delete((key, version))
+
+    def get(self, key, default=None, version=None):
+        prefix = self._local_prefix(key)
+        if prefix is None:
+            return self.shared.get(key, default, version)
+        pickled = self.local.get((key, version), prefix)
+        if pickled is not None:
+            return pickle.loads(pickled)
+        value = self.shared.get(key, self, version)
+        if value is self:
+            return default
+        self._store(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        result = {}
+        remote = []
+        for key in keys:
+            prefix = self._local_prefix(key)
+            pickled = self.local.get((key, version), prefix) if prefix is not None else None
+            if pickled is not None:
+                result[key] = pickle.loads(pickled)
+            else:
+                remote.append(key)
+        if remote:
+            fetched = self.shared.get_many(remote, version)
+            for key, value in fetched.iteritems():
+                if self._local_prefix(key) is not None:
+                    self._store(key, value, DEFAULT_TIMEOUT, version)
+            result.update(fetched)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        if self._local_prefix(key) is not None:
+            self._store(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        for key, value in data.iteritems():
+            if self._local_prefix(key) is not None:
+                self._store(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if self._local_prefix(key) is not None:
+            if added:
+                self._store(key, value, timeout, version)
+            else:
+                # Another process got there first, so the next read has to see its value.
+                self.local.delete((key, version))
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        try:
+            value = self.shared.incr(key, delta, version)
+        except ValueError:
+            self.local.delete((key, version))
+            raise
+        if self._local_prefix(key) is not None:
+            self._store(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version)
+
+    def has_key(self, key, version=None):
+        prefix = self._local_prefix(key)
+        if prefix is not None and self.local.get((key, version), prefix) is not None:
+            return True
+        return self.shared.has_key(key, version)
+
+    def delete(self, key, version=None):
+        self.shared.delete(key, version)
+        self.local.delete((key, version))
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version)
+        for key in keys:
+            self.local.delete((key, version))
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        """Returns the hits and misses of the local tier of this process, overall and by prefix."""
+        with self.local.lock:
+            hits, misses = dict(self.local.hits), dict(self.local.misses)
+            entries, evictions = len(self.local.entries), self.local.evictions
+        total_hits, total_misses = sum(hits.itervalues()), sum(misses.itervalues())
+        return {
+            'hits': total_hits,
+            'misses': total_misses,
+            'hit_rate': float(total_hits) / (total_hits + total_misses) if total_hits + total_misses else None,
+            'entries': entries,
+            'evictions': evictions,
+            'prefixes': {prefix: (hits.get(prefix, 0), misses.get(prefix, 0))
+                         for prefix in set(hits) | set(misses)},
+        }
@@ -1,24 +1,35 @@
-from django.core.cache import cache
 from django.template.defaultfilters import truncatewords
 
+from judge.caching import cached_computation, get_generation
 from judge.jinja2.markdown import markdown
 from judge.jinja2.reference import reference
 
 
 def generate_opengraph(cache_key, data, style):
-    metadata = cache.get(cache_key)
-    if metadata is None:
-        description = None
-        tree = reference(markdown(data, style)).tree
-        for p in tree.iterfind('.//p'):
-            text = p.text_content().strip()
-            if text:
-                description = text
-                break
-        if description:
-            for remove in (r'\[', r'\]', r'\(', r'\)'):
-                description = description.replace(remove, '')
-        img = tree.xpath('.//img')
-        metadata = truncatewords(description, 60), img[0].get('src') if img else None
-        cache.set(cache_key, metadata, 86400)
-    return metadata
+    return cached_computation(cache_key, lambda: _generate_opengraph(data, style), 86400)
+
+
+def problem_opengraph(problem, language, description):
+    return generate_opengraph('generated-meta-problem:%s:%d:%d' % (language, problem.id,
+                                                                   get_generation('problem', problem.id)),
+                              description, 'problem')
+
+
+def contest_opengraph(contest):
+    return generate_opengraph('generated-meta-contest:%d:%d' % (contest.id, get_generation('contest', contest.id)),
+                              contest.description, 'contest')
+
+
+def _generate_opengraph(data, style):
+    description = None
+    tree = reference(markdown(data, style)).tree
+    for p in tree.iterfind('.//p'):
+        text = p.text_content().strip()
+        if text:
+            description = text
+            break
+    if description:
+        for remove in (r'\[', r'\]', r'\(', r'\)'):
+            description = description.replace(remove, '')
+    img = tree.xpath('.//img')
+    return truncatewords(description, 60), img[0].get('src') if img else None
@@ -0,0 +1,63 @@
+import numpy as np
+
+__all__ = ['ProblemIdSet', 'AttemptedProblems', 'encode_ids', 'decode_ids']
+
+IDS_BITMAP = 0
+IDS_ARRAY_TYPES = {1: '<u2', 2: '<u4'}
+
+
+def encode_ids(ids):
+    """Encodes problem ids as a sorted array of the smallest integers that fit or a bitmap, whichever is smaller."""
+    ids = np.unique(np.fromiter(ids, dtype=np.int64))
+    if not len(ids):
+        return 1, b''
+    kind = 1 if ids[-1] < 1 << 16 else 2
+    if (int(ids[-1]) >> 3) + 1 >= np.dtype(IDS_ARRAY_TYPES[kind]).itemsize * len(ids):
+        return kind, ids.astype(IDS_ARRAY_TYPES[kind]).tostring()
+    bits = np.zeros(int(ids[-1]) + 1, dtype=np.bool_)
+    bits[ids] = True
+    return IDS_BITMAP, np.packbits(bits).tostring()
+
+
+def decode_ids(kind, data):
+    if kind == IDS_BITMAP:
+        return np.flatnonzero(np.unpackbits(np.frombuffer(data, dtype=np.uint8))).tolist()
+    return np.frombuffer(data, dtype=IDS_ARRAY_TYPES[kind]).tolist()
+
+
+def _decode_id_set(kind, data):
+    return ProblemIdSet(decode_ids(kind, data))
+
+
+def _decode_attempted(kind, data, achieved_points, max_points):
+    return AttemptedProblems(zip(decode_ids(kind, data), np.frombuffer(achieved_points, dtype='<f8').tolist(),
+                                 np.frombuffer(max_points, dtype='<f8').tolist()))
+
+
+class ProblemIdSet(set):
+    """A set of problem ids which is cached as a few hundred bytes instead of a pickled set."""
+
+    def __reduce__(self):
+        return _decode_id_set, encode_ids(self)
+
+
+class AttemptedProblems(dict):
+    """
+    The points achieved on attempted problems, by problem id, which is cached as the encoded ids and an array of
+    points for each of them.
+    """
+
+    def __init__(self, points=()):
+        super(AttemptedProblems, self).__init__()
+        for id, achieved_points, max_points in points:
+            self.set_points(id, achieved_points, max_points)
+
+    def set_points(self, id, achieved_points, max_points):
+        self[id] = {'achieved_points': achieved_points, 'max_points': max_points}
+
+    def __reduce__(self):
+        ids = sorted(self)
+        return _decode_attempted, encode_ids(ids) + (
+            np.array([self[id]['achieved_points'] for id in ids], dtype='<f8').tostring(),
+            np.array([self[id]['max_points'] for id in ids], dtype='<f8').tostring(),
+        )
@@ -1,13 +1,14 @@
 from collections import defaultdict
 from math import e
 
-from django.core.cache import cache
-from django.db.models import F, Count, Max, Q, ExpressionWrapper, Case, When
-from django.db.models.fields import FloatField
+from django.db.models import F, Count, Max, Q
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 
-from judge.models import Submission, Problem
+from judge.caching import bump_generation, cached_computation, carry_computation, get_generation
+from judge.models import Submission, Problem, BestResult, ProblemActivity
+from judge.utils.hyperloglog import hll_count
+from judge.utils.problem_sets import AttemptedProblems, ProblemIdSet
 
 __all__ = ['contest_completed_ids', 'user_completed_ids', 'user_authored_ids', 'user_editable_ids']
 
@@ -24,49 +25,92 @@ def user_editable_ids(profile):
 
 
 def contest_completed_ids(participation):
-    key = 'contest_complete:%d' % participation.id
-    result = cache.get(key)
-    if result is None:
-        result = set(participation.submissions.filter(submission__result='AC', points=F('problem__points'))
-                     .values_list('problem__problem__id', flat=True).distinct())
-        cache.set(key, result, 86400)
-    return result
+    key = 'contest_complete:%d:%d' % (participation.id, get_generation('solved', participation.user_id))
+    return cached_computation(key, lambda: ProblemIdSet(
+        participation.submissions.filter(submission__result='AC', points=F('problem__points'))
+        .values_list('problem__problem__id', flat=True).distinct()
+    ), 86400)
 
 
 def user_completed_ids(profile):
-    key = 'user_complete:%d' % profile.id
-    result = cache.get(key)
-    if result is None:
-        result = set(Submission.objects.filter(user=profile, result='AC', points=F('problem__points'))
-                     .values_list('problem_id', flat=True).distinct())
-        cache.set(key, result, 86400)
-    return result
+    key = 'user_complete:%d:%d' % (profile.id, get_generation('solved', profile.id))
+    return cached_computation(key, lambda: ProblemIdSet(
+        BestResult.objects.filter(user=profile, first_ac_date__isnull=False, points=F('problem__points'))
+        .values_list('problem_id', flat=True)
+    ), 86400)
 
 
 def contest_attempted_ids(participation):
-    key = 'contest_attempted:%s' % participation.id
-    result = cache.get(key)
-    if result is None:
-        result = {id: {'achieved_points': points, 'max_points': max_points}
-                  for id, max_points, points in (participation.submissions
-                                                 .values_list('problem__problem__id', 'problem__points')
-                                                 .annotate(points=Max('points'))
-                                                 .filter(points__lt=F('problem__points')))}
-        cache.set(key, result, 86400)
-    return result
+    key = 'contest_attempted:%d:%d' % (participation.id, get_generation('solved', participation.user_id))
+    return cached_computation(key, lambda: AttemptedProblems(
+        (id, points, max_points) for id, max_points, points in
+        (participation.submissions.values_list('problem__problem__id', 'problem__points')
+         .annotate(points=Max('points')).filter(points__lt=F('problem__points')))
+    ), 86400)
 
 
 def user_attempted_ids(profile):
-    key = 'user_attempted:%s' % profile.id
-    result = cache.get(key)
-    if result is None:
-        result = {id: {'achieved_points': points, 'max_points': max_points}
-                  for id, max_points, points in (Submission.objects.filter(user=profile)
-                                                 .values_list('problem__id', 'problem__points')
-                                                 .annotate(points=Max('points'))
-                                                 .filter(points__lt=F('problem__points')))}
-        cache.set(key, result, 86400)
-    return result
+    key = 'user_attempted:%d:%d' % (profile.id, get_generation('solved', profile.id))
+    return cached_computation(key, lambda: AttemptedProblems(
+        BestResult.objects.filter(user=profile, points__lt=F('problem__points'))
+        .values_list('problem_id', 'points', 'problem__points')
+    ), 86400)
+
+
+def update_solved_problems(submission, best_result):
+    """
+    Invalidates the problems completed and attempted by the user of a graded submission. A freshly graded
+    submission can only change them for its own problem, so the cached ones are carried over to the new
+    generation with just that problem updated rather than computed again.
+    """
+    generation = bump_generation('solved', submission.user_id)
+    if generation is None or submission.was_rejudged:
+        return
+    old, new = generation - 1, generation
+    problem = submission.problem
+
+    def update_completed(completed):
+        if best_result is not None and best_result.first_ac_date is not None and \
+                best_result.points == problem.points:
+            completed.add(problem.id)
+        return completed
+
+    def update_attempted(attempted):
+        if best_result is not None:
+            if best_result.points < problem.points:
+                attempted.set_points(problem.id, best_result.points, problem.points)
+            else:
+                attempted.pop(problem.id, None)
+        return attempted
+
+    carry_computation('user_complete:%d:%d' % (submission.user_id, old),
+                      'user_complete:%d:%d' % (submission.user_id, new), update_completed)
+    carry_computation('user_attempted:%d:%d' % (submission.user_id, old),
+                      'user_attempted:%d:%d' % (submission.user_id, new), update_attempted)
+
+    if not hasattr(submission, 'contest'):
+        return
+    contest = submission.contest
+    participation_id = contest.participation_id
+    achieved_points = (contest.participation.submissions.filter(problem_id=contest.problem_id)
+                       .aggregate(points=Max('points'))['points'])
+
+    def update_contest_completed(completed):
+        if submission.result == 'AC' and contest.points == contest.problem.points:
+            completed.add(problem.id)
+        return completed
+
+    def update_contest_attempted(attempted):
+        if achieved_points is not None and achieved_points < contest.problem.points:
+            attempted.set_points(problem.id, achieved_points, contest.problem.points)
+        else:
+            attempted.pop(problem.id, None)
+        return attempted
+
+    carry_computation('contest_complete:%d:%d' % (participation_id, old),
+                      'contest_complete:%d:%d' % (participation_id, new), update_contest_completed)
+    carry_computation('contest_attempted:%d:%d' % (participation_id, old),
+                      'contest_attempted:%d:%d' % (participation_id, new), update_contest_attempted)
 
 
 def get_result_table(*args, **kwargs):
@@ -100,35 +144,31 @@ def editable_problems(user, profile=None):
 
 
 def hot_problems(duration, limit):
-    cache_key = 'hot_problems:%d:%d' % (duration.total_seconds(), limit)
-    qs = cache.get(cache_key)
-    if qs is None:
-        qs = Problem.objects.filter(is_public=True, submission__date__gt=timezone.now() - duration, points__gt=3, points__lt=25)
-        qs0 = qs.annotate(k=Count('submission__user', distinct=True)).order_by('-k').values_list('k', flat=True)
-        
-        if not qs0:
-            return []
-        # make this an aggregate
-        mx = float(qs0[0])
-
-        qs = qs.annotate(unique_user_count=Count('submission__user', distinct=True))  
-        # fix braindamage in excluding CE  
-        qs = qs.annotate(submission_volume=Count(Case(
-                When(submission__result='AC', then=1),
-                When(submission__result='WA', then=1),
-                When(submission__result='IR', then=1),
-                When(submission__result='RTE', then=1),
-                When(submission__result='TLE', then=1),
-                When(submission__result='OLE', then=1),
-                output_field=FloatField(),
-            )))
-        qs = qs.annotate(ac_volume=Count(Case(
-                When(submission__result='AC', then=1),
-                output_field=FloatField(),
-            )))
-        qs = qs.filter(unique_user_count__gt=max(mx / 3.0, 1))
-
-        qs = qs.annotate(ordering=ExpressionWrapper(0.5 * F('points') * (0.4 * F('ac_volume') / F('submission_volume') + 0.6 * F('ac_rate')) + 100 * e ** (F('unique_user_count') / mx), output_field=FloatField())).order_by('-ordering').defer('description')[:limit]
-
-        cache.set(cache_key, qs, 900)
-    return qs
+    return cached_computation('hot_problems:%d:%d' % (duration.total_seconds(), limit),
+                              lambda: _hot_problems(duration, limit), 300)
+
+
+def _hot_problems(duration, limit):
+    # Distinct submitting users are estimated by merging the sketches of every hour in the window.
+    sketches, volumes, ac_volumes = defaultdict(list), defaultdict(int), defaultdict(int)
+    for problem, users, volume, ac_count in (
+            ProblemActivity.objects.filter(hour__gte=ProblemActivity.hour_of(timezone.now() - duration),
+                                           problem__is_public=True, problem__points__gt=3, problem__points__lt=25)
+            .values_list('problem_id', 'users', 'volume', 'ac_count').iterator()):
+        sketches[problem].append(users)
+        volumes[problem] += volume
+        ac_volumes[problem] += ac_count
+
+    user_counts = {problem: hll_count(problem_sketches) for problem, problem_sketches in sketches.iteritems()}
+    if not user_counts:
+        return []
+    mx = max(user_counts.itervalues())
+
+    def ordering(problem):
+        ac_volume_rate = float(ac_volumes[problem.id]) / volumes[problem.id] if volumes[problem.id] > 0 else 0
+        return 0.5 * problem.points * (0.4 * ac_volume_rate + 0.6 * problem.ac_rate) + \
+            100 * e ** (user_counts[problem.id] / mx)
+
+    problems = Problem.objects.filter(id__in=[problem for problem, count in user_counts.iteritems()
+                                              if count > max(mx / 3.0, 1)]).defer('description')
+    return sorted(problems, key=ordering, reverse=True)[:limit]
@@ -0,0 +1,110 @@
+from datetime import datetime
+
+import numpy as np
+from django.db.models import Count, Case, When, IntegerField, Max
+from django.utils.timezone import utc
+
+from judge.models import ContestParticipation, ContestSubmission, Submission
+from judge.performance_points import PP_BONUS_FUNCTION, PP_ENTRIES, PP_WEIGHT_TABLE
+
+__all__ = ['PROFILE_FIELDS', 'PROBLEM_FIELDS', 'PARTICIPATION_FIELDS',
+           'profile_stats', 'problem_stats', 'participation_stats']
+
+PROFILE_FIELDS = ('points', 'problem_count', 'performance_points')
+PROBLEM_FIELDS = ('submission_count', 'ac_count', 'user_count', 'ac_rate')
+PARTICIPATION_FIELDS = ('score', 'cumtime')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=utc)
+
+
+def _index(ids, values):
+    position = {id: i for i, id in enumerate(ids)}
+    return np.array([position[value] for value in values], dtype=np.intp)
+
+
+def _sum_by(index, weights, size):
+    return np.bincount(index, weights=weights, minlength=size) if len(index) else np.zeros(size)
+
+
+def profile_stats(profile_ids):
+    """Computes the fields of PROFILE_FIELDS for the given profiles from their submissions."""
+    size = len(profile_ids)
+    rows = list(Submission.objects.filter(user_id__in=profile_ids, problem__is_public=True, points__gt=0)
+                .values('user_id', 'problem_id').order_by().annotate(best=Max('points'))
+                .values_list('user_id', 'best'))
+    users = _index(profile_ids, [user for user, best in rows])
+    points = np.array([best for user, best in rows], dtype=np.float64)
+
+    # Order every user's best points from highest to lowest and find the rank of each one within its user,
+    # which selects its weight.
+    order = np.lexsort((-points, users))
+    users, points = users[order], points[order]
+    rank = np.arange(len(users))
+    if len(users):
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+        rank -= np.repeat(starts, np.diff(np.r_[starts, len(users)]))
+    weights = np.zeros(len(users))
+    counted = rank < PP_ENTRIES
+    weights[counted] = np.array(PP_WEIGHT_TABLE)[rank[counted]]
+
+    total = _sum_by(users, points, size)
+    count = np.bincount(users, minlength=size) if len(users) else np.zeros(size, dtype=np.intp)
+    weighted = _sum_by(users, points * weights, size)
+
+    solved = dict(Submission.objects.filter(user_id__in=profile_ids, problem__is_public=True, result='AC')
+                  .values('user_id').order_by().annotate(problems=Count('problem_id', distinct=True))
+                  .values_list('user_id', 'problems'))
+    bonus = np.array([PP_BONUS_FUNCTION(solved.get(id, 0)) for id in profile_ids], dtype=np.float64)
+    pp = weighted + bonus
+    return {id: (float(total[i]), int(count[i]), float(pp[i])) for i, id in enumerate(profile_ids)}
+
+
+def problem_stats(problem_ids):
+    """Computes the fields of PROBLEM_FIELDS for the given problems from their submissions."""
+    size = len(problem_ids)
+    counts = list(Submission.objects.filter(problem_id__in=problem_ids).values('problem_id').order_by()
+                  .annotate(submissions=Count('id'),
+                            accepted=Count(Case(When(result='AC', then=1), output_field=IntegerField())))
+                  .values_list('problem_id', 'submissions', 'accepted'))
+    index = _index(problem_ids, [problem for problem, submissions, accepted in counts])
+    submissions = np.zeros(size, dtype=np.int64)
+    accepted = np.zeros(size, dtype=np.int64)
+    submissions[index] = [row[1] for row in counts]
+    accepted[index] = [row[2] for row in counts]
+
+    users = np.zeros(size, dtype=np.int64)
+    user_counts = list(Submission.objects.filter(problem_id__in=problem_ids, points__gt=0)
+                       .values('problem_id').order_by().annotate(users=Count('user_id', distinct=True))
+                       .values_list('problem_id', 'users'))
+    users[_index(problem_ids, [problem for problem, count in user_counts])] = [count for _, count in user_counts]
+
+    ac_rate = 100.0 * accepted / np.maximum(submissions, 1)
+    return {id: (int(submissions[i]), int(accepted[i]), int(users[i]), float(ac_rate[i]))
+            for i, id in enumerate(problem_ids)}
+
+
+def participation_stats(participation_ids):
+    """Computes the fields of PARTICIPATION_FIELDS for the given participations from their submissions."""
+    size = len(participation_ids)
+    submissions = ContestSubmission.objects.filter(participation_id__in=participation_ids) \
+                                           .values('participation_id', 'problem_id').order_by()
+
+    best = list(submissions.annotate(best=Max('points')).values_list('participation_id', 'best'))
+    score = _sum_by(_index(participation_ids, [participation for participation, points in best]),
+                    np.array([points for participation, points in best], dtype=np.float64), size)
+
+    # Each participation starts at ContestParticipation.start, which is the contest's start time unless the
+    # contest has a time limit or the participation is virtual.
+    starts = {id: contest_start if time_limit is None and not virtual > 0 else real_start
+              for id, real_start, virtual, contest_start, time_limit in
+              ContestParticipation.objects.filter(id__in=participation_ids)
+                                  .values_list('id', 'real_start', 'virtual', 'contest__start_time',
+                                               'contest__time_limit')}
+    start = np.array([(starts[id] - EPOCH).total_seconds() for id in participation_ids])
+
+    last = list(submissions.filter(points__gt=0).annotate(last=Max('submission__date'))
+                .values_list('participation_id', 'last'))
+    index = _index(participation_ids, [participation for participation, date in last])
+    elapsed = np.array([(date - EPOCH).total_seconds() for participation, date in last]) - start[index]
+    cumtime = _sum_by(index, elapsed, size)
+    return {id: (int(score[i]), int(cumtime[i])) for i, id in enumerate(participation_ids)}
@@ -4,9 +4,10 @@ from django.db.models import Prefetch, F
 from django.http import JsonResponse, Http404
 from django.shortcuts import get_object_or_404
 
-from dmoj import settings
 from judge.models import Contest, Problem, Profile, Submission, ContestTag
-from judge.views.contests import contest_access_check, base_contest_ranking_list
+from judge.problem_search import get_problem_search, problem_query
+from judge.scoreboard import get_scoreboard
+from judge.views.contests import contest_access_check
 
 
 def sane_time_repr(delta):
@@ -35,9 +36,6 @@ def api_v1_contest_detail(request, contest):
 
     problems = list(contest.contest_problems.select_related('problem')
                     .defer('problem__description').order_by('order'))
-    users = base_contest_ranking_list(contest, problems, contest.users.filter(virtual=0)
-                                      .prefetch_related('user__organizations')
-                                      .order_by('-score', 'cumtime'))
     return JsonResponse({
         'time_limit': contest.time_limit and contest.time_limit.total_seconds(),
         'start_time': contest.start_time.isoformat(),
@@ -52,23 +50,27 @@ def api_v1_contest_detail(request, contest):
             } for problem in problems],
         'rankings': [
             {
-                'user': user.user.username,
-                'points': user.points,
-                'cumtime': user.cumtime,
+                'user': entry.username,
+                'points': entry.points,
+                'cumtime': entry.cumtime,
                 'solutions': [{
-                                  'points': int(sol.points),
-                                  'time': sol.time.total_seconds()
-                              } if sol else None for sol in user.problems]
-            } for user in users]
+                                  'points': int(entry.cells[problem.id][0]),
+                                  'time': entry.cells[problem.id][1]
+                              } if problem.id in entry.cells else None for problem in problems]
+            } for entry in get_scoreboard(contest)]
     })
 
 
 def api_v1_problem_list(request):
     queryset = Problem.objects.filter(is_public=True)
-    if settings.ENABLE_FTS and 'search' in request.GET:
+    if 'search' in request.GET:
         query = ' '.join(request.GET.getlist('search')).strip()
         if query:
-            queryset = queryset.search(query)
+            search = get_problem_search()
+            if search is not None:
+                queryset = queryset.filter(id__in=search.search(query, full_text=True))
+            else:
+                queryset = queryset.filter(problem_query(query, full_text=True)).distinct()
     queryset = queryset.values_list('code', 'points', 'partial', 'name', 'group__full_name')
 
     return JsonResponse({code: {
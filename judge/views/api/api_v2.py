@@ -1,13 +1,12 @@
-from operator import attrgetter
-
-from django.db.models import Prefetch, F, Max
+from django.db.models import Prefetch, F
 from django.http import JsonResponse, Http404
 from django.shortcuts import get_object_or_404
 
 from dmoj import settings
-from judge.models import Contest, Problem, Profile, Submission, ContestTag, ContestParticipation
-from judge.utils.ranker import ranker
-from judge.views.contests import contest_access_check, base_contest_ranking_list, contest_ranking_list
+from judge.models import Contest, Problem, Profile, ContestTag, ContestParticipation, BestResult
+from judge.rank_index import get_rank_index
+from judge.scoreboard import get_scoreboard
+from judge.views.contests import contest_access_check, base_contest_ranking_list
 
 
 def error(message):
@@ -22,6 +21,8 @@ def api_v2_user_info(request):
         "points": 100.0,
         "rating": 2452,
         "rank": "user",
+        "performance_points_rank": 12,
+        "rating_rank": 3,
         "organizations": [],
         "solved_problems": ["ccc14s4", ...],
         "attempted_problems": [
@@ -61,28 +62,33 @@ def api_v2_user_info(request):
 
     resp = {
         "rank": profile.display_rank,
+        "performance_points_rank": get_rank_index('performance_points').rank(profile.performance_points),
+        "rating_rank": get_rank_index('rating').rank(profile.rating) if profile.rating is not None else None,
         "organizations": list(profile.organizations.values_list('key', flat=True))
     }
 
     contest_history = []
     for participation in (ContestParticipation.objects.filter(user=profile, virtual=0, contest__is_public=True)
-                                  .order_by('-contest__end_time')):
+                          .select_related('contest', 'rating').prefetch_related('contest__tags')
+                          .order_by('-contest__end_time')):
         contest = participation.contest
-
-        problems = list(contest.contest_problems.select_related('problem').defer('problem__description').order_by('order'))
-        rank, result = filter(lambda data: data[1].user == profile.user, ranker(contest_ranking_list(contest, problems), key=attrgetter('points', 'cumtime')))[0]
+        rank = participation.rank
+        if rank is None:
+            # The ranks of ended contests are stored by update_contest_ranks; until then, use the scoreboard.
+            scoreboard = get_scoreboard(contest)
+            rank = scoreboard.rank(participation.id) if participation.id in scoreboard.entries else None
 
         contest_history.append({
             'contest': {
                 'code': contest.key,
                 'name': contest.name,
-                'tags': list(contest.tags.values_list('name', flat=True)),
+                'tags': [tag.name for tag in contest.tags.all()],
                 'time_limit': contest.time_limit and contest.time_limit.total_seconds(),
                 'start_time': contest.start_time.isoformat(),
                 'end_time': contest.end_time.isoformat(),
             },
             'rank': rank,
-            'rating': result.participation_rating,
+            'rating': participation.rating.rating if hasattr(participation, 'rating') else None,
         })
 
     resp['contests'] = {
@@ -94,10 +100,8 @@ def api_v2_user_info(request):
     solved_problems = []
     attempted_problems = []
 
-    problem_data = (Submission.objects.filter(points__gt=0, user=profile, problem__is_public=True)
-                    .annotate(max_pts=Max('points'))
-                    .values_list('max_pts', 'problem__points', 'problem__code')
-                    .distinct())
+    problem_data = (BestResult.objects.filter(points__gt=0, user=profile, problem__is_public=True)
+                    .values_list('points', 'problem__points', 'problem__code'))
     for awarded_pts, max_pts, problem in problem_data:
         if awarded_pts == max_pts:
             solved_problems.append(problem)
@@ -6,14 +6,15 @@ from operator import attrgetter
 
 from datetime import timedelta, date, datetime, time
 from django import forms
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ImproperlyConfigured
+from django.core.paginator import InvalidPage
 from django.core.urlresolvers import reverse
-from django.db import connection, IntegrityError
+from django.db import IntegrityError
 from django.db.models import Q, Min, Max, Count
-from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -24,11 +25,14 @@ from django.views.generic import ListView, TemplateView
 from django.views.generic.detail import BaseDetailView, DetailView
 
 from judge import event_poster as event
+from judge.caching import cached_computation, get_generation
 from judge.comments import CommentedDetailView
-from judge.models import Contest, ContestParticipation, ContestTag, Profile
+from judge.models import Contest, ContestParticipation, ContestProblemResult, ContestTag, Profile
 from judge.models import Problem
-from judge.timezone import from_database_time
-from judge.utils.opengraph import generate_opengraph
+from judge.ratings import get_provisional_ratings
+from judge.scoreboard import get_scoreboard, get_timeline
+from judge.utils.diggpaginator import DiggPaginator
+from judge.utils.opengraph import contest_opengraph
 from judge.utils.ranker import ranker
 from judge.utils.views import TitleMixin, generic_message
 
@@ -142,8 +146,7 @@ class ContestMixin(object):
         context['is_organizer'] = self.is_organizer
 
         if not self.object.og_image or not self.object.summary:
-            metadata = generate_opengraph('generated-meta-contest:%d' % self.object.id,
-                                          self.object.description, 'contest')
+            metadata = contest_opengraph(self.object)
         context['meta_description'] = self.object.summary or metadata[0]
         context['og_image'] = self.object.og_image or metadata[1]
 
@@ -390,15 +393,12 @@ class ContestCalendar(TitleMixin, ContestListMixin, TemplateView):
 
 
 class CachedContestCalendar(ContestCalendar):
-    def render(self):
-        key = 'contest_cal:%d:%d' % (self.year, self.month)
-        cached = cache.get(key)
-        if cached is not None:
-            return HttpResponse(cached)
-        response = super(CachedContestCalendar, self).render()
-        response.render()
-        cached.set(key, response.content)
-        return response
+    def get_contest_data(self, start, end):
+        # Only anonymous users all see the same contests.
+        if self.request.user.is_authenticated:
+            return super(CachedContestCalendar, self).get_contest_data(start, end)
+        key = 'contest_cal:%d:%d:%d' % (self.year, self.month, get_generation('contest', 'calendar'))
+        return cached_computation(key, lambda: super(CachedContestCalendar, self).get_contest_data(start, end), 3600)
 
 
 class ContestRankingProfile(namedtuple(
@@ -438,20 +438,14 @@ def best_solution_state(points, total):
 
 
 def base_contest_ranking_list(contest, problems, queryset, for_user=None):
-    cursor = connection.cursor()
-    cursor.execute('''
-        SELECT part.id, cp.id, prob.code, MAX(cs.points) AS best, MAX(sub.date) AS `last`
-        FROM judge_contestproblem cp CROSS JOIN judge_contestparticipation part INNER JOIN
-             judge_problem prob ON (cp.problem_id = prob.id) LEFT OUTER JOIN
-             judge_contestsubmission cs ON (cs.problem_id = cp.id AND cs.participation_id = part.id) LEFT OUTER JOIN
-             judge_submission sub ON (sub.id = cs.submission_id)
-        WHERE cp.contest_id = %s AND part.contest_id = %s {extra}
-        GROUP BY cp.id, part.id
-    '''.format(extra=('AND part.user_id = %s' if for_user is not None else
-                                         'AND part.virtual = 0')),
-                   (contest.id, contest.id) + ((for_user,) if for_user is not None else ()))
-    data = {(part, prob): (code, best, last and from_database_time(last)) for part, prob, code, best, last in cursor}
-    cursor.close()
+    results = ContestProblemResult.objects.filter(problem__contest=contest)
+    if for_user is not None:
+        results = results.filter(participation__user_id=for_user)
+    else:
+        results = results.filter(participation__virtual=0)
+    data = {(part, prob): (code, best, last) for part, prob, code, best, last in
+            results.values_list('participation_id', 'problem_id', 'problem__problem__code', 'points',
+                                'last_submission')}
 
     problems = map(attrgetter('id', 'points', 'is_pretested'), problems)
 
@@ -469,17 +463,31 @@ def base_contest_ranking_list(contest, problems, queryset, for_user=None):
                .defer('user__about', 'user__organizations__about'))
 
 
+def scoreboard_ranking_list(contest, problems, entries):
+    participations = contest.users.select_related('user__user', 'rating').prefetch_related('user__organizations') \
+                            .defer('user__about', 'user__organizations__about') \
+                            .in_bulk([entry.id for entry in entries])
+
+    def make_ranking_profile(entry):
+        # The order comes from the scoreboard, so its points and time are shown to keep the ranks consistent.
+        return make_contest_ranking_profile(participations[entry.id], [
+            BestSolutionData(code=problem.problem.code, points=entry.cells[problem.id][0],
+                             time=timedelta(seconds=entry.cells[problem.id][1]),
+                             state=best_solution_state(entry.cells[problem.id][0], problem.points),
+                             is_pretested=problem.is_pretested)
+            if problem.id in entry.cells else None for problem in problems
+        ])._replace(points=entry.points, cumtime=entry.cumtime)
+
+    return [make_ranking_profile(entry) for entry in entries if entry.id in participations]
+
+
 def contest_ranking_list(contest, problems):
-    return base_contest_ranking_list(contest, problems, contest.users.filter(virtual=0)
-                                     .prefetch_related('user__organizations')
-                                     .order_by('-score', 'cumtime'))
+    return scoreboard_ranking_list(contest, problems, get_scoreboard(contest))
 
 
 def get_participation_ranking_profile(contest, participation, problems):
-    scoring = {data['id']: (data['score'], data['time']) for data in
-               contest.contest_problems.filter(submission__participation=participation)
-                   .annotate(score=Max('submission__points'), time=Max('submission__submission__date'))
-                   .values('score', 'time', 'id')}
+    scoring = {problem: (points, last) for problem, points, last in
+               participation.results.values_list('problem_id', 'points', 'last_submission')}
 
     return make_contest_ranking_profile(participation, [
         BestSolutionData(code=problem.problem.code, points=scoring[problem.id][0],
@@ -496,26 +504,156 @@ def get_contest_ranking_list(request, contest, participation=None, ranking_list=
     users = ranker(ranking_list(contest, problems), key=attrgetter('points', 'cumtime'))
 
     if show_current_virtual:
-        if participation is None and request.user.is_authenticated:
-            participation = request.user.profile.current_contest
-            if participation is None or participation.contest_id != contest.id:
-                participation = None
+        if participation is None:
+            participation = get_current_participation(request, contest)
         if participation is not None and participation.virtual:
-            users = chain([('-', get_participation_ranking_profile(contest, participation, problems))], users)
+            # Rank virtual participants against the live ones at the same time into the contest.
+            rank = '-'
+            if participation.virtual > 0 and contest.ended:
+                rank = get_timeline(contest).rank(get_participation_elapsed(participation), participation.score,
+                                                  participation.cumtime)
+            users = chain([(rank, get_participation_ranking_profile(contest, participation, problems))], users)
     return users, problems
 
 
+def get_current_participation(request, contest):
+    if not request.user.is_authenticated:
+        return None
+    participation = request.user.profile.current_contest
+    if participation is None or participation.contest_id != contest.id:
+        return None
+    return participation
+
+
+def get_participation_elapsed(participation):
+    """Returns the number of seconds since the start of the participation, up to the end of its contest."""
+    return (min(timezone.now(), participation.end_time) - participation.start).total_seconds()
+
+
+def get_ranking_window(request, scoreboard):
+    """
+    Selects the scoreboard entries asked for by the query string. The scoreboard is first narrowed down to an
+    organization and to usernames, if given, and then either a few rows around a user or a page of it is taken.
+    Returns the entries, the page if the ranking was paginated, and the query string for the links to other pages.
+    """
+    entries = scoreboard
+    params = request.GET.copy()
+    params.pop('page', None)
+
+    organization = request.GET.get('organization')
+    if organization:
+        try:
+            members = set(Profile.organizations.through.objects.filter(organization_id=int(organization))
+                                 .values_list('profile_id', flat=True))
+        except ValueError:
+            raise Http404()
+        entries = [entry for entry in entries if entry.user_id in members]
+
+    usernames = set(request.GET.getlist('user'))
+    if usernames:
+        entries = [entry for entry in entries if entry.username in usernames]
+
+    around = request.GET.get('around')
+    if around:
+        for index, entry in enumerate(entries):
+            if entry.username == around:
+                break
+        else:
+            index = None
+        if index is not None:
+            radius = getattr(settings, 'DMOJ_CONTEST_RANKING_WINDOW', 15)
+            return entries[max(0, index - radius):index + radius + 1], None, None
+
+    paginator = DiggPaginator(entries, getattr(settings, 'DMOJ_CONTEST_RANKING_PAGE_SIZE', 100), body=6, padding=2)
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except InvalidPage:
+        raise Http404()
+    return page.object_list, page, params.urlencode()
+
+
+def get_ranking_elapsed(request, contest, participation=None):
+    """
+    Returns the number of seconds into the contest that the ranking should be shown at, which is either given
+    in minutes by the query string or, for a virtual participant, their own time into the contest. Rankings of
+    contests that have not ended are always current, since their timelines would be rebuilt after every grading.
+    """
+    if not contest.ended:
+        return None
+    if 'time' in request.GET:
+        try:
+            return int(request.GET['time']) * 60
+        except ValueError:
+            raise Http404()
+    if participation is None:
+        participation = get_current_participation(request, contest)
+    if participation is not None and participation.virtual > 0:
+        return get_participation_elapsed(participation)
+    return None
+
+
+def get_contest_ranking_window(request, contest, participation=None):
+    scoreboard = get_scoreboard(contest)
+    elapsed = get_ranking_elapsed(request, contest, participation)
+    if elapsed is not None:
+        timeline = get_timeline(contest)
+        scoreboard = timeline.scoreboard(elapsed, scoreboard)
+    entries, page, query = get_ranking_window(request, scoreboard)
+    if elapsed is not None:
+        entries = timeline.cells(elapsed, entries)
+    users, problems = get_contest_ranking_list(
+        request, contest, participation,
+        ranking_list=lambda contest, problems: scoreboard_ranking_list(contest, problems, entries),
+        ranker=lambda users, key: ((scoreboard.rank(user.participation.id), user) for user in users))
+    return users, problems, {
+        'ranking_time': timedelta(seconds=elapsed) if elapsed is not None else None,
+        'page_obj': page,
+        'page_prefix': '?%s%spage=' % (query, '&' if query else '') if page is not None else None,
+    }
+
+
 def contest_ranking_ajax(request, contest, participation=None):
     contest, exists = _find_contest(request, contest)
     if not exists:
         return HttpResponseBadRequest('Invalid contest', content_type='text/plain')
 
-    users, problems = get_contest_ranking_list(request, contest, participation)
-    return render(request, 'contest/ranking-table.html', {
+    users, problems, window = get_contest_ranking_window(request, contest, participation)
+    context = {
         'users': users,
         'problems': problems,
         'contest': contest,
         'has_rating': contest.ratings.exists(),
+    }
+    context.update(get_rating_change_context(contest, context['has_rating']))
+    return render(request, 'contest/ranking-table.html', context)
+
+
+def get_rating_change_context(contest, has_rating):
+    """Returns the provisional rating changes of a rated contest that is not rated yet, if they are computed."""
+    provisional = get_provisional_ratings(contest) if contest.is_rated and not has_rating else None
+    return {
+        'rating_changes_time': provisional[0] if provisional is not None else None,
+        'rating_changes': provisional[1] if provisional is not None else None,
+    }
+
+
+def contest_rating_changes(request, contest):
+    contest, exists = _find_contest(request, contest)
+    if not exists:
+        return contest
+    contest_access_check(request, contest)
+    if not contest.is_rated or contest.ratings.exists():
+        raise Http404()
+    provisional = get_provisional_ratings(contest)
+    if provisional is None:
+        raise Http404()
+
+    time, changes = provisional
+    usernames = dict(contest.users.filter(id__in=changes).values_list('id', 'user__user__username'))
+    return JsonResponse({
+        'time': time.isoformat(),
+        'users': {usernames[id]: {'old_rating': old, 'new_rating': new}
+                  for id, (old, new) in changes.iteritems() if id in usernames},
     })
 
 
@@ -529,7 +667,7 @@ def contest_access_check(request, contest):
 
 def contest_ranking_view(request, contest, participation=None):
     contest_access_check(request, contest)
-    users, problems = get_contest_ranking_list(request, contest, participation)
+    users, problems, window = get_contest_ranking_window(request, contest, participation)
 
     context = {
         'users': users,
@@ -541,6 +679,7 @@ def contest_ranking_view(request, contest, participation=None):
         'has_rating': contest.ratings.exists(),
         'tab': 'ranking',
     }
+    context.update(get_rating_change_context(contest, context['has_rating']))
 
     # TODO: use ContestMixin when this becomes a class-based view
     if request.user.is_authenticated:
@@ -563,6 +702,10 @@ def contest_ranking_view(request, contest, participation=None):
         context['participation'] = None
         context['in_contest'] = False
     context['now'] = timezone.now()
+    context.update(window)
+    context['ranking_filtered'] = any(key in request.GET for key in ('organization', 'user', 'around', 'time'))
+    if request.user.is_authenticated:
+        context['ranking_organizations'] = request.user.profile.organizations.only('id', 'short_name')
 
     return render(request, 'contest/ranking.html', context)
 
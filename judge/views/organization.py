@@ -1,14 +1,10 @@
-from itertools import chain
-
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.cache import cache
-from django.core.cache.utils import make_template_fragment_key
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
 from django.db import transaction
-from django.db.models import Count, Max
+from django.db.models import Count
 from django.forms import Form, modelformset_factory
 from django.http import HttpResponseRedirect, Http404
 from django.shortcuts import get_object_or_404
@@ -19,8 +15,9 @@ from reversion import revisions
 
 from judge.forms import EditOrganizationForm
 from judge.models import Organization, OrganizationRequest, Profile
-from judge.utils.ranker import ranker
-from judge.utils.views import generic_message, TitleMixin
+from judge.rank_index import RankedProfileList
+from judge.utils.diggpaginator import DiggPaginator, InvalidPage
+from judge.utils.views import generic_message, paginate_query_context, TitleMixin
 
 __all__ = ['OrganizationList', 'OrganizationHome', 'OrganizationUsers', 'OrganizationMembershipChange',
            'JoinOrganization', 'LeaveOrganization', 'EditOrganization', 'RequestJoinOrganization',
@@ -77,18 +74,23 @@ class OrganizationHome(OrganizationMixin, DetailView):
 
 class OrganizationUsers(OrganizationMixin, DetailView):
     template_name = 'organization/users.html'
+    paginate_by = 100
 
     def get_context_data(self, **kwargs):
         context = super(OrganizationUsers, self).get_context_data(**kwargs)
         context['title'] = _('%s Members') % self.object.name
-        context['users'] = ranker(chain(*[
-            i.select_related('user').defer('about') for i in (
-                self.object.members.filter(submission__points__gt=0).order_by('-performance_points')
-                    .annotate(problems=Count('submission__problem', distinct=True)),
-                self.object.members.annotate(problems=Max('submission__points')).filter(problems=0),
-                self.object.members.annotate(problems=Count('submission__problem', distinct=True)).filter(problems=0),
-            )
-        ]))
+
+        # Members are ranked by performance points from the organization's rank index, a page at a time.
+        members = RankedProfileList(self.object.members.order_by('-performance_points', 'id').select_related('user')
+                                    .defer('about'), '-performance_points', self.object.id)
+        paginator = DiggPaginator(members, self.paginate_by, body=6, padding=2)
+        try:
+            page = paginator.page(self.request.GET.get('page', 1), softlimit=True)
+        except InvalidPage:
+            page = paginator.page(1)
+        context['users'] = [(members.rank(user), user) for user in page.object_list]
+        context['page_obj'] = page
+        context.update(paginate_query_context(self.request))
         context['partial'] = True
         context['is_admin'] = self.can_edit_organization()
         context['kick_url'] = reverse('organization_user_kick', args=[self.object.key])
@@ -115,7 +117,6 @@ class JoinOrganization(OrganizationMembershipChange):
             return generic_message(request, _('Joining organization'), _('This organization is not open.'))
         profile.organizations.add(org)
         profile.save()
-        cache.delete(make_template_fragment_key('org_member_count', (org.id,)))
 
 
 class LeaveOrganization(OrganizationMembershipChange):
@@ -123,7 +124,6 @@ class LeaveOrganization(OrganizationMembershipChange):
         if not profile.organizations.filter(id=org.id).exists():
             return generic_message(request, _('Leaving organization'), _('You are not in "%s".') % org.key)
         profile.organizations.remove(org)
-        cache.delete(make_template_fragment_key('org_member_count', (org.id,)))
 
 
 class OrganizationRequestForm(Form):
@@ -235,7 +235,6 @@ class OrganizationRequestView(OrganizationRequestBaseView):
             messages.success(request,
                              ungettext('Approved %d user.', 'Approved %d users.', approved) % approved + '\n' +
                              ungettext('Rejected %d user.', 'Rejected %d users.', rejected) % rejected)
-            cache.delete(make_template_fragment_key('org_member_count', (organization.id,)))
             return HttpResponseRedirect(request.get_full_path())
         return self.render_to_response(self.get_context_data(object=organization))
 
@@ -8,13 +8,13 @@ from datetime import timedelta
 from operator import itemgetter
 from random import randrange
 
+import numpy as np
 from django.conf import settings
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.core.urlresolvers import reverse
 from django.db import IntegrityError
-from django.db.models import Count, Q, F, Prefetch
-from django.db.utils import ProgrammingError
+from django.db.models import Count, Prefetch
 from django.http import Http404, HttpResponseRedirect, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render, get_object_or_404
 from django.template.loader import get_template
@@ -34,8 +34,10 @@ from judge.forms import ProblemSubmitForm
 from judge.models import Problem, Submission, ContestSubmission, ContestProblem, Language, ProblemGroup, Solution, \
     ProblemTranslation, TranslatedProblemForeignKeyQuerySet, RuntimeVersion, ProblemType
 from judge.pdf_problems import HAS_PDF, DefaultPdfMaker
+from judge.problem_catalog import ProblemCatalogList, get_problem_catalog
+from judge.problem_search import get_problem_search, problem_query
 from judge.utils.diggpaginator import DiggPaginator
-from judge.utils.opengraph import generate_opengraph
+from judge.utils.opengraph import problem_opengraph
 from judge.utils.problems import contest_completed_ids, user_completed_ids, contest_attempted_ids, user_attempted_ids, \
     hot_problems
 from judge.utils.strings import safe_int_or_none, safe_float_or_none
@@ -194,8 +196,7 @@ class ProblemDetail(ProblemMixin, SolvedProblemMixin, CommentedDetailView):
             context['translated'] = True
 
         if not self.object.og_image or not self.object.summary:
-            metadata = generate_opengraph('generated-meta-problem:%s:%d' % (context['language'], self.object.id),
-                                          context['description'], 'problem')
+            metadata = problem_opengraph(self.object, context['language'], context['description'])
         context['meta_description'] = self.object.summary or metadata[0]
         context['og_image'] = self.object.og_image or metadata[1]
         return context
@@ -278,39 +279,17 @@ class ProblemList(QueryStringSortMixin, TitleMixin, SolvedProblemMixin, ListView
                       allow_empty_first_page=True, **kwargs):
         paginator = DiggPaginator(queryset, per_page, body=6, padding=2, orphans=orphans,
                                   allow_empty_first_page=allow_empty_first_page, **kwargs)
-        if not self.in_contest:
-            # Get the number of pages and then add in this magic.
-            # noinspection PyStatementEffect
-            paginator.num_pages
-
-            queryset = queryset.add_i18n_name(self.request.LANGUAGE_CODE)
+        if not self.in_contest and not self.by_relevance:
             sort_key = self.order.lstrip('-')
-            if sort_key in self.sql_sort:
-                queryset = queryset.order_by(self.order)
-            elif sort_key == 'name':
-                queryset = queryset.order_by(self.order.replace('name', 'i18n_name'))
-            elif sort_key == 'group':
-                queryset = queryset.order_by(self.order + '__name')
-            elif sort_key == 'solved':
+            if sort_key == 'solved':
                 if self.request.user.is_authenticated:
                     profile = self.request.user.profile
-                    solved = user_completed_ids(profile)
-                    attempted = user_attempted_ids(profile)
-
-                    def _solved_sort_order(problem):
-                        if problem.id in solved:
-                            return 1
-                        if problem.id in attempted:
-                            return 0
-                        return -1
-
-                    queryset = list(queryset)
-                    queryset.sort(key=_solved_sort_order, reverse=self.order.startswith('-'))
-            elif sort_key == 'type':
-                if self.show_types:
-                    queryset = list(queryset)
-                    queryset.sort(key=lambda problem: problem.types_list[0] if problem.types_list else '',
-                                  reverse=self.order.startswith('-'))
+                    queryset = queryset.order_by_key(
+                        get_problem_catalog().solved_rank(user_completed_ids(profile), user_attempted_ids(profile)),
+                        self.order.startswith('-'),
+                    )
+            elif sort_key != 'type' or self.show_types:
+                queryset = queryset.order_by(self.order, self.request.LANGUAGE_CODE)
             paginator.object_list = queryset
         return paginator
 
@@ -341,41 +320,48 @@ class ProblemList(QueryStringSortMixin, TitleMixin, SolvedProblemMixin, ListView
                                    'problem__group__full_name', 'points', 'partial', 'user_count')]
 
     def get_normal_queryset(self):
-        filter = Q(is_public=True)
+        # Problems are filtered and sorted in the catalog, and only the rows of the shown page are queried.
+        catalog = get_problem_catalog()
+        visible = catalog.is_public.copy()
         if self.profile is not None:
-            filter |= Q(
-                id__in=Problem.objects.annotate(contest_user_count=Count('contest__users'))
-                              .filter(contest__users=self.profile.current_contest_id,
-                                      contest_user_count__gt=0).values('id').distinct()
-            )
-            filter |= Q(authors=self.profile)
-            filter |= Q(curators=self.profile)
-            filter |= Q(testers=self.profile)
-        queryset = Problem.objects.filter(filter).select_related('group').defer('description')
-        if self.profile is not None and self.hide_solved:
-            queryset = queryset.exclude(id__in=Submission.objects.filter(user=self.profile, points=F('problem__points'))
-                                        .values_list('problem__id', flat=True))
-        if self.show_types:
-            queryset = queryset.prefetch_related('types')
+            visible |= catalog.editable_by(self.profile.id)
+            if self.profile.current_contest_id is not None:
+                visible |= catalog.contains(Problem.objects.filter(contest__users=self.profile.current_contest_id)
+                                            .values_list('id', flat=True))
+            if self.hide_solved:
+                visible &= ~catalog.contains(user_completed_ids(self.profile))
         if self.category is not None:
-            queryset = queryset.filter(group__id=self.category)
+            visible &= catalog.group == self.category
         if self.selected_types:
-            queryset = queryset.filter(types__in=self.selected_types)
+            visible &= catalog.has_any_type(self.selected_types)
+        matches = None
         if 'search' in self.request.GET:
             self.search_query = query = ' '.join(self.request.GET.getlist('search')).strip()
             if query:
-                if settings.ENABLE_FTS and self.full_text:
-                    queryset = queryset.search(query, queryset.BOOLEAN).extra(order_by=['-relevance'])
+                search = get_problem_search()
+                if search is not None:
+                    matches = catalog.positions(search.search(query, full_text=self.full_text))
+                    found = np.zeros(len(catalog), dtype=np.bool_)
+                    found[matches] = True
+                    visible &= found
                 else:
-                    queryset = queryset.filter(
-                        Q(code__icontains=query) | Q(name__icontains=query) |
-                        Q(translations__name__icontains=query, translations__language=self.request.LANGUAGE_CODE))
-        self.prepoint_queryset = queryset
+                    visible &= catalog.contains(Problem.objects.filter(problem_query(query, self.full_text))
+                                                .values_list('id', flat=True))
+        self.prepoint_points = catalog.points[visible]
         if self.point_start is not None:
-            queryset = queryset.filter(points__gte=self.point_start)
+            visible &= catalog.points >= self.point_start
         if self.point_end is not None:
-            queryset = queryset.filter(points__lte=self.point_end)
-        return queryset.distinct()
+            visible &= catalog.points <= self.point_end
+
+        queryset = Problem.objects.select_related('group').defer('description') \
+            .add_i18n_name(self.request.LANGUAGE_CODE)
+        if self.show_types:
+            queryset = queryset.prefetch_related('types')
+        if matches is not None and 'order' not in self.request.GET:
+            # Search results are shown from the best match down unless another order is asked for.
+            self.by_relevance = True
+            return ProblemCatalogList(catalog, matches[visible[matches]], queryset)
+        return ProblemCatalogList(catalog, np.flatnonzero(visible), queryset)
 
     def get_queryset(self):
         if self.in_contest:
@@ -393,7 +379,6 @@ class ProblemList(QueryStringSortMixin, TitleMixin, SolvedProblemMixin, ListView
         if self.show_types:
             context['selected_types'] = self.selected_types
             context['problem_types'] = ProblemType.objects.all()
-        context['has_fts'] = settings.ENABLE_FTS
         context['search_query'] = self.search_query
         context['completed_problem_ids'] = self.get_completed_problems()
         context['attempted_problems'] = self.get_attempted_problems()
@@ -409,7 +394,7 @@ class ProblemList(QueryStringSortMixin, TitleMixin, SolvedProblemMixin, ListView
         return context
 
     def get_noui_slider_points(self):
-        points = sorted(self.prepoint_queryset.values_list('points', flat=True).distinct())
+        points = np.unique(self.prepoint_points).tolist()
         if not points:
             return 0, 0, {}
         if len(points) == 1:
@@ -438,6 +423,7 @@ class ProblemList(QueryStringSortMixin, TitleMixin, SolvedProblemMixin, ListView
         self.full_text = self.GET_with_session(request, 'full_text')
 
         self.search_query = None
+        self.by_relevance = False
         self.category = None
         self.selected_types = []
 
@@ -459,10 +445,7 @@ class ProblemList(QueryStringSortMixin, TitleMixin, SolvedProblemMixin, ListView
     def get(self, request, *args, **kwargs):
         self.setup(request)
 
-        try:
-            return super(ProblemList, self).get(request, *args, **kwargs)
-        except ProgrammingError as e:
-            return generic_message(request, 'FTS syntax error', e.args[1], status=400)
+        return super(ProblemList, self).get(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
         to_update = ('hide_solved', 'show_types', 'full_text')
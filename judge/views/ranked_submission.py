@@ -4,7 +4,7 @@ from django.db.models.expressions import RawSQL
 from django.utils.html import format_html
 from django.utils.translation import ugettext as _
 
-from judge.models import Submission
+from judge.models import BestResult, Submission
 from judge.utils.problems import get_result_table
 from judge.views.submission import ProblemSubmissions, ForceContestMixin
 
@@ -16,15 +16,15 @@ class RankedSubmissions(ProblemSubmissions):
     dynamic_update = False
 
     def get_queryset(self):
-        if self.in_contest:
-            contest_join = '''INNER JOIN judge_contestsubmission AS cs ON (sub.id = cs.submission_id)
-                              INNER JOIN judge_contestparticipation AS cp ON (cs.participation_id = cp.id)'''
-            points = 'cs.points'
-            constraint = 'AND cp.contest_id = %s'
-        else:
-            contest_join = ''
-            points = 'sub.points'
-            constraint = ''
+        if not self.in_contest:
+            return super(RankedSubmissions, self).get_queryset().filter(
+                id__in=BestResult.objects.filter(problem=self.problem, points__gt=0).values('submission_id')
+            ).order_by('-points', 'time')
+
+        contest_join = '''INNER JOIN judge_contestsubmission AS cs ON (sub.id = cs.submission_id)
+                          INNER JOIN judge_contestparticipation AS cp ON (cs.participation_id = cp.id)'''
+        points = 'cs.points'
+        constraint = 'AND cp.contest_id = %s'
         queryset = super(RankedSubmissions, self).get_queryset().filter(id__in=RawSQL(
                 '''
                     SELECT sub.id
@@ -46,14 +46,10 @@ class RankedSubmissions(ProblemSubmissions):
                     WHERE sub.problem_id = %s AND {points} > 0 {constraint}
                     GROUP BY fastest.uid
                 '''.format(points=points, contest_join=contest_join, constraint=constraint),
-                (self.problem.id, self.contest.id) * 3 if self.in_contest else (self.problem.id,) * 3,
+                (self.problem.id, self.contest.id) * 3,
                 output_field=IntegerField()))
         queryset.query.group_by = ['user_id']
-
-        if self.in_contest:
-            return queryset.order_by('-contest__points', 'time')
-        else:
-            return queryset.order_by('-points', 'time')
+        return queryset.order_by('-contest__points', 'time')
 
     def get_title(self):
         return _('Best solutions for %s') % self.problem_name
@@ -1,3 +1,4 @@
+import numpy as np
 from django.db.models import Q, F
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
@@ -6,6 +7,8 @@ from django.views.generic.list import BaseListView
 
 from judge.models import Profile, Organization, Problem, Comment, Contest
 from judge.jinja2.gravatar import gravatar
+from judge.problem_catalog import ProblemCatalogList, get_problem_catalog
+from judge.problem_search import get_problem_search, problem_query
 
 
 def _get_user_queryset(term):
@@ -54,13 +57,28 @@ class OrganizationSelect2View(Select2View):
 
 class ProblemSelect2View(Select2View):
     def get_queryset(self):
-        queryset = Problem.objects.filter(Q(code__icontains=self.term) | Q(name__icontains=self.term))
+        catalog = get_problem_catalog()
+        if self.term.strip():
+            search = get_problem_search()
+            if search is not None:
+                positions = catalog.positions(search.search(self.term))
+                # Words only match from their start, so codes containing the term elsewhere follow the matches.
+                codes = catalog.positions(list(Problem.objects.filter(code__icontains=self.term)
+                                               .values_list('id', flat=True)))
+                codes = codes[~np.in1d(codes, positions)]
+                positions = np.concatenate((positions, catalog.order(codes, catalog.code_rank)))
+            else:
+                positions = catalog.positions(list(Problem.objects.filter(problem_query(self.term))
+                                                   .values_list('id', flat=True).distinct()))
+                positions = catalog.order(positions, catalog.code_rank)
+        else:
+            positions = catalog.order(np.arange(len(catalog)), catalog.code_rank)
         if not self.request.user.has_perm('judge.see_private_problem'):
-            filter = Q(is_public=True)
+            visible = catalog.is_public.copy()
             if self.request.user.is_authenticated:
-                filter |= Q(authors=self.request.user.profile) | Q(curators=self.request.user.profile)
-            queryset = queryset.filter(filter).distinct()
-        return queryset.distinct()
+                visible |= catalog.editable_by(self.request.user.profile.id)
+            positions = positions[visible[positions]]
+        return ProblemCatalogList(catalog, positions, Problem.objects.all())
 
 
 class ContestSelect2View(Select2View):
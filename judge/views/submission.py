@@ -220,6 +220,7 @@ class SubmissionsListBase(DiggPaginatorMixin, TitleMixin, ListView):
         context['completed_problem_ids'] = user_completed_ids(self.request.user.profile) if authenticated else []
         context['authored_problem_ids'] = user_authored_ids(self.request.user.profile) if authenticated else []
         context['editable_problem_ids'] = user_editable_ids(self.request.user.profile) if authenticated else []
+        Problem.prefetch_access([submission.problem for submission in context['submissions']], self.request.user)
 
         context['all_languages'] = Language.objects.all().values_list('key', 'name')
         context['selected_languages'] = self.selected_languages
@@ -26,11 +26,11 @@ from django.views.generic import DetailView, ListView, TemplateView
 from reversion import revisions
 
 from judge.forms import ProfileForm, newsletter_id
-from judge.models import Profile, Submission, Rating
+from judge.models import Profile, Rating, BestResult
 from judge.performance_points import get_pp_breakdown, PP_ENTRIES
+from judge.rank_index import RankedProfileList, get_rank_index
 from judge.ratings import rating_class, rating_progress
 from judge.utils.problems import contest_completed_ids, user_completed_ids
-from judge.utils.ranker import ranker
 from judge.utils.subscription import Subscription
 from judge.utils.views import TitleMixin, generic_message, DiggPaginatorMixin, QueryStringSortMixin
 from .contests import contest_ranking_view
@@ -99,11 +99,12 @@ class UserPage(TitleMixin, UserMixin, DetailView):
         rating = self.object.ratings.order_by('-contest__end_time')[:1]
         context['rating'] = rating[0] if rating else None
 
-        context['rank'] = Profile.objects.filter(performance_points__gt=self.object.performance_points).count() + 1
+        context['rank'] = get_rank_index('performance_points').rank(self.object.performance_points)
 
         if rating:
-            context['rating_rank'] = Profile.objects.filter(rating__gt=self.object.rating).count() + 1
-            context['rated_users'] = Profile.objects.filter(rating__isnull=False).count()
+            ratings = get_rank_index('rating')
+            context['rating_rank'] = ratings.rank(self.object.rating)
+            context['rated_users'] = len(ratings)
         context.update(self.object.ratings.aggregate(min_rating=Min('rating'), max_rating=Max('rating'),
                                                      contests=Count('contest')))
         return context
@@ -153,10 +154,10 @@ class UserProblemsPage(UserPage):
     def get_context_data(self, **kwargs):
         context = super(UserProblemsPage, self).get_context_data(**kwargs)
 
-        result = Submission.objects.filter(user=self.object, points__gt=0, problem__is_public=True) \
+        result = BestResult.objects.filter(user=self.object, points__gt=0, problem__is_public=True) \
             .exclude(problem__id__in=self.get_completed_problems() if self.hide_solved else []) \
-            .values('problem__id', 'problem__code', 'problem__name', 'problem__points', 'problem__group__full_name') \
-            .distinct().annotate(points=Max('points')).order_by('problem__group__full_name', 'problem__code')
+            .values('problem__id', 'problem__code', 'problem__name', 'problem__points', 'problem__group__full_name',
+                    'points').order_by('problem__group__full_name', 'problem__code')
 
         def process_group(group, problems_iter):
             problems = list(problems_iter)
@@ -262,13 +263,13 @@ class UserList(QueryStringSortMixin, DiggPaginatorMixin, TitleMixin, ListView):
     default_sort = '-performance_points'
 
     def get_queryset(self):
-        return (Profile.objects.order_by(self.order, 'id').select_related('user')
-                .only('display_rank', 'user__username', 'name', 'points', 'rating', 'performance_points',
-                      'problem_count'))
+        return RankedProfileList(Profile.objects.order_by(self.order, 'id').select_related('user')
+                                 .only('display_rank', 'user__username', 'name', 'points', 'rating',
+                                       'performance_points', 'problem_count'), self.order)
 
     def get_context_data(self, **kwargs):
         context = super(UserList, self).get_context_data(**kwargs)
-        context['users'] = ranker(context['users'], rank=self.paginate_by * (context['page_obj'].number - 1))
+        context['users'] = [(self.object_list.rank(user), user) for user in context['users']]
         context['first_page_href'] = '.'
         context.update(self.get_sort_context())
         context.update(self.get_sort_paginate_context())
@@ -292,8 +293,7 @@ def user_ranking_redirect(request):
     except KeyError:
         raise Http404()
     user = get_object_or_404(Profile, user__username=username)
-    rank = Profile.objects.filter(performance_points__gt=user.performance_points).count()
-    rank += Profile.objects.filter(performance_points__exact=user.performance_points, id__lt=user.id).count()
+    rank = get_rank_index('performance_points').position(user.id, user.performance_points)
     page = rank // UserList.paginate_by
     return HttpResponseRedirect('%s%s#!%s' % (reverse('user_list'), '?page=%d' % (page + 1) if page else '', username))
 